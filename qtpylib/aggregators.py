@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Day, Tick
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# how bar columns are resampled (same as ``tools.resample()``)
+BAR_AGGREGATES = {
+    'open':           'first',
+    'high':           'max',
+    'low':            'min',
+    'close':          'last',
+    'volume':         'sum',
+    'opt_price':      'last',
+    'opt_underlying': 'last',
+    'opt_dividend':   'last',
+    'opt_volume':     'last',
+    'opt_iv':         'last',
+    'opt_oi':         'last',
+    'opt_delta':      'last',
+    'opt_gamma':      'last',
+    'opt_theta':      'last',
+    'opt_vega':       'last'
+}
+
+_META = ('symbol', 'symbol_group', 'asset_class')
+
+
+class BarBuilder():
+    """Streaming 1-minute OHLCV bar builder (one instance per symbol)
+
+    Updates the open bar in constant time and returns the finished
+    bar once a tick from a different minute arrives. Emits the same
+    bars as the Blotter's original pandas resampler did: the tick that
+    rolls the minute opens the new bar, but is replaced by the next tick
+    of that minute (bars are built from the ticks that follow it), and
+    the very first tick of a symbol is emitted as a bar of its own.
+    """
+
+    __slots__ = ('minute', 'open', 'high', 'low', 'close', 'volume',
+                 '_replace')
+
+    def __init__(self):
+        self.minute = None
+        self.open = None
+        self.high = None
+        self.low = None
+        self.close = None
+        self.volume = 0
+        self._replace = False
+
+    # -------------------------------------------
+    def _reset(self, minute, price, size):
+        self.minute = minute
+        self.open = self.high = self.low = self.close = price
+        self.volume = size
+
+    def as_tuple(self):
+        return (self.minute, self.open, self.high,
+                self.low, self.close, self.volume)
+
+    # -------------------------------------------
+    def update(self, timestamp, price, size):
+        """ add a tick to the bar
+
+        :Parameters:
+            timestamp : datetime
+                Tick time
+            price : float
+                Tick price
+            size : int
+                Tick size
+
+        :Returns:
+            bar : tuple
+                ``(minute, open, high, low, close, volume)`` of a finished
+                bar, or ``None`` while the bar is still open
+        """
+        minute = timestamp.replace(second=0, microsecond=0)
+
+        # first tick for symbol
+        if self.minute is None:
+            self._reset(minute, price, size)
+            self._replace = True
+            return self.as_tuple()
+
+        # same minute
+        if minute == self.minute:
+            if self._replace:
+                self._reset(minute, price, size)
+                self._replace = False
+            else:
+                self.high = max(self.high, price)
+                self.low = min(self.low, price)
+                self.close = price
+                self.volume += size
+            return None
+
+        # late tick from an earlier minute
+        if minute < self.minute:
+            self._replace = True
+            return (minute, price, price, price, price, size)
+
+        # minute rolled - emit and start a new bar
+        bar = self.as_tuple()
+        self._reset(minute, price, size)
+        self._replace = True
+        return bar
+
+
+# ---------------------------------------------
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+class BarResampler():
+    """Streaming bar resampler, eg. 1-minute bars into 5-minute bars
+    (one instance per symbol)
+
+    Folds each bar into the open (current period's) bar in constant
+    time. Returns the same bars as resampling the open bar along with
+    each new one using ``tools.resample()``: bars are labelled by the
+    start of their period (aligned to midnight of the first bar's day),
+    empty periods between two bars are filled with the previous close
+    (and no volume), and a bar with the same timestamp as the open bar
+    is ignored.
+
+    :Parameters:
+        resolution : str
+            Pandas resolution of a fixed period (eg. 5T, 1H, 1D)
+
+    :Optional:
+        complete_only : bool
+            Drop bars with missing values (like ``tools.resample()``
+            does with options). Default is False
+    """
+
+    def __init__(self, resolution, complete_only=False):
+        offset = to_offset(resolution)
+        if not isinstance(offset, Tick):
+            raise ValueError("Cannot stream bars of %s" % resolution)
+
+        self.resolution = resolution
+        self.complete_only = complete_only
+        self._period = pd.Timedelta(offset)
+        # (days are local days, even around DST changes)
+        self._daily = isinstance(offset, Day)
+
+        self.start = None
+        self.bar = None
+        self._origin = None
+
+    # -------------------------------------------
+    def seed(self, timestamp, bar):
+        """ sets the open bar (eg. the last resampled bar) """
+        self.start = pd.Timestamp(timestamp)
+        self.bar = self._row(bar, {})
+        self._origin = self.start.normalize()
+
+    def _period_start(self, timestamp):
+        origin = self._origin
+        tz = timestamp.tz
+        if self._daily and tz is not None:
+            timestamp = timestamp.tz_localize(None)
+            origin = origin.tz_localize(None)
+
+        start = origin + ((timestamp - origin) // self._period) * self._period
+        if self._daily and tz is not None:
+            start = start.tz_localize(tz)
+        return start
+
+    def _next(self, start):
+        if self._daily and start.tz is not None:
+            return (start.tz_localize(None) + self._period
+                    ).tz_localize(start.tz)
+        return start + self._period
+
+    @staticmethod
+    def _row(bar, previous):
+        """ a bar's resampled columns (``previous`` is the open bar) """
+        row = {}
+        for name in sorted(set(previous) | set(bar)):
+            how = BAR_AGGREGATES.get(name)
+            if how is None:
+                if name in _META:
+                    row[name] = bar.get(name, previous.get(name))
+                continue
+
+            old, new = previous.get(name, np.nan), bar.get(name, np.nan)
+            if _missing(old):
+                value = 0 if how == "sum" and _missing(new) else new
+            elif _missing(new):
+                value = old
+            elif how == "first":
+                value = old
+            elif how == "max":
+                value = max(old, new)
+            elif how == "min":
+                value = min(old, new)
+            elif how == "sum":
+                value = old + new
+            else:
+                value = new
+            row[name] = value
+
+        if "volume" in row and not _missing(row["volume"]):
+            row["volume"] = int(row["volume"])
+        return row
+
+    def _complete(self, row):
+        return not self.complete_only or not any(
+            _missing(value) for value in row.values())
+
+    # -------------------------------------------
+    def update(self, timestamp, bar):
+        """ add a bar
+
+        :Parameters:
+            timestamp : pd.Timestamp
+                Bar time
+            bar : dict
+                Bar data (open, high, low, close, volume, symbol, etc.)
+
+        :Returns:
+            bars : list
+                ``(timestamp, bar)`` tuples of new bars and of bars to
+                replace (the open bar is always last), may be empty
+        """
+        timestamp = pd.Timestamp(timestamp)
+
+        # first bar
+        if self.start is None:
+            self._origin = timestamp.normalize()
+            start = self._period_start(timestamp)
+            row = self._row(bar, {})
+            if not self._complete(row):
+                return []
+            self.start, self.bar = start, row
+            return [(start, row)]
+
+        # already resampled
+        if timestamp == self.start:
+            return [(self.start, self.bar)]
+
+        start = self._period_start(timestamp)
+
+        # same period
+        if start == self.start:
+            row = self._row(bar, self.bar)
+            if not self._complete(row):
+                return []
+            self.bar = row
+            return [(start, row)]
+
+        # late bar (of an earlier period) is resampled on its own
+        if start < self.start:
+            row = self._row(bar, {})
+            return [(start, row)] if self._complete(row) else []
+
+        # new period
+        row = self._row(bar, {})
+        bars = []
+        fill = self._next(self.start)
+        if fill < start:
+            # empty periods: previous close (and values), no volume
+            close = self.bar.get("close")
+            empty = dict(self.bar)
+            empty.update({name: close for name in
+                          ("open", "high", "low", "close")
+                          if name in empty})
+            if "volume" in empty:
+                empty["volume"] = 0
+            while fill < start:
+                bars.append((fill, dict(empty)))
+                fill = self._next(fill)
+
+            # (missing values of the new bar are filled as well)
+            for name, value in row.items():
+                if _missing(value) and name in empty:
+                    row[name] = empty[name]
+            if "volume" in row and row["volume"] <= 0:
+                row.update({name: row["close"] for name in
+                            ("open", "high", "low") if name in row})
+
+        bars = [(fill, empty) for fill, empty in bars
+                if self._complete(empty)]
+        if self._complete(row):
+            self.start, self.bar = start, row
+            bars.append((start, row))
+        return bars
@@ -34,6 +34,10 @@ from numpy import nan
 from qtpylib.broker import Broker
 from qtpylib.workflow import validate_columns as validate_csv_columns
 from qtpylib.blotter import prepare_history
+from qtpylib.orderbook import OrderBook
+from qtpylib.backtest import BacktestRunner
+from qtpylib.aggregators import BarResampler
+from qtpylib.windows import WindowStore
 from qtpylib import (
     tools, sms, asynctools
 )
@@ -95,6 +99,12 @@ class Algo(Broker):
             Path to the directory with QTPyLib-compatible CSV files (Backtest)
         output: str
             Path to save the recorded data (default: None)
+        slippage: float
+            Price slippage of backtest market/stop fills (default: 0)
+        commission: float
+            Backtest commission per share/contract (default: 0)
+        latency: float
+            Seconds before backtest orders can be filled (default: 0)
         ibport: int
             IB TWS/GW Port to use (default: 4001)
         ibclient: int
@@ -109,7 +119,7 @@ class Algo(Broker):
                  tick_window=1, bar_window=100, timezone="UTC", preload=None,
                  continuous=True, blotter=None, sms=None, log=None,
                  backtest=False, start=None, end=None, data=None, output=None,
-                 ibclient=998, ibport=4001, ibserver="localhost", **kwargs):
+                 slippage=0, commission=0, latency=0, ibclient=998, ibport=4001, ibserver="localhost", **kwargs):
 
         # detect algo name
         self.name = str(self.__class__).split('.')[-1].split("'")[0]
@@ -129,12 +139,11 @@ class Algo(Broker):
 
         # -----------------------------------
         # assign algo params
-        self.bars = pd.DataFrame()
-        self.ticks = pd.DataFrame()
         self.quotes = {}
         self.books = {}
+        self._order_books = {}
         self.tick_count = 0
-        self.tick_bar_count = 0
+        self.tick_bar_counts = {}
         self.bar_count = 0
         self.bar_hashes = {}
 
@@ -143,6 +152,16 @@ class Algo(Broker):
             self.tick_window = 1000
         self.bar_window = bar_window if bar_window > 0 else 100
         self.resolution = resolution.upper().replace("MIN", "T")
+
+        # per-symbol tick/bar windows (tick/volume bars
+        # are made of all the ticks since the last bar)
+        self._ticks = WindowStore(
+            None if self.resolution[-1] in ("S", "K", "V")
+            else self.tick_window)
+        self._bars = WindowStore(self.bar_window)
+
+        # per-symbol streaming resamplers (see _update_window)
+        self._resamplers = {}
         self.timezone = timezone
         self.preload = preload
         self.continuous = continuous
@@ -154,6 +173,13 @@ class Algo(Broker):
         self.backtest_end = self.args["end"]
         self.backtest_csv = self.args["data"]
 
+        # backtest order execution (see qtpylib.simulator)
+        self.simulator_args = {
+            "slippage": self.args["slippage"],
+            "commission": self.args["commission"],
+            "latency": self.args["latency"],
+        }
+
         # -----------------------------------
         self.sms_numbers = self.args["sms"]
         self.trade_log_dir = self.args["log"]
@@ -204,7 +230,9 @@ class Algo(Broker):
         # initilize output file
         self.record_ts = None
         if self.record_output:
-            self.datastore = tools.DataStore(self.args["output"])
+            # (backtests save it once done)
+            self.datastore = tools.DataStore(
+                self.args["output"], autosave=not self.backtest)
 
         # ---------------------------------------
         # add stale ticks for more accurate time--based bars
@@ -217,18 +245,42 @@ class Algo(Broker):
         self.threads = asynctools.multitasking.getPool(__name__)['threads']
 
 
+    # ---------------------------------------
+    @property
+    def ticks(self):
+        """ all symbols' ticks (built on access, use
+        ``Instrument.get_ticks()`` for a single symbol) """
+        return self._ticks.frame()
+
+    @ticks.setter
+    def ticks(self, data):
+        self._ticks.load(data)
+
+    @property
+    def bars(self):
+        """ all symbols' bars (built on access, use
+        ``Instrument.get_bars()`` for a single symbol) """
+        return self._bars.frame()
+
+    @bars.setter
+    def bars(self, data):
+        self._bars.load(data)
+        self._resamplers = {}
+
     # ---------------------------------------
     def add_stale_tick(self):
-        ticks = self.ticks.copy()
-        if self.ticks.empty:
+        last_tick = self._ticks.last_index()
+        if last_tick is None:
             return
 
         last_tick_sec = float(tools.datetime64_to_datetime(
-            ticks.index.values[-1]).strftime('%M.%S'))
+            last_tick.to_datetime64()).strftime('%M.%S'))
 
-        for sym in list(self.ticks["symbol"].unique()):
-            tick = ticks[ticks['symbol'] ==
-                         sym][-5:].to_dict(orient='records')[-1]
+        for sym in self._ticks.symbols:
+            ticks = self._ticks.frame(sym, lookback=1)
+            if ticks.empty:
+                continue
+            tick = ticks.to_dict(orient='records')[-1]
             tick['timestamp'] = datetime.utcnow()
 
             if last_tick_sec != float(tick['timestamp'].strftime("%M.%S")):
@@ -272,6 +324,15 @@ class Algo(Broker):
                             help='Path to backtester CSV files')
         parser.add_argument('--output', default=self.args["output"],
                             help='Path to save the recorded data')
+        parser.add_argument('--slippage', default=self.args["slippage"],
+                            help='Slippage of backtest market/stop fills',
+                            type=float)
+        parser.add_argument('--commission', default=self.args["commission"],
+                            help='Backtest commission per share/contract',
+                            type=float)
+        parser.add_argument('--latency', default=self.args["latency"],
+                            help='Seconds before backtest orders can fill',
+                            type=float)
         parser.add_argument('--blotter',
                             help='Log trades to this Blotter\'s MySQL')
         parser.add_argument('--continuous', default=self.args["continuous"],
@@ -286,12 +347,13 @@ class Algo(Broker):
         return args
 
     # ---------------------------------------
-    def run(self):
-        """Starts the algo
+    def load_history(self):
+        """Loads the history to backtest (or to preload)
+        from the CSV files/Blotter
 
-        Connects to the Blotter, processes market data and passes
-        tick data to the ``on_tick`` function and bar data to the
-        ``on_bar`` methods.
+        :Returns:
+            history : pd.DataFrame
+                Prepared ticks/bars of all symbols
         """
 
         history = pd.DataFrame()
@@ -340,20 +402,22 @@ class Algo(Broker):
             if self.backtest_end:
                 history = history[history.index <= self.backtest_end]
 
-        elif not self.blotter_args["dbskip"] and (
-                self.backtest or self.preload):
+        elif (not self.blotter_args["dbskip"] or self.blotter_args.get(
+                "storage") == "archive") and (self.backtest or self.preload):
 
             start = self.backtest_start if self.backtest else tools.backdate(
                 self.preload)
             end = self.backtest_end if self.backtest else None
 
+            # (cached locally - only new rows are loaded from the db)
             history = self.blotter.history(
                 symbols=self.symbols,
                 start=start,
                 end=end,
                 resolution=self.resolution,
                 tz=self.timezone,
-                continuous=self.continuous
+                continuous=self.continuous,
+                cache=True
             )
 
             # history needs backfilling?
@@ -363,19 +427,21 @@ class Algo(Broker):
                 self.blotter.ibConn = self.ibConn
 
                 # call the back fill
-                self.blotter.backfill(data=history,
-                                      resolution=self.resolution,
-                                      start=start, end=end)
-
-                # re-get history from db
-                history = self.blotter.history(
-                    symbols=self.symbols,
-                    start=start,
-                    end=end,
-                    resolution=self.resolution,
-                    tz=self.timezone,
-                    continuous=self.continuous
-                )
+                backfilled = self.blotter.backfill(
+                    data=history, resolution=self.resolution,
+                    start=start, end=end)
+
+                # re-get history from db (if anything was backfilled)
+                if backfilled:
+                    history = self.blotter.history(
+                        symbols=self.symbols,
+                        start=start,
+                        end=end,
+                        resolution=self.resolution,
+                        tz=self.timezone,
+                        continuous=self.continuous,
+                        cache="refresh"
+                    )
 
                 # take our ibConn back :)
                 self.blotter.ibConn = None
@@ -386,14 +452,32 @@ class Algo(Broker):
             history['symbol_group'] = history['symbol_group'].astype('category')
             history['asset_class'] = history['asset_class'].astype('category')
 
+        return history
+
+    # ---------------------------------------
+    def run(self, history=None):
+        """Starts the algo
+
+        Connects to the Blotter, processes market data and passes
+        tick data to the ``on_tick`` function and bar data to the
+        ``on_bar`` methods.
+
+        :Optional:
+            history : pd.DataFrame
+                Already loaded history to use (eg. by the optimizer,
+                see ``load_history()``)
+        """
+        if history is None:
+            history = self.load_history()
+
         if self.backtest:
             # initiate strategy
             self.on_start()
 
-            # drip history
-            drip_handler = self._tick_handler if self.resolution[-1] in (
-                "S", "K", "V") else self._bar_handler
-            self.blotter.drip(history, drip_handler)
+            # run history through the (non threaded) handlers
+            handler = self._base_tick_handler if self.resolution[-1] in (
+                "S", "K", "V") else self._base_bar_handler
+            self._run_backtest(history, handler)
 
         else:
             # place history self.bars
@@ -415,6 +499,25 @@ class Algo(Broker):
                 book_handler=self._book_handler
             )
 
+    # ---------------------------------------
+    def _run_backtest(self, history, handler):
+        runner = BacktestRunner(handler, logger=self.log_algo)
+        try:
+            stats = runner.run(history)
+            self.log_algo.info(
+                "Backtest completed: %d events in %.2fs (%d/sec)",
+                stats["events"], stats["seconds"], stats["rate"])
+
+        except (KeyboardInterrupt, SystemExit):
+            print("\n\n>>> Interrupted with Ctrl-c...\n")
+            sys.exit(1)
+
+        finally:
+            # in case the strategy started any tasks
+            asynctools.multitasking.wait_for_tasks()
+            if self.record_output:
+                self.datastore.save()
+
     # ---------------------------------------
     @abstractmethod
     def on_start(self):
@@ -602,8 +705,7 @@ class Algo(Broker):
             except Exception as e:
                 pass
 
-            if not self.backtest:
-                self._create_order(**kwargs)
+            self._create_order(**kwargs)
 
         else:
             if quantity == 0:
@@ -624,8 +726,7 @@ class Algo(Broker):
             except Exception as e:
                 pass
 
-            if not self.backtest:
-                self._create_order(**kwargs)
+            self._create_order(**kwargs)
 
     # ---------------------------------------
     def cancel_order(self, orderId):
@@ -682,12 +783,32 @@ class Algo(Broker):
         return caller in stack
 
     # ---------------------------------------
-    @asynctools.multitasking.task
     def _book_handler(self, book):
         symbol = book['symbol']
-        del book['symbol']
-        del book['kind']
 
+        # snapshots/deltas: rebuild the book locally (in order,
+        # before handing it over to a task)
+        if "seq" in book:
+            local = self._order_books.get(symbol)
+            if local is None:
+                local = self._order_books.setdefault(symbol, OrderBook())
+
+            # waiting for a snapshot?
+            if not local.apply(book):
+                return
+
+            data = local.to_dict()
+            data["symbol_group"] = book.get("symbol_group")
+            data["asset_class"] = book.get("asset_class")
+            book = data
+        else:
+            del book['symbol']
+            del book['kind']
+
+        self._on_book(symbol, book)
+
+    @asynctools.multitasking.task
+    def _on_book(self, symbol, book):
         self.books[symbol] = book
         self.on_orderbook(self.get_instrument(symbol))
 
@@ -698,40 +819,15 @@ class Algo(Broker):
         self.quotes[quote['symbol']] = quote
         self.on_quote(self.get_instrument(quote))
 
-    # ---------------------------------------
-    @staticmethod
-    def _get_window_per_symbol(df, window):
-        # truncate tick window per symbol
-        dfs = []
-        for sym in list(df["symbol"].unique()):
-            dfs.append(df[df['symbol'] == sym][-window:])
-        return pd.concat(dfs, sort=True).sort_index()
-
-
-    # ---------------------------------------
-    @staticmethod
-    def _thread_safe_merge(symbol, basedata, newdata):
-        data = newdata
-        if "symbol" in basedata.columns:
-            data = pd.concat(
-                [basedata[basedata['symbol'] != symbol], data], sort=True)
-
-        data.loc[:, '_idx_'] = data.index
-        data = data.drop_duplicates(
-            subset=['_idx_', 'symbol', 'symbol_group', 'asset_class'],
-            keep='last')
-        data = data.drop('_idx_', axis=1)
-        data = data.sort_index()
-
-        try:
-            return data.dropna(subset=[
-                'open', 'high', 'low', 'close', 'volume'])
-        except Exception as e:
-            return data
-
     # ---------------------------------------
     @asynctools.multitasking.task
     def _tick_handler(self, tick, stale_tick=False):
+        """ threaded version of _base_tick_handler (called by blotter's) """
+        self._base_tick_handler(tick, stale_tick)
+
+    # ---------------------------------------
+    def _base_tick_handler(self, tick, stale_tick=False):
+        """ non threaded tick handler (called by the backtest runner) """
         self._cancel_expired_pending_orders()
 
         # tick symbol
@@ -741,51 +837,39 @@ class Algo(Broker):
         symbol = symbol[0]
         self.last_price[symbol] = float(tick['last'].values[0])
 
-        # work on copy
-        self_ticks = self.ticks.copy()
-
         # initial value
         if self.record_ts is None:
             self.record_ts = tick.index[0]
 
-        if self.resolution[-1] not in ("S", "K", "V"):
-            if self.threads == 0:
-                self.ticks = self._update_window(
-                    self.ticks, tick, window=self.tick_window)
-            else:
-                self_ticks = self._update_window(
-                    self_ticks, tick, window=self.tick_window)
-                self.ticks = self._thread_safe_merge(
-                    symbol, self.ticks, self_ticks)  # assign back
-        else:
-            self.ticks = self._update_window(self.ticks, tick)
-            # bars = tools.resample(self.ticks, self.resolution)
+        self._ticks.append(tick)
+
+        # fill backtest orders
+        if self.simulator is not None and not stale_tick:
+            self.simulator.on_tick(
+                symbol, tick.index[0], self.last_price[symbol],
+                bid=tick['bid'].values[0] if 'bid' in tick.columns else None,
+                ask=tick['ask'].values[0] if 'ask' in tick.columns else None)
+
+        if self.resolution[-1] in ("S", "K", "V"):
             bars = tools.resample(
-                self.ticks, self.resolution, tz=self.timezone)
+                self._ticks.frame(symbol), self.resolution, tz=self.timezone)
 
-            if len(bars.index) > self.tick_bar_count > 0 or stale_tick:
+            tick_bar_count = self.tick_bar_counts.get(symbol, 0)
+            if len(bars.index) > tick_bar_count > 0 or stale_tick:
                 self.record_ts = tick.index[0]
-                self._base_bar_handler(bars[bars['symbol'] == symbol][-1:])
+                self._base_bar_handler(bars[-1:])
 
                 window = int(
                     "".join([s for s in self.resolution if s.isdigit()]))
-                if self.threads == 0:
-                    self.ticks = self._get_window_per_symbol(
-                        self.ticks, window)
-                else:
-                    self_ticks = self._get_window_per_symbol(
-                        self_ticks, window)
-                    self.ticks = self._thread_safe_merge(
-                        symbol, self.ticks, self_ticks)  # assign back
+                self._ticks.truncate(symbol, window)
 
-            self.tick_bar_count = len(bars.index)
+            self.tick_bar_counts[symbol] = len(bars.index)
 
             # record non time-based bars
             self.record(bars[-1:])
 
         if not stale_tick:
-            if self.ticks[(self.ticks['symbol'] == symbol) | (
-                    self.ticks['symbol_group'] == symbol)].empty:
+            if symbol not in self._ticks:
                 return
             tick_instrument = self.get_instrument(tick)
             if tick_instrument:
@@ -799,46 +883,30 @@ class Algo(Broker):
         if len(symbol) == 0:
             return
         symbol = symbol[0]
-        self_bars = self.bars.copy()  # work on copy
 
         is_tick_or_volume_bar = False
         handle_bar = True
 
         if self.resolution[-1] in ("S", "K", "V"):
             is_tick_or_volume_bar = True
-            handle_bar = self._caller("_tick_handler")
+            handle_bar = self._caller("_base_tick_handler")
 
         # drip is also ok
         handle_bar = handle_bar or self._caller("drip")
 
         if is_tick_or_volume_bar:
             # just add a bar (used by tick bar bandler)
-            if self.threads == 0:
-                self.bars = self._update_window(self.bars, bar,
-                                                window=self.bar_window)
-            else:
-                self_bars = self._update_window(self_bars, bar,
-                                                window=self.bar_window)
+            self._update_window(bar)
         else:
             # add the bar and resample to resolution
-            if self.threads == 0:
-                self.bars = self._update_window(self.bars, bar,
-                                                window=self.bar_window,
-                                                resolution=self.resolution)
-            else:
-                self_bars = self._update_window(self_bars, bar,
-                                                window=self.bar_window,
-                                                resolution=self.resolution)
-
-        # assign new data to self.bars if threaded
-        if self.threads > 0:
-            self.bars = self._thread_safe_merge(symbol, self.bars, self_bars)
+            self._update_window(bar, resolution=self.resolution)
 
-        # optimize pandas
-        if len(self.bars) == 1:
-            self.bars['symbol'] = self.bars['symbol'].astype('category')
-            self.bars['symbol_group'] = self.bars['symbol_group'].astype('category')
-            self.bars['asset_class'] = self.bars['asset_class'].astype('category')
+            # fill backtest orders
+            if self.simulator is not None:
+                self.simulator.on_bar(
+                    symbol, bar.index[0], bar['open'].values[0],
+                    bar['high'].values[0], bar['low'].values[0],
+                    bar['close'].values[0])
 
         # new bar?
         hash_string = bar[:1]['symbol'].to_string().translate(
@@ -851,8 +919,7 @@ class Algo(Broker):
         self.bar_hashes[symbol] = this_bar_hash
 
         if newbar and handle_bar:
-            if self.bars[(self.bars['symbol'] == symbol) | (
-                    self.bars['symbol_group'] == symbol)].empty:
+            if symbol not in self._bars:
                 return
             bar_instrument = self.get_instrument(symbol)
             if bar_instrument:
@@ -868,36 +935,60 @@ class Algo(Broker):
         self._base_bar_handler(bar)
 
     # ---------------------------------------
-    def _update_window(self, df, data, window=None, resolution=None):
-        if df is None:
-            df = data
-        else:
-            df = df.append(data, sort=True)
+    def _on_simulated_fill(self, order):
+        # record bracket exits (orders are recorded when placed)
+        if order['parentId']:
+            symbol = order['symbol']
+            try:
+                self.record({symbol+'_POSITION':
+                             self.simulator.position(symbol)[0]})
+            except Exception as e:
+                pass
 
-        # resample
+        super()._on_simulated_fill(order)
+
+    # ---------------------------------------
+    def _update_window(self, bar, resolution=None):
+        """ adds a bar to its symbol's window (replacing bars with the
+        same timestamp) """
         if resolution:
-            tz = str(df.index.tz)
-            # try:
-            #     tz = str(df.index.tz)
-            # except Exception as e:
-            #     tz = None
-            df = tools.resample(df, resolution=resolution, tz=tz)
+            if self._resample_bar(bar, resolution):
+                return
 
-        else:
-            # remove duplicates rows
-            # (handled by resample if resolution is provided)
-            df.loc[:, '_idx_'] = df.index
-            df.drop_duplicates(
-                subset=['_idx_', 'symbol', 'symbol_group', 'asset_class'],
-                keep='last', inplace=True)
-            df.drop('_idx_', axis=1, inplace=True)
-
-        # return
-        if window is None:
-            return df
-
-        # return df[-window:]
-        return self._get_window_per_symbol(df, window)
+            # (not a fixed period, eg. 1W) resample the symbol's
+            # last (incomplete?) bar with the new one
+            last = self._bars.frame(bar['symbol'].values[0], lookback=1)
+            data = bar.copy() if last.empty else pd.concat(
+                [last, bar], sort=True)
+            bar = tools.resample(data, resolution=resolution,
+                                 tz=str(data.index.tz))
+
+        self._bars.append(bar)
+
+    def _resample_bar(self, bar, resolution):
+        """ folds a bar into its symbol's open bar (O(1)), returns
+        False for resolutions that aren't a fixed period (eg. 1W) """
+        symbol = bar['symbol'].values[0]
+        resampler = self._resamplers.get(symbol)
+
+        if resampler is None:
+            try:
+                resampler = BarResampler(
+                    resolution, complete_only=symbol[-3:] in ("OPT", "FOP"))
+            except ValueError:
+                return False
+
+            # continue the window's last bar (eg. preloaded history)
+            last = self._bars.frame(symbol, lookback=1)
+            if not last.empty:
+                resampler.seed(last.index[0],
+                               last.to_dict(orient='records')[0])
+            self._resamplers[symbol] = resampler
+
+        for timestamp, row in resampler.update(
+                bar.index[0], dict(zip(bar.columns, bar.values[0]))):
+            self._bars.append_row(timestamp, row, bar.index.name)
+        return True
 
     # ---------------------------------------
     # signal logging methods
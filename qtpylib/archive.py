@@ -0,0 +1,779 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Columnar tick/bar archive (used by the Blotter when running with
+``--storage archive``, instead of MySQL).
+
+Data is stored as columnar segments, partitioned by table, date and
+symbol (bar rollups are stored as ``bars_{resolution}`` tables, see
+``qtpylib.rollups``)::
+
+    {path}/manifest.json
+    {path}/bars/2019-01-02/AAPL_STK/{first}-{last}-{pid}-{n}.col
+    {path}/bars_1H/2019-01-02/AAPL_STK/{first}-{last}-{pid}-{n}.col
+
+Each segment holds a small json header followed by each column's raw
+(numpy) data, with datetime as microseconds since epoch, so readers only
+load the columns they need. Its file name
+holds its first/last timestamps so readers can skip segments outside the
+requested time range. The manifest lists every partition along with
+the symbols' meta data (symbol group, asset class and expiry) and
+their coverage (see ``qtpylib.coverage``).
+"""
+
+import json
+import os
+import sys
+
+from datetime import datetime
+from struct import Struct
+from threading import Lock
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from qtpylib import protocol
+from qtpylib.dbwriter import DBWriter, tick_row, bar_row, greeks_row
+from qtpylib.rollups import (
+    SKIP_ASSET_CLASSES, archive_table, is_archive_table, merge_rollup,
+    period_start, resolution_seconds, rollup_bars
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+TABLES = {"TICK": "ticks", "BAR": "bars"}
+
+COLUMNS = {
+    "ticks": ('bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize'),
+    "bars": ('open', 'high', 'low', 'close', 'volume'),
+}
+
+GREEK_COLUMNS = ('opt_price', 'opt_underlying', 'opt_dividend', 'opt_volume',
+                 'opt_iv', 'opt_oi', 'opt_delta', 'opt_gamma', 'opt_theta',
+                 'opt_vega')
+
+INT_COLUMNS = frozenset(('bidsize', 'asksize', 'lastsize', 'volume'))
+
+_DAY = 86400 * 1000000
+
+SEGMENT_MAGIC = b"QTPYCOL1"
+_SEGMENT_HEAD = Struct('<8sI')
+
+
+# ---------------------------------------------
+def _micros(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert("UTC").tz_localize(None)
+    return protocol.to_micros(value.to_pydatetime())
+
+
+def table_columns(table):
+    """ data columns of a table (rollups have the bars' columns) """
+    if is_archive_table(table):
+        return COLUMNS["bars"]
+    return COLUMNS[table]
+
+
+def _date(micros):
+    return datetime.utcfromtimestamp(micros // _DAY * 86400).strftime(
+        "%Y-%m-%d")
+
+
+def write_segment(filename, columns):
+    """ writes a dict of equal-length column arrays to a segment file """
+    header = {"rows": len(columns["datetime"]), "columns": []}
+    arrays = []
+    offset = 0
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values)
+        header["columns"].append([name, values.dtype.str, offset])
+        arrays.append(values)
+        offset += values.nbytes
+
+    header = json.dumps(header).encode("utf-8")
+    with open(filename, "wb") as f:
+        f.write(_SEGMENT_HEAD.pack(SEGMENT_MAGIC, len(header)))
+        f.write(header)
+        for values in arrays:
+            f.write(values.tobytes())
+
+
+def read_segment(filename, columns=None):
+    """ reads columns (default: all) of a segment file into a dict """
+    with open(filename, "rb") as f:
+        magic, length = _SEGMENT_HEAD.unpack(f.read(_SEGMENT_HEAD.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError("Not an archive segment: %s" % filename)
+        header = json.loads(f.read(length).decode("utf-8"))
+        start = _SEGMENT_HEAD.size + length
+
+        data = {}
+        for name, dtype, offset in header["columns"]:
+            if columns is not None and name not in columns:
+                continue
+            f.seek(start + offset)
+            data[name] = np.fromfile(f, dtype=dtype, count=header["rows"])
+        return data
+
+
+# ---------------------------------------------
+class Archive():
+    """Reads and writes a columnar tick/bar archive
+
+    :Parameters:
+        path : str
+            Archive root directory (created if needed)
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = Lock()
+        self._manifest = None
+        self._manifest_mtime = None
+        self._counter = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    # -------------------------------------------
+    @property
+    def manifest_file(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def manifest(self):
+        """ returns the manifest (re-read when changed on disk) """
+        try:
+            mtime = os.stat(self.manifest_file).st_mtime_ns
+        except OSError:
+            return {"version": 1, "symbols": {}, "partitions": {}}
+
+        if self._manifest is None or mtime != self._manifest_mtime:
+            with open(self.manifest_file, "r") as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+
+        return self._manifest
+
+    def _register(self, partitions):
+        """ adds ``(table, date, symbol, meta)`` partitions to the manifest """
+        known = self.manifest()
+        partitions = [(table, date, symbol, meta)
+                      for table, date, symbol, meta in partitions
+                      if date not in known["partitions"].get(
+                          table, {}).get(symbol, ())]
+        if not partitions:
+            return
+
+        def register(manifest):
+            for table, date, symbol, meta in partitions:
+                manifest["symbols"].setdefault(symbol, meta)
+                dates = manifest["partitions"].setdefault(
+                    table, {}).setdefault(symbol, [])
+                if date not in dates:
+                    dates.append(date)
+                    dates.sort()
+
+        self._update_manifest(register)
+
+    def _update_manifest(self, func):
+        """ applies ``func(manifest)`` and saves the manifest """
+
+        # other processes (eg. an algo's backfill) may write too
+        with self._lock, open(os.path.join(
+                self.path, "manifest.lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            manifest = self.manifest()
+            func(manifest)
+
+            tmp = "%s.%d.tmp" % (self.manifest_file, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.manifest_file)
+
+    # -------------------------------------------
+    def coverage(self, resolution, symbol):
+        """ stored ``[start, end]`` intervals (see ``qtpylib.coverage``) """
+        return self.manifest().get("coverage", {}).get(
+            resolution, {}).get(symbol, [])
+
+    def update_coverage(self, resolution, symbol, func):
+        """ replaces a symbol's intervals with ``func(intervals)`` """
+        def update(manifest):
+            coverage = manifest.setdefault("coverage", {}).setdefault(
+                resolution, {})
+            coverage[symbol] = func(coverage.get(symbol, []))
+
+        self._update_manifest(update)
+
+    # -------------------------------------------
+    def partition_path(self, table, date, symbol):
+        return os.path.join(self.path, table, date,
+                            symbol.replace(os.sep, "-"))
+
+    def segments(self, table, date, symbol, start=None, end=None):
+        """ segment files of a partition overlapping ``start``-``end`` """
+        path = self.partition_path(table, date, symbol)
+        try:
+            names = sorted(name for name in os.listdir(path)
+                           if name.endswith(".col"))
+        except OSError:
+            return []
+
+        segments = []
+        for name in names:
+            first, last = map(int, name.split("-")[:2])
+            if (start is None or last >= start) and (
+                    end is None or first <= end):
+                segments.append(os.path.join(path, name))
+        return segments
+
+    # -------------------------------------------
+    def append(self, table, symbol, columns, meta=None):
+        """Writes rows of a symbol as new segment(s)
+
+        :Parameters:
+            table : str
+                ``ticks`` or ``bars``
+            symbol : str
+                Symbol (eg. ``AAPL_STK``)
+            columns : dict
+                Column arrays, including ``datetime`` (microseconds)
+
+        :Optional:
+            meta : dict
+                ``symbol_group``, ``asset_class`` and ``expiry``
+        """
+        columns = {name: np.asarray(values)
+                   for name, values in columns.items()}
+        if not len(columns["datetime"]):
+            return
+
+        # sort (stable, so duplicates keep their order)
+        order = np.argsort(columns["datetime"], kind="mergesort")
+        columns = {name: values[order] for name, values in columns.items()}
+
+        # split by date
+        days = columns["datetime"] // _DAY
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        partitions = []
+
+        for first, last in zip(np.r_[0, bounds], np.r_[bounds, len(days)]):
+            part = {name: values[first:last]
+                    for name, values in columns.items()}
+            date = _date(int(part["datetime"][0]))
+            path = self.partition_path(table, date, symbol)
+            os.makedirs(path, exist_ok=True)
+
+            with self._lock:
+                self._counter += 1
+                name = "%d-%d-%d-%d" % (part["datetime"][0],
+                                        part["datetime"][-1],
+                                        os.getpid(), self._counter)
+
+            # write to temp file, so readers never see partial segments
+            tmp = os.path.join(path, "." + name + ".tmp")
+            write_segment(tmp, part)
+            os.replace(tmp, os.path.join(path, name + ".col"))
+
+            partitions.append((table, date, symbol, meta or {}))
+
+        self._register(partitions)
+
+    # -------------------------------------------
+    def symbols(self, symbols, table, symbol_groups=None):
+        """ archived symbols matching symbols/symbol groups """
+        known = self.manifest()["symbols"]
+        archived = self.manifest()["partitions"].get(table, {})
+
+        if symbols is None or symbols[0].strip() == "*":
+            return sorted(archived)
+
+        symbols = set(symbol.strip() for symbol in symbols)
+        groups = set(symbol_groups or [])
+        return sorted(symbol for symbol in archived if symbol in symbols or
+                      known.get(symbol, {}).get("symbol_group") in groups)
+
+    # -------------------------------------------
+    def read(self, symbols, start, end=None, table="bars", columns=None,
+             symbol_groups=None):
+        """Reads ticks/bars into a DataFrame (in ``Blotter.history()``'s
+        raw format), touching only the needed partitions and columns
+
+        :Parameters:
+            symbols : list
+                Symbols to read (``["*"]`` for all)
+            start : str / datetime
+                Start time (UTC)
+
+        :Optional:
+            end : str / datetime
+                End time (UTC)
+            table : str
+                ``ticks`` or ``bars`` (default: bars)
+            columns : list
+                Data columns to read (default: all)
+            symbol_groups : list
+                Also read symbols of these groups (eg. for
+                continuous futures)
+
+        :Returns:
+            data : pd.DataFrame
+                Raw data (datetime as a column), sorted by time per symbol
+        """
+        if isinstance(symbols, str):
+            symbols = symbols.split(',')
+
+        start = _micros(start)
+        end = _micros(end)
+        start_day = _date(start) if start is not None else None
+        end_day = _date(end) if end is not None else None
+
+        if columns is None:
+            columns = table_columns(table) + GREEK_COLUMNS
+        columns = list(columns)
+
+        manifest = self.manifest()
+        wanted = set(["datetime"] + columns)
+
+        # one array per column for all symbols
+        parts = {name: [] for name in ["datetime"] + columns}
+        symbol_rows = []
+
+        for symbol in self.symbols(symbols, table, symbol_groups):
+            dates = [date for date in manifest["partitions"][table][symbol]
+                     if (start_day is None or date >= start_day) and (
+                         end_day is None or date <= end_day)]
+
+            chunks = []
+            for date in dates:
+                for segment in self.segments(table, date, symbol, start, end):
+                    chunk = read_segment(segment, wanted)
+                    times = chunk["datetime"]
+                    if (start is not None and times[0] < start) or (
+                            end is not None and times[-1] > end):
+                        mask = np.ones(len(times), dtype=bool)
+                        if start is not None:
+                            mask &= times >= start
+                        if end is not None:
+                            mask &= times <= end
+                        chunk = {name: values[mask]
+                                 for name, values in chunk.items()}
+                    if len(chunk["datetime"]):
+                        chunks.append(chunk)
+
+            if not chunks:
+                continue
+
+            data = {}
+            for name in parts:
+                if all(name in chunk for chunk in chunks):
+                    data[name] = np.concatenate(
+                        [chunk[name] for chunk in chunks])
+                elif not any(name in chunk for chunk in chunks):
+                    data[name] = np.full(sum(
+                        len(chunk["datetime"]) for chunk in chunks), np.nan)
+                else:
+                    data[name] = np.concatenate([
+                        chunk[name] if name in chunk else np.full(
+                            len(chunk["datetime"]), np.nan)
+                        for chunk in chunks])
+
+            # same as the db's unique (datetime, symbol) key:
+            # ticks are inserted once, bars are replaced
+            if np.any(np.diff(data["datetime"]) <= 0):
+                data = self._dedupe(data, table)
+
+            for name, values in data.items():
+                parts[name].append(values)
+            symbol_rows.append((symbol, len(data["datetime"])))
+
+        if not symbol_rows:
+            return pd.DataFrame(columns=["datetime"] + columns + [
+                "symbol", "symbol_group", "asset_class", "expiry"])
+
+        data = pd.DataFrame({name: np.concatenate(values)
+                             for name, values in parts.items()})
+        data["datetime"] = pd.to_datetime(data["datetime"], unit="us")
+
+        # symbols' meta data
+        counts = [rows for _, rows in symbol_rows]
+        data["symbol"] = np.repeat(np.array(
+            [symbol for symbol, _ in symbol_rows], dtype=object), counts)
+        for name in ("symbol_group", "asset_class", "expiry"):
+            values = [manifest["symbols"].get(symbol, {}).get(name)
+                      for symbol, _ in symbol_rows]
+            data[name] = np.repeat(np.array(values, dtype=object), counts)
+
+        return data
+
+    def iter_read(self, symbols, start, end=None, table="bars", columns=None,
+                  symbol_groups=None):
+        """ same as ``read()``, but yields the data one day at a time """
+        if isinstance(symbols, str):
+            symbols = symbols.split(',')
+
+        start = _micros(start)
+        end = _micros(end)
+
+        partitions = self.manifest()["partitions"].get(table, {})
+        dates = sorted(set(date for symbol in self.symbols(
+            symbols, table, symbol_groups) for date in partitions[symbol]))
+
+        for date in dates:
+            day_start = _micros(date)
+            day_end = day_start + _DAY - 1
+            if (start is not None and day_end < start) or (
+                    end is not None and day_start > end):
+                continue
+
+            data = self.read(symbols, max(day_start, start or day_start),
+                             min(day_end, day_end if end is None else end),
+                             table, columns, symbol_groups)
+            if not data.empty:
+                yield data
+
+    @staticmethod
+    def _dedupe(data, table):
+        order = np.argsort(data["datetime"], kind="mergesort")
+        data = {name: values[order] for name, values in data.items()}
+        times = data["datetime"]
+        if len(times) < 2 or np.all(times[1:] != times[:-1]):
+            return data
+
+        # partial periods written by different segments
+        if is_archive_table(table):
+            return merge_rollup(data)
+
+        # keep the first tick, the last bar (written again = replaced)
+        if table != "bars":
+            keep = np.r_[True, times[1:] != times[:-1]]
+        else:
+            keep = np.r_[times[1:] != times[:-1], True]
+        return {name: values[keep] for name, values in data.items()}
+
+    # -------------------------------------------
+    def compact(self, table=None, before=None, start=None):
+        """Merges each partition's segments into a single segment
+
+        :Optional:
+            table : str
+                Only compact this table (default: all)
+            before : str
+                Only compact dates before this one (``YYYY-MM-DD``,
+                default: before today, UTC)
+            start : str
+                Only compact dates from this one (``YYYY-MM-DD``,
+                default: all)
+        """
+        if before is None:
+            before = datetime.utcnow().strftime("%Y-%m-%d")
+
+        partitions = self.manifest()["partitions"]
+        for tbl in ([table] if table else list(partitions)):
+            for symbol, dates in partitions.get(tbl, {}).items():
+                for date in dates:
+                    if date >= before or (start is not None and
+                                          date < start):
+                        continue
+                    segments = self.segments(tbl, date, symbol)
+                    if len(segments) < 2:
+                        continue
+
+                    chunks = [read_segment(segment) for segment in segments]
+                    names = set().union(*chunks)
+
+                    # segments may not share optional columns
+                    columns = {name: np.concatenate([
+                        chunk[name] if name in chunk else np.full(
+                            len(chunk["datetime"]), np.nan)
+                        for chunk in chunks]) for name in names}
+
+                    # one row per rollup period
+                    if is_archive_table(tbl):
+                        columns = self._dedupe(columns, tbl)
+
+                    self.append(tbl, symbol, columns)
+                    for segment in segments:
+                        os.remove(segment)
+
+    # -------------------------------------------
+    def rebuild_rollup(self, resolution, start=None, end=None):
+        """Rebuilds a bar rollup from the stored 1-minute bars
+
+        :Parameters:
+            resolution : str
+                Rollup resolution (eg. ``1H``)
+
+        :Optional:
+            start : str
+                First date to rebuild (``YYYY-MM-DD``, default: all)
+            end : str
+                Last date to rebuild (``YYYY-MM-DD``, default: all)
+        """
+        table = archive_table(resolution)
+        manifest = self.manifest()
+
+        for symbol, dates in manifest["partitions"].get("bars", {}).items():
+            meta = manifest["symbols"].get(symbol, {})
+            if meta.get("asset_class") in SKIP_ASSET_CLASSES:
+                continue
+
+            for date in dates:
+                if (start is not None and date < start) or (
+                        end is not None and date > end):
+                    continue
+
+                chunks = [read_segment(segment, ("datetime",) +
+                                       COLUMNS["bars"])
+                          for segment in self.segments("bars", date, symbol)]
+                if not chunks:
+                    continue
+
+                bars = self._dedupe({name: np.concatenate([
+                    chunk[name] for chunk in chunks]) for name in chunks[0]},
+                    "bars")
+
+                # periods never span days, so replace the whole partition
+                segments = self.segments(table, date, symbol)
+                self.append(table, symbol, rollup_bars(bars, resolution),
+                            meta)
+                for segment in segments:
+                    os.remove(segment)
+
+
+# ---------------------------------------------
+class ArchiveWriter(DBWriter):
+    """Writes Blotter ticks/bars to an ``Archive``
+
+    Works like ``DBWriter`` (rows are queued and written by a background
+    thread), but keeps rows in memory and writes each symbol's rows as a
+    segment once ``segment_rows`` rows are pending or ``segment_interval``
+    seconds have passed (and when stopped). Rows count as written once
+    their segment is on disk.
+
+    :Parameters:
+        archive : Archive
+            Archive to write to
+
+    :Optional:
+        expiry : callable
+            ``expiry(symbol)`` returning a contract's expiry date
+        segment_rows : int
+            Max rows per segment (default: 100000)
+        segment_interval : float
+            Max seconds between segments (default: 60)
+        compact : bool
+            Compact the previous days' (sealed) partitions at each day
+            roll, UTC (default: True)
+    """
+
+    def __init__(self, archive, expiry=None, segment_rows=100000,
+                 segment_interval=60, compact=True, **kwargs):
+        super(ArchiveWriter, self).__init__(
+            connect=None, symbol_id=None, **kwargs)
+
+        self.archive = archive
+        self.expiry = expiry
+        self.segment_rows = int(segment_rows)
+        self.segment_interval = float(segment_interval)
+        self.rows_buffered = 0
+        self.compact = bool(compact)
+
+        self._buffers = {}
+        self._meta = {}
+        self._last_segment = time()
+        self._day = datetime.utcnow().strftime("%Y-%m-%d")
+        # first compaction: all days (eg. left by a previous run)
+        self._compact_from = None
+
+    # -------------------------------------------
+    def stop(self, timeout=None):
+        """ flush pending rows, write them to the archive and stop """
+        super(ArchiveWriter, self).stop(timeout)
+        self.write_segments()
+        self.update_coverage(force=True)
+
+    def stats(self):
+        stats = super(ArchiveWriter, self).stats()
+        stats["rows_buffered"] = self.rows_buffered
+        return stats
+
+    # -------------------------------------------
+    def _symbol_meta(self, data):
+        symbol = data["symbol"]
+        if symbol not in self._meta:
+            expiry = None
+            if self.expiry is not None and data.get("asset_class") in (
+                    "FUT", "OPT", "FOP"):
+                try:
+                    expiry = self.expiry(symbol)
+                except Exception as e:
+                    pass
+            self._meta[symbol] = {
+                "symbol_group": data.get("symbol_group"),
+                "asset_class": data.get("asset_class"),
+                "expiry": str(expiry) if expiry else None
+            }
+        return self._meta[symbol]
+
+    def _count_written(self, rows):
+        # counted by write_segments()
+        pass
+
+    def _write_batch(self, batch, rebuild=False):
+        # (local writes aren't retried, rollups are merged)
+        written = 0
+        for data, kind, greeks in batch:
+            table = TABLES.get(kind)
+            if table is None:
+                continue
+
+            try:
+                row = tick_row(data, None) if kind == "TICK" else bar_row(
+                    data, None)
+            except Exception as e:
+                self.log.error("Cannot write %s %s row to archive (%s)",
+                               data.get("symbol"), kind, e)
+                continue
+
+            if kind == "BAR" and self.rollups and data.get(
+                    "asset_class") not in SKIP_ASSET_CLASSES:
+                self._buffer_rollups(data["symbol"], row)
+
+            key = (table, data["symbol"])
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = {name: [] for name in ("datetime",) +
+                          COLUMNS[table] + GREEK_COLUMNS}
+                self._buffers[key] = buffer
+
+            buffer["datetime"].append(protocol.to_micros(row[0]))
+            for name, value in zip(COLUMNS[table], row[2:]):
+                buffer[name].append(value)
+
+            # greeks (NaN when incomplete)
+            values = (np.nan,) * len(GREEK_COLUMNS)
+            if data.get("asset_class") in ("OPT", "FOP"):
+                try:
+                    values = greeks_row(greeks or data, None, None)[:-2]
+                except Exception as e:
+                    pass
+            for name, value in zip(GREEK_COLUMNS, values):
+                buffer[name].append(value)
+
+            self._symbol_meta(data)
+            self.rows_buffered += 1
+            written += 1
+
+        if self.rows_buffered >= self.segment_rows or \
+                time() - self._last_segment >= self.segment_interval:
+            self.write_segments()
+
+        return written
+
+    def _buffer_rollups(self, symbol, row):
+        """ merges a bar into its (buffered) rollup periods """
+        micros = protocol.to_micros(row[0])
+
+        for resolution in self.rollups:
+            period = period_start(micros, resolution_seconds(resolution))
+            key = (archive_table(resolution), symbol)
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = {name: [] for name in ("datetime",) +
+                          COLUMNS["bars"]}
+                self._buffers[key] = buffer
+
+            if buffer["datetime"] and buffer["datetime"][-1] == period:
+                buffer["high"][-1] = max(buffer["high"][-1], row[3])
+                buffer["low"][-1] = min(buffer["low"][-1], row[4])
+                buffer["close"][-1] = row[5]
+                buffer["volume"][-1] += row[6]
+            else:
+                buffer["datetime"].append(period)
+                for name, value in zip(COLUMNS["bars"], row[2:]):
+                    buffer[name].append(value)
+
+    # -------------------------------------------
+    def write_segments(self):
+        """ writes buffered rows to the archive """
+        buffers, self._buffers = self._buffers, {}
+        self.rows_buffered = 0
+        self._last_segment = time()
+
+        for (table, symbol), buffer in buffers.items():
+            columns = {"datetime": np.array(buffer["datetime"], dtype=np.int64)}
+            for name in table_columns(table):
+                columns[name] = np.array(buffer[name], dtype=(
+                    np.int64 if name in INT_COLUMNS else np.float64))
+
+            # only store greeks for options
+            if self._meta[symbol]["asset_class"] in ("OPT", "FOP"):
+                for name in GREEK_COLUMNS:
+                    columns[name] = np.array(buffer[name], dtype=np.float64)
+
+            rollup = is_archive_table(table)
+            try:
+                self.archive.append(table, symbol, columns,
+                                    self._meta[symbol])
+            except Exception as e:
+                self.log.error("Cannot write %d rows to archive (%s)",
+                               len(buffer["datetime"]), e)
+                if not rollup:
+                    self.rows_failed += len(buffer["datetime"])
+                continue
+
+            if rollup:
+                continue
+
+            # written - extend the symbol's coverage
+            self.rows_written += len(buffer["datetime"])
+            kind = "TICK" if table == "ticks" else "BAR"
+            self._extend_spans((symbol, kind),
+                               columns["datetime"].astype("datetime64[us]"))
+
+        # the previous days' partitions are sealed: merge their segments
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        if today != self._day:
+            if self.compact:
+                try:
+                    self.archive.compact(before=today,
+                                         start=self._compact_from)
+                    self._compact_from = today
+                except Exception as e:
+                    self.log.error("Cannot compact the archive (%s)", e)
+            self._day = today
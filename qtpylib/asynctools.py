@@ -19,11 +19,14 @@
 # limitations under the License.
 #
 
-from threading import Thread, Semaphore
+import logging
+import queue
+
+from threading import Thread, Semaphore, Lock, Condition, local
 from multiprocessing import Process, cpu_count
 from sys import exit as sysexit, version_info as sys_version_info
 from os import _exit as osexit
-from time import sleep, time
+from time import sleep, time, perf_counter
 
 # =============================================
 # check min, python version
@@ -41,6 +44,8 @@ class multitasking():
 
     __KILL_RECEIVED__ = False
     __TASKS__ = []
+    __PRUNE_EVERY__ = 1000
+    __SPAWNED__ = 0
 
     # processing
     __CPU_CORES__ = cpu_count()
@@ -105,6 +110,13 @@ class multitasking():
                     target=_run_via_pool, args=args, kwargs=kwargs, daemon=False)
                 cls.__TASKS__.append(task)
                 task.start()
+
+                # forget finished tasks every once in a while
+                cls.__SPAWNED__ += 1
+                if cls.__SPAWNED__ % cls.__PRUNE_EVERY__ == 0:
+                    cls.__TASKS__ = [
+                        t for t in cls.__TASKS__ if t.is_alive()]
+
                 return task
 
             return None
@@ -128,6 +140,14 @@ class multitasking():
             pass
         return True
 
+    @classmethod
+    def stats(cls):
+        return {
+            "spawned": cls.__SPAWNED__,
+            "running": len([t for t in cls.__TASKS__
+                            if t is not None and t.is_alive()])
+        }
+
     @classmethod
     def killall(cls):
         cls.__KILL_RECEIVED__ = True
@@ -139,6 +159,274 @@ class multitasking():
 # =============================================
 
 
+class WorkerPool():
+    """Fixed number of worker threads, each with its own bounded queue.
+
+    Tasks are routed by key (eg. ticker id), so tasks sharing a key always
+    run on the same worker, in the order they were submitted.
+
+    Per-task policies:
+
+    - ``queue``: wait for room in the worker's queue (default)
+    - ``drop``: discard the task if the worker's queue is full
+    - ``coalesce``: if a task with the same key/function is still waiting,
+      replace its arguments instead of queueing another one
+
+    :Optional:
+        workers : int
+            Number of worker threads (0 runs tasks inline). Default is 4
+        max_queue : int
+            Max tasks waiting per worker. Default is 10000
+        name : str
+            Thread name prefix. Default is "worker"
+        observer : callable
+            Called as ``observer(func_name, wait, run)`` after each task,
+            with the seconds it waited in the queue and took to run
+    """
+
+    __STOP__ = object()
+
+    def __init__(self, workers=4, max_queue=10000, name="worker",
+                 observer=None):
+        self.workers = max(0, int(workers))
+        self.name = name
+        self.observer = observer
+        self._current = local()
+
+        self._queues = [queue.Queue(maxsize=max(1, int(max_queue)))
+                        for _ in range(self.workers)]
+        self._pending = {}
+        self._lock = Lock()
+        self._log = logging.getLogger(__name__)
+
+        self.submitted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._processed = [0] * self.workers
+
+        self._threads = []
+        for ix in range(self.workers):
+            thread = Thread(target=self._work, args=(ix,), daemon=True,
+                            name="%s-%d" % (name, ix))
+            thread.start()
+            self._threads.append(thread)
+
+    # -------------------------------------------
+    def submit(self, key, func, *args, policy="queue", **kwargs):
+        """Run ``func(*args, **kwargs)`` on the worker that owns ``key``"""
+        if self.workers == 0:
+            self._current.submitted = perf_counter()
+            return func(*args, **kwargs)
+
+        tasks = self._queues[hash(key) % self.workers]
+        submitted = perf_counter()
+
+        if policy == "coalesce":
+            slot = (key, func)
+            with self._lock:
+                self.submitted += 1
+                if slot in self._pending:
+                    self._pending[slot] = (args, kwargs)
+                    self.coalesced += 1
+                    return None
+                self._pending[slot] = (args, kwargs)
+            tasks.put((slot, None, None, None, submitted))
+            return None
+
+        with self._lock:
+            self.submitted += 1
+
+        if policy == "drop":
+            try:
+                tasks.put_nowait((None, func, args, kwargs, submitted))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+            return None
+
+        tasks.put((None, func, args, kwargs, submitted))
+        return None
+
+    def task_submitted(self):
+        """ ``perf_counter()`` time at which the task running on the
+        current thread was submitted (None outside of tasks) """
+        return getattr(self._current, "submitted", None)
+
+    # -------------------------------------------
+    def _work(self, ix):
+        tasks = self._queues[ix]
+        while True:
+            task = tasks.get()
+            if task is self.__STOP__:
+                return
+
+            slot, func, args, kwargs, submitted = task
+            if slot is not None:
+                with self._lock:
+                    args, kwargs = self._pending.pop(slot)
+                func = slot[1]
+
+            self._current.submitted = submitted
+            started = perf_counter()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                self._log.exception("Task %s failed", func.__name__)
+            self._current.submitted = None
+
+            self._processed[ix] += 1
+
+            if self.observer is not None:
+                try:
+                    self.observer(func.__name__, started - submitted,
+                                  perf_counter() - started)
+                except Exception as e:
+                    pass
+
+    # -------------------------------------------
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_depth": [tasks.qsize() for tasks in self._queues],
+            "submitted": self.submitted,
+            "processed": sum(self._processed),
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "errors": self.errors
+        }
+
+    # -------------------------------------------
+    def stop(self, timeout=None):
+        """Let workers finish their queued tasks, then stop them"""
+        for tasks in self._queues:
+            tasks.put(self.__STOP__)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+# =============================================
+
+
+class Conflator():
+    """Keeps only the latest message per key and publishes it at most
+    once every ``interval`` seconds.
+
+    Messages arriving sooner replace the pending one, which is published
+    by a background thread once its interval has passed, so the latest
+    state is never lost. Messages for which ``urgent(last, message)``
+    is true (eg. a price move) are published right away.
+
+    :Parameters:
+        publish : callable
+            ``publish(message)``, called in order per key
+
+    :Optional:
+        interval : float
+            Min seconds between messages per key. Default is 0.25
+        urgent : callable
+            ``urgent(last_published, message)``. Default is None
+        name : str
+            Thread name. Default is "conflator"
+    """
+
+    def __init__(self, publish, interval=0.25, urgent=None,
+                 name="conflator"):
+        self.publish = publish
+        self.interval = float(interval)
+        self.urgent = urgent
+        self.name = name
+
+        self._last = {}  # key -> (time, message)
+        self._pending = {}
+        self._cond = Condition()
+        self._thread = None
+        self._running = True
+        self._log = logging.getLogger(__name__)
+
+        self.received = 0
+        self.published = 0
+        self.conflated = 0
+        self.errors = 0
+
+    # -------------------------------------------
+    def submit(self, key, message):
+        with self._cond:
+            self.received += 1
+            last = self._last.get(key)
+
+            if last is None or time() - last[0] >= self.interval or (
+                    self.urgent is not None and self.urgent(last[1], message)):
+                if self._pending.pop(key, None) is not None:
+                    self.conflated += 1
+                self._publish(key, message)
+                return
+
+            if key in self._pending:
+                self.conflated += 1
+            self._pending[key] = message
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True,
+                                      name=self.name)
+                self._thread.start()
+            self._cond.notify()
+
+    def _publish(self, key, message):
+        # called with the lock held (keeps each key's messages in order)
+        self._last[key] = (time(), message)
+        self.published += 1
+        try:
+            self.publish(message)
+        except Exception as e:
+            self.errors += 1
+            self._log.exception("Cannot publish %s", key)
+
+    # -------------------------------------------
+    def _run(self):
+        with self._cond:
+            while self._running:
+                now = time()
+                wait = None
+                for key in list(self._pending):
+                    due = self._last[key][0] + self.interval - now
+                    if due <= 0:
+                        self._publish(key, self._pending.pop(key))
+                    elif wait is None or due < wait:
+                        wait = due
+                self._cond.wait(wait)
+
+    # -------------------------------------------
+    def flush(self):
+        """ publishes all pending messages now """
+        with self._cond:
+            for key in list(self._pending):
+                self._publish(key, self._pending.pop(key))
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "published": self.published,
+            "conflated": self.conflated,
+            "pending": len(self._pending),
+            "errors": self.errors
+        }
+
+    def stop(self, flush=True):
+        if flush:
+            self.flush()
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+# =============================================
+
+
 class RecurringTask(Thread):
     """Calls a function at a sepecified interval."""
 
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Pacing-aware historical data backfill (used by ``Blotter.backfill()``).
+
+Missing time ranges are split into request-sized chunks and requested
+from a historical data source (IB, or a fake one in tests), a chunk per
+symbol at a time and several symbols concurrently, without exceeding the
+source's pacing limits (IB allows 60 requests per 10 minutes).
+"""
+
+import logging
+import sys
+
+from collections import deque, OrderedDict
+from datetime import timedelta
+from threading import Condition
+from time import time
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# max request duration per bar size
+CHUNK_SIZES = {
+    "1 sec": timedelta(minutes=30),
+    "1 min": timedelta(days=1),
+}
+
+
+# ---------------------------------------------
+def split_range(start, end, chunk_size):
+    """ splits a time range into ``chunk_size`` long ``(start, end)`` chunks """
+    chunks = []
+    while start < end:
+        chunks.append((start, min(start + chunk_size, end)))
+        start += chunk_size
+    return chunks
+
+
+# ---------------------------------------------
+class BackfillJob():
+    """ a single historical data request """
+
+    __slots__ = ('symbol', 'start', 'end', 'bar_size', 'attempts',
+                 'requested', 'rows')
+
+    def __init__(self, symbol, start, end, bar_size="1 min"):
+        self.symbol = symbol
+        self.start = start
+        self.end = end
+        self.bar_size = bar_size
+        self.attempts = 0
+        self.requested = None
+        self.rows = []
+
+    @property
+    def duration(self):
+        """ request duration (IB format) """
+        seconds = int((self.end - self.start).total_seconds())
+        return "%d S" % max(1, seconds)
+
+    def __repr__(self):
+        return "<BackfillJob %s %s - %s>" % (self.symbol, self.start, self.end)
+
+
+class Pacer():
+    """ sliding window rate limiter (``max_requests`` per ``period`` sec) """
+
+    def __init__(self, max_requests=60, period=600):
+        self.max_requests = int(max_requests)
+        self.period = float(period)
+        self.requests = deque()
+
+    def delay(self, now=None):
+        """ seconds to wait before the next request is allowed """
+        now = time() if now is None else now
+        while self.requests and now - self.requests[0] >= self.period:
+            self.requests.popleft()
+        if len(self.requests) < self.max_requests:
+            return 0
+        return self.requests[0] + self.period - now
+
+    def record(self, now=None):
+        self.requests.append(time() if now is None else now)
+
+
+# ---------------------------------------------
+class BackfillScheduler():
+    """Dispatches backfill requests under a pacing budget
+
+    The ``request(job)`` callable starts a request and the source reports
+    back by calling ``received()`` for each row, then ``completed()``
+    (or ``failed()``) with the job's symbol. Completed jobs are passed
+    to ``write(job)``, holding all of the chunk's rows (for bulk inserts).
+
+    Sources identify requests by symbol only, so a symbol isn't requested
+    again after a timeout until the late answer (if any) has arrived and
+    been discarded, or for another ``timeout`` seconds.
+
+    :Parameters:
+        request : callable
+            Starts a request for a ``BackfillJob``
+
+    :Optional:
+        write : callable
+            Stores a completed job's rows
+        max_requests : int
+            Max requests per ``period`` (default: 60)
+        period : float
+            Pacing period in seconds (default: 600)
+        max_inflight : int
+            Max concurrent requests (default: 10)
+        timeout : float
+            Seconds before an unanswered request is retried (default: 120)
+        retries : int
+            Retries per chunk (default: 2)
+        logger : object
+            Logger to use (default: this module's)
+    """
+
+    def __init__(self, request, write=None, max_requests=60, period=600,
+                 max_inflight=10, timeout=120, retries=2, logger=None):
+        self.request = request
+        self.write = write
+        self.pacer = Pacer(max_requests, period)
+        self.max_inflight = max(1, int(max_inflight))
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.log = logger if logger is not None else logging.getLogger(
+            __name__)
+
+        self._cond = Condition()
+        self._pending = OrderedDict()
+        self._inflight = {}
+        self._done = []
+        self._progress = {}
+        self._stale = {}
+
+    # -------------------------------------------
+    def add(self, symbol, ranges, bar_size="1 min"):
+        """ queue requests for a symbol's missing ``(start, end)`` ranges """
+        chunk_size = CHUNK_SIZES.get(bar_size, CHUNK_SIZES["1 min"])
+        jobs = [BackfillJob(symbol, start, end, bar_size)
+                for range_start, range_end in ranges
+                for start, end in split_range(range_start, range_end,
+                                              chunk_size)]
+        if not jobs:
+            return 0
+
+        with self._cond:
+            self._pending.setdefault(symbol, deque()).extend(jobs)
+            progress = self._progress.setdefault(symbol, {
+                "chunks": 0, "completed": 0, "failed": 0, "rows": 0})
+            progress["chunks"] += len(jobs)
+            self._cond.notify_all()
+        return len(jobs)
+
+    def progress(self):
+        """ chunks (completed/failed) and rows per symbol """
+        with self._cond:
+            return {symbol: dict(progress)
+                    for symbol, progress in self._progress.items()}
+
+    @property
+    def busy(self):
+        return bool(self._pending or self._inflight or self._done)
+
+    # -------------------------------------------
+    # source callbacks
+    def received(self, symbol, row):
+        with self._cond:
+            if symbol in self._stale:
+                return
+            job = self._inflight.get(symbol)
+            if job is not None:
+                job.rows.append(row)
+
+    def completed(self, symbol):
+        with self._cond:
+            if self._resolve_stale(symbol):
+                return
+            job = self._inflight.pop(symbol, None)
+            if job is None:
+                return
+            progress = self._progress[symbol]
+            progress["completed"] += 1
+            progress["rows"] += len(job.rows)
+            self._done.append(job)
+            self._cond.notify_all()
+
+        self.log.info("Backfill %s: %d/%d chunks, %d rows", symbol,
+                      progress["completed"], progress["chunks"],
+                      progress["rows"])
+
+    def failed(self, symbol, reason=None, retry=True):
+        with self._cond:
+            if self._resolve_stale(symbol):
+                return
+            self._retry(self._inflight.pop(symbol, None), reason, retry)
+
+    # -------------------------------------------
+    def _resolve_stale(self, symbol):
+        """ ends a timed out request (its answer arrived after all) """
+        if self._stale.pop(symbol, None) is None:
+            return False
+        self._cond.notify_all()
+        return True
+
+    def _retry(self, job, reason=None, retry=True):
+        """ re-queues a failed job (unless out of retries) """
+        if job is None:
+            return
+
+        if retry and job.attempts <= self.retries:
+            job.rows = []
+            self._pending.setdefault(job.symbol, deque()).appendleft(job)
+            self.log.warning("Backfill %s failed (%s), retrying...",
+                             job, reason)
+        else:
+            self._progress[job.symbol]["failed"] += 1
+            self.log.error("Backfill %s failed (%s)", job, reason)
+        self._cond.notify_all()
+
+    def _expire(self, now):
+        """ fails unanswered requests, ignoring their late answers """
+        for symbol, job in list(self._inflight.items()):
+            if now - job.requested > self.timeout:
+                del self._inflight[symbol]
+                self._stale[symbol] = now
+                self._retry(job, "timeout")
+
+        for symbol, expired in list(self._stale.items()):
+            if now - expired > self.timeout:
+                del self._stale[symbol]
+
+    # -------------------------------------------
+    def _next_jobs(self, now):
+        """ jobs that can be dispatched now, and seconds to wait otherwise """
+        jobs = []
+        for symbol in list(self._pending):
+            if len(self._inflight) >= self.max_inflight:
+                break
+            if symbol in self._inflight or symbol in self._stale:
+                continue
+
+            wait = self.pacer.delay(now)
+            if wait > 0:
+                return jobs, wait
+
+            job = self._pending[symbol].popleft()
+            if not self._pending[symbol]:
+                del self._pending[symbol]
+            else:
+                # round robin
+                self._pending.move_to_end(symbol)
+
+            job.attempts += 1
+            job.requested = now
+            self._inflight[symbol] = job
+            self.pacer.record(now)
+            jobs.append(job)
+
+        return jobs, 1
+
+    def run(self, timeout=None):
+        """Dispatches all queued requests and blocks until they're done
+
+        :Optional:
+            timeout : float
+                Give up after this many seconds (default: None)
+
+        :Returns:
+            progress : dict
+                Same as ``progress()``
+        """
+        deadline = None if timeout is None else time() + timeout
+
+        while True:
+            with self._cond:
+                now = time()
+                if not self.busy or (deadline is not None and now > deadline):
+                    break
+
+                # unanswered requests
+                self._expire(now)
+
+                jobs, wait = self._next_jobs(now)
+                done, self._done = self._done, []
+
+                if not jobs and not done:
+                    self._cond.wait(min(wait, 1))
+                    continue
+
+            # outside the lock, as sources may call back right away
+            for job in jobs:
+                try:
+                    self.request(job)
+                except Exception as e:
+                    self.failed(job.symbol, e)
+
+            for job in done:
+                if self.write is not None:
+                    try:
+                        self.write(job)
+                    except Exception as e:
+                        self.log.error("Cannot store backfill %s (%s)",
+                                       job, e)
+
+        return self.progress()
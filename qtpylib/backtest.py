@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Backtest runner (used by ``Algo`` in ``--backtest`` mode).
+
+History is fed to the algo's (non-threaded) tick/bar handler one row
+at a time, in timestamp order, from the calling thread: each event is
+fully handled (``on_bar()``, orders, recording) before the next one,
+with no sleeping in between. Rows that share a timestamp keep their
+original order.
+"""
+
+import logging
+import sys
+import time
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+
+class BacktestRunner():
+    """Runs history through a tick/bar handler
+
+    :Parameters:
+        handler : func
+            Called with a single-row ``pd.DataFrame`` per tick/bar
+            (eg. ``Algo._base_bar_handler``)
+
+    :Optional:
+        logger : object
+            Logger to report progress to
+        log_interval : float
+            Seconds between progress reports (default: 10)
+    """
+
+    def __init__(self, handler, logger=None, log_interval=10):
+        self.handler = handler
+        self.logger = logger if logger is not None else \
+            logging.getLogger(__name__)
+        self.log_interval = log_interval
+
+        self.events = 0
+        self.total = 0
+        self.started = None
+        self.ended = None
+        self.backtest_time = None
+        self._running = False
+
+    # ---------------------------------------------
+    def run(self, data):
+        """Feeds ``data`` to the handler (until done or stopped)
+
+        :Parameters:
+            data : pd.DataFrame
+                Ticks/bars of all symbols, indexed by timestamp
+
+        :Returns:
+            stats : dict
+                See ``stats()``
+        """
+        if not data.index.is_monotonic_increasing:
+            data = data.sort_index(kind="mergesort")
+
+        self._running = True
+        self.events = 0
+        self.total = len(data)
+        self.started = time.time()
+        self.ended = None
+        next_log = self.started + self.log_interval
+
+        try:
+            for ix in range(self.total):
+                if not self._running:
+                    break
+
+                self.handler(data.iloc[ix:ix + 1])
+                self.events += 1
+
+                if time.time() >= next_log:
+                    next_log = time.time() + self.log_interval
+                    self.backtest_time = data.index[ix]
+                    stats = self.stats()
+                    self.logger.info(
+                        "Backtested %d/%d events (%s, %d/sec)",
+                        self.events, self.total, stats["backtest_time"],
+                        stats["rate"])
+        finally:
+            if self.events:
+                self.backtest_time = data.index[self.events - 1]
+            self._running = False
+            self.ended = time.time()
+
+        return self.stats()
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        elapsed = (self.ended or time.time()) - (self.started or time.time())
+        return {
+            "events": self.events,
+            "total": self.total,
+            "seconds": round(elapsed, 3),
+            "rate": self.events / elapsed if elapsed > 0 else 0,
+            "backtest_time": None if self.backtest_time is None else
+            str(self.backtest_time),
+        }
@@ -21,6 +21,7 @@
 
 import argparse
 import atexit
+import itertools
 import json
 import logging
 import os
@@ -28,11 +29,12 @@ import pickle
 
 import sys
 import tempfile
+import threading
 import time
 import glob
 import subprocess
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from abc import ABCMeta
 
 import zmq
@@ -53,7 +55,27 @@ from ezibpy import (
 )
 
 from qtpylib import (
-    tools, asynctools, path, futures, __version__
+    tools, asynctools, path, futures, partitions, protocol, replay,
+    sharding, shmbus, __version__
+)
+from qtpylib.aggregators import BarBuilder
+from qtpylib.backfill import BackfillScheduler
+from qtpylib.dbwriter import (
+    DBWriter, PARTITIONED_BARS_SQL, PARTITIONED_TICKS_SQL, NO_GREEKS,
+    bar_row, inline_greeks, tick_row
+)
+from qtpylib.orderbook import OrderBook
+from qtpylib.rollups import (
+    REBUILD_SQL, archive_table, best_rollup, parse_rollups, period_bounds,
+    resolution_seconds, rollup_ranges
+)
+from qtpylib.journal import Journal
+from qtpylib.telemetry import Telemetry
+from qtpylib.archive import Archive, ArchiveWriter
+from qtpylib.cache import HistoryCache, to_utc
+from qtpylib.coverage import (
+    ArchiveCoverage, MySQLCoverage, find_gaps, index_intervals,
+    merge_intervals
 )
 
 # =============================================
@@ -98,8 +120,29 @@ class Blotter():
             ZeroMQ Port to use (default: 12345)
         zmqtopic : str
             ZeroMQ string to use (default: _qtpylib_BLOTTERNAME_)
+        zmqformat : str
+            ZeroMQ message format: json or binary (default: json)
+        shards : int
+            Number of Blotter processes streaming a hash-partition of
+            the symbols each (see ``qtpylib.sharding``) (default: 1)
+        shard : int
+            Shard to run (0 to shards-1). Without it, a sharded Blotter
+            runs the proxy republishing all shards on zmqport
+        zmqbackend : str
+            Port shards publish to the proxy on (default: zmqport + 1)
+        shm : bool
+            Also publish ticks, bars and quotes via shared memory,
+            used by algos running on the same host (default: False)
         orderbook : str
             Get Order Book (Market Depth) data (default: False)
+        orderbookmode : str
+            Publish order books as full snapshots or as deltas (changed
+            levels, with periodic snapshots) (default: snapshot)
+        orderbookrate : float
+            Min seconds between order book messages per symbol,
+            conflating the updates in between (default: 0)
+        orderbooksnapshot : float
+            Seconds between full snapshots in delta mode (default: 5)
         dbhost : str
             MySQL server hostname (default: localhost)
         dbport : str
@@ -112,6 +155,59 @@ class Blotter():
             MySQL server password (default: none)
         dbskip : str
             Skip MySQL logging (default: False)
+        dbschema : str
+            MySQL ticks/bars schema: default or partitioned (by day,
+            see ``qtpylib.partitions``) (default: default)
+        tickretention : int
+            Days of ticks to keep with the partitioned schema
+            (default: 0 = keep all)
+        storage : str
+            Where ticks/bars are stored: mysql or archive (default: mysql)
+        archive : str
+            Path of the columnar tick/bar archive (default: ./archive)
+        dbbatch : int
+            Max rows per MySQL commit (default: 500)
+        dbflush : float
+            Max seconds between MySQL commits (default: 1)
+        dbqueue : int
+            Max rows waiting to be written to MySQL (default: 100000)
+        journal : str
+            Journal ticks/bars to this directory before writing them
+            to MySQL, so they survive database outages and restarts
+            (see ``qtpylib.journal``) (default: None = disabled)
+        rollups : str
+            Bar resolutions to maintain as each 1-minute bar is stored
+            and read by ``history()``, eg. ``5T,15T,1H,1D``
+            (default: none)
+        quotepolicy : str
+            Handling of quotes waiting to be processed when using threads:
+            queue, drop (when backlogged) or coalesce (default: queue)
+        quoterate : float
+            Min seconds between quotes per symbol, only publishing the
+            latest one (default: 0 = publish every quote)
+        quotemove : bool
+            Publish quotes right away when the bid/ask price moves
+            (default: False)
+        backfillpace : int
+            Max historical data requests per 10 minutes (default: 60)
+        backfillinflight : int
+            Max concurrent historical data requests (default: 10)
+        telemetryport : int
+            Serve runtime metrics as JSON on this local HTTP port
+            (+ shard #, when sharded) (default: 0 = disabled)
+        telemetrylog : float
+            Log runtime metrics every N seconds (default: 0 = disabled)
+        replay : str
+            Replay stored ticks/bars from this date/time instead of
+            streaming from IB (default: None, see ``replay()``)
+        replayend : str
+            Replay until this date/time (default: None = all)
+        replayspeed : float
+            Replay speed, as a multiple of real time (0 = as fast as
+            algos keep up with) (default: 1)
+        replaycsv : str
+            Replay ``workflow.prepare_data()`` CSV files from this
+            directory instead of the database (default: None)
     """
 
     __metaclass__ = ABCMeta
@@ -120,7 +216,18 @@ class Blotter():
                  ibport=4001, ibclient=999, ibserver="localhost",
                  dbhost="localhost", dbport="3306", dbname="qtpy",
                  dbuser="root", dbpass="", dbskip=False, orderbook=False,
-                 zmqport="12345", zmqtopic=None, **kwargs):
+                 orderbookmode="snapshot", orderbookrate=0,
+                 orderbooksnapshot=5,
+                 zmqport="12345", zmqtopic=None, zmqformat="json",
+                 shards=1, shard=None, zmqbackend=None,
+                 shm=False, storage="mysql", archive="archive", dbbatch=500, dbflush=1,
+                 dbqueue=100000, journal=None, rollups="", dbschema="default",
+                 tickretention=0, quotepolicy="queue",
+                 quoterate=0,
+                 quotemove=False, backfillpace=60,
+                 backfillinflight=10, telemetryport=0, telemetrylog=0,
+                 replay=None, replayend=None, replayspeed=1, replaycsv=None,
+                 **kwargs):
 
         # whats my name?
         self.name = str(self.__class__).split('.')[-1].split("'")[0].lower()
@@ -133,21 +240,18 @@ class Blotter():
         # do not act on first tick (timezone is incorrect)
         self.first_tick = True
 
-        self._bars = pd.DataFrame(
-            columns=['open', 'high', 'low', 'close', 'volume'])
-        self._bars.index.names = ['datetime']
-        self._bars.index = pd.to_datetime(self._bars.index, utc=True)
-        # self._bars.index = self._bars.index.tz_convert(settings['timezone'])
-        self._bars = {"~": self._bars}
-
-        self._raw_bars = pd.DataFrame(columns=['last', 'volume'])
-        self._raw_bars.index.names = ['datetime']
-        self._raw_bars.index = pd.to_datetime(self._raw_bars.index, utc=True)
-        self._raw_bars = {"~": self._raw_bars}
+        # per-symbol 1-minute bar builders
+        self._bar_builders = {}
 
         # global objects
         self.dbcurr = None
         self.dbconn = None
+        self.dbwriter = None
+        self.workers = None
+        self.quote_conflator = None
+        self.telemetry = Telemetry()
+        self._telemetry_started = False
+        self.shmbus = None
         self.context = None
         self.socket = None
         self.ibConn = None
@@ -155,6 +259,8 @@ class Blotter():
         self.symbol_ids = {}  # cache
         self.cash_ticks = cash_ticks  # outside cache
         self.rtvolume = set()  # has RTVOLUME?
+        self.books = {}  # order books (by tickerId)
+        self._book_state = {}
 
         # -------------------------------
         # work default values
@@ -165,6 +271,10 @@ class Blotter():
         # if no path given for symbols' csv, use same dir
         if symbols == "symbols.csv":
             symbols = path['caller'] + '/' + symbols
+
+        # same for the archive
+        if archive == "archive":
+            archive = path['caller'] + '/' + archive
         # -------------------------------
 
         # override args with any (non-default) command-line args
@@ -178,6 +288,19 @@ class Blotter():
         self.cahced_args = {}
         self.args_cache_file = "%s/%s.qtpylib" % (
             tempfile.gettempdir(), self.name)
+
+        # shards aren't connected to directly by clients
+        self.shard = None
+        if self.sharded and self.args['shard'] not in (None, ""):
+            self.shard = int(self.args['shard'])
+            self.args_cache_file = "%s/%s.qtpylib-shard%d" % (
+                tempfile.gettempdir(), self.name, self.shard)
+
+        # clients of a sharded blotter only read from the proxy
+        if self.sharded and self.args['shm']:
+            self.log_blotter.warning(
+                "Shared memory isn't supported by sharded Blotters")
+            self.args['shm'] = False
         if os.path.exists(self.args_cache_file):
             self.cahced_args = self._read_cached_args()
 
@@ -189,8 +312,8 @@ class Blotter():
 
         # track historical data download status
         self.backfilled = False
-        self.backfilled_symbols = []
         self.backfill_resolution = "1 min"
+        self._backfill_scheduler = None
 
         # be aware of thread count
         self.threads = asynctools.multitasking.getPool(__name__)['threads']
@@ -202,6 +325,21 @@ class Blotter():
 
         self.log_blotter.info("Blotter stopped...")
 
+        if self.workers is not None:
+            self.workers.stop(timeout=5)
+            self.workers = None
+
+        if self.quote_conflator is not None:
+            self.quote_conflator.stop()
+            self.log_blotter.info(
+                "Quotes: %(published)d published, %(conflated)d conflated",
+                self.quote_conflator.stats())
+            self.quote_conflator = None
+
+        if self.shmbus is not None:
+            self.shmbus.close()
+            self.shmbus = None
+
         if self.ibConn is not None:
             self.log_blotter.info("Cancel market data...")
             self.ibConn.cancelMarketData()
@@ -213,7 +351,12 @@ class Blotter():
             self.log_blotter.info("Deleting runtime args...")
             self._remove_cached_args()
 
-        if not self.args['dbskip']:
+        if self.dbwriter is not None:
+            self.log_blotter.info("Flushing pending writes...")
+            self.dbwriter.stop()
+            self.dbwriter = None
+
+        if self.dbconn is not None:
             self.log_blotter.info("Disconnecting from MySQL...")
             try:
                 self.dbcurr.close()
@@ -286,11 +429,37 @@ class Blotter():
                             help='TWS/GW Client ID', required=False)
         parser.add_argument('--ibserver', default=self.args['ibserver'],
                             help='IB TWS/GW Server hostname', required=False)
+        parser.add_argument('--shards', default=self.args['shards'],
+                            help='Number of Blotter shards', required=False)
+        parser.add_argument('--shard', default=self.args['shard'],
+                            help='Shard to run (0 to shards-1, '
+                                 'default: run the proxy)', required=False)
+        parser.add_argument('--zmqbackend', default=self.args['zmqbackend'],
+                            help='Port shards publish on (default: '
+                                 'zmqport + 1)', required=False)
         parser.add_argument('--zmqport', default=self.args['zmqport'],
                             help='ZeroMQ Port to use', required=False)
+        parser.add_argument('--zmqformat', default=self.args['zmqformat'],
+                            choices=protocol.FORMATS,
+                            help='ZeroMQ message format', required=False)
+        parser.add_argument('--shm', action='store_true',
+                            help='Publish via shared memory to local algos',
+                            required=False)
         parser.add_argument('--orderbook', action='store_true',
                             help='Get Order Book (Market Depth) data',
                             required=False)
+        parser.add_argument('--orderbookmode',
+                            default=self.args['orderbookmode'],
+                            choices=['delta', 'snapshot'],
+                            help='Order book message format', required=False)
+        parser.add_argument('--orderbookrate',
+                            default=self.args['orderbookrate'],
+                            help='Min seconds between order book messages',
+                            required=False)
+        parser.add_argument('--orderbooksnapshot',
+                            default=self.args['orderbooksnapshot'],
+                            help='Seconds between order book snapshots',
+                            required=False)
         parser.add_argument('--dbhost', default=self.args['dbhost'],
                             help='MySQL server hostname', required=False)
         parser.add_argument('--dbport', default=self.args['dbport'],
@@ -304,6 +473,73 @@ class Blotter():
         parser.add_argument('--dbskip', default=self.args['dbskip'],
                             required=False, help='Skip MySQL logging (flag)',
                             action='store_true')
+        parser.add_argument('--dbschema', default=self.args['dbschema'],
+                            choices=['default', 'partitioned'],
+                            help='MySQL ticks/bars schema', required=False)
+        parser.add_argument('--tickretention',
+                            default=self.args['tickretention'],
+                            help='Days of ticks to keep (partitioned schema)',
+                            required=False)
+        parser.add_argument('--storage', default=self.args['storage'],
+                            choices=['mysql', 'archive'],
+                            help='Tick/Bar storage backend', required=False)
+        parser.add_argument('--archive', default=self.args['archive'],
+                            help='Tick/Bar archive path (--storage archive)',
+                            required=False)
+        parser.add_argument('--dbbatch', default=self.args['dbbatch'],
+                            help='Max rows per MySQL commit', required=False)
+        parser.add_argument('--dbflush', default=self.args['dbflush'],
+                            help='Max seconds between MySQL commits',
+                            required=False)
+        parser.add_argument('--dbqueue', default=self.args['dbqueue'],
+                            help='Max rows waiting to be written to MySQL',
+                            required=False)
+        parser.add_argument('--journal', default=self.args['journal'],
+                            help='Journal ticks/bars to this directory '
+                                 'before writing them to MySQL',
+                            required=False)
+        parser.add_argument('--rollups', default=self.args['rollups'],
+                            help='Bar rollups to maintain (eg. 5T,1H,1D)',
+                            required=False)
+        parser.add_argument('--quotepolicy', default=self.args['quotepolicy'],
+                            choices=['queue', 'drop', 'coalesce'],
+                            help='Handling of backlogged quotes',
+                            required=False)
+        parser.add_argument('--quoterate', default=self.args['quoterate'],
+                            help='Min seconds between quotes per symbol',
+                            required=False)
+        parser.add_argument('--quotemove', action='store_true',
+                            help='Publish bid/ask price moves right away',
+                            required=False)
+        parser.add_argument('--backfillpace',
+                            default=self.args['backfillpace'],
+                            help='Max historical data requests per 10 minutes',
+                            required=False)
+        parser.add_argument('--backfillinflight',
+                            default=self.args['backfillinflight'],
+                            help='Max concurrent historical data requests',
+                            required=False)
+        parser.add_argument('--telemetryport',
+                            default=self.args['telemetryport'],
+                            help='Local HTTP port for runtime metrics',
+                            required=False)
+        parser.add_argument('--telemetrylog',
+                            default=self.args['telemetrylog'],
+                            help='Log runtime metrics every N seconds',
+                            required=False)
+        parser.add_argument('--replay', default=self.args['replay'],
+                            help='Replay stored data from date/time '
+                                 '(instead of streaming from IB)',
+                            required=False)
+        parser.add_argument('--replayend', default=self.args['replayend'],
+                            help='Replay until date/time', required=False)
+        parser.add_argument('--replayspeed',
+                            default=self.args['replayspeed'],
+                            help='Replay speed (0 = as fast as possible)',
+                            required=False)
+        parser.add_argument('--replaycsv', default=self.args['replaycsv'],
+                            help='Replay CSV files from this directory',
+                            required=False)
 
         # only return non-default cmd line args
         # (meaning only those actually given)
@@ -314,6 +550,14 @@ class Blotter():
 
     # -------------------------------------------
     def ibCallback(self, caller, msg, **kwargs):
+        start = time.perf_counter()
+        try:
+            self._on_ib_callback(caller, msg, **kwargs)
+        finally:
+            self.telemetry.observe(
+                "ib." + caller, time.perf_counter() - start)
+
+    def _on_ib_callback(self, caller, msg, **kwargs):
 
         if caller == "handleConnectionClosed":
             self.log_blotter.info("Lost conncetion to Interactive Brokers...")
@@ -324,16 +568,28 @@ class Blotter():
             self.on_ohlc_received(msg, kwargs)
 
         elif caller == "handleTickString":
-            self.on_tick_string_received(msg.tickerId, kwargs)
+            self._dispatch(msg.tickerId, self.on_tick_string_received,
+                           msg.tickerId, kwargs)
 
         elif caller == "handleTickPrice" or caller == "handleTickSize":
-            self.on_quote_received(msg.tickerId)
+            self._dispatch(msg.tickerId, self.on_quote_received,
+                           msg.tickerId, policy=self.args['quotepolicy'])
 
         elif caller in "handleTickOptionComputation":
-            self.on_option_computation_received(msg.tickerId)
+            self._dispatch(msg.tickerId, self.on_option_computation_received,
+                           msg.tickerId)
 
         elif caller == "handleMarketDepth":
-            self.on_orderbook_received(msg.tickerId)
+            # apply level updates in order (only publishing is conflated)
+            book = self.books.get(msg.tickerId)
+            if book is None:
+                book = self.books.setdefault(msg.tickerId, OrderBook())
+            with book.lock:
+                book.update(msg.position, msg.operation, msg.side,
+                            msg.price, msg.size)
+
+            self._dispatch(msg.tickerId, self.on_orderbook_received,
+                           msg.tickerId, policy=self.args['quotepolicy'])
 
         elif caller == "handleError":
             # don't display connection errors on ctrl+c
@@ -341,6 +597,10 @@ class Blotter():
                     msg.errorCode in ibDataTypes["DISCONNECT_ERROR_CODES"]:
                 return
 
+            # historical data request errors
+            if self._on_backfill_error(msg):
+                return
+
             # errorCode can be None...
             if 1100 <= msg.errorCode < 2200 or msg.errorCode == 0:
                 self.log_blotter.warning(
@@ -349,17 +609,22 @@ class Blotter():
                 self.log_blotter.error(
                     '[IB #%d] %s', msg.errorCode, msg.errorMsg)
 
+    # -------------------------------------------
+    def _dispatch(self, tickerId, func, *args, policy="queue"):
+        """ run market data handlers on the worker owning this ticker id
+        (keeps each symbol's events in order) """
+        if self.workers is None:
+            return func(*args)
+        return self.workers.submit(tickerId, func, *args, policy=policy)
+
     # -------------------------------------------
     def on_ohlc_received(self, msg, kwargs):
         symbol = self.ibConn.tickerSymbol(msg.reqId)
+        scheduler = self._backfill_scheduler
 
         if kwargs["completed"]:
-            self.backfilled_symbols.append(symbol)
-            tickers = set(
-                {v: k for k, v in self.ibConn.tickerIds.items() if v.upper() != "SYMBOL"}.keys())
-            if tickers == set(self.backfilled_symbols):
-                self.backfilled = True
-                print(".")
+            if scheduler is not None:
+                scheduler.completed(symbol)
 
             try:
                 self.ibConn.cancelHistoricalData(
@@ -393,13 +658,34 @@ class Blotter():
                 data["volume"] = int(msg.volume)
                 data["kind"] = "BAR"
 
-            print(data)
+            # store in db (in bulk, once the chunk is complete)
+            if scheduler is not None:
+                scheduler.received(symbol, data)
+            else:
+                self.log2db(data, data["kind"])
+
+    # -------------------------------------------
+    def _on_backfill_error(self, msg):
+        """ routes historical data request errors to the backfill """
+        scheduler = self._backfill_scheduler
+        if scheduler is None or msg.errorCode not in (162, 165, 166, 200, 321):
+            return False
+
+        symbol = self.ibConn.tickerSymbol(msg.id)
+        error = str(msg.errorMsg)
 
-            # store in db
-            self.log2db(data, data["kind"])
+        if "pacing" in error.lower():
+            scheduler.failed(symbol, error)
+        elif "returned no data" in error.lower():
+            # nothing to backfill for this chunk
+            scheduler.completed(symbol)
+        else:
+            scheduler.failed(symbol, error, retry=False)
+            return False
+
+        return True
 
     # -------------------------------------------
-    @asynctools.multitasking.task
     def on_tick_string_received(self, tickerId, kwargs):
 
         # kwargs is empty
@@ -466,7 +752,6 @@ class Blotter():
             self.on_tick_received(data)
 
     # -------------------------------------------
-    @asynctools.multitasking.task
     def on_quote_received(self, tickerId):
         try:
 
@@ -504,17 +789,22 @@ class Blotter():
                 if symbol in self.cash_ticks.keys() and quote['last'] != self.cash_ticks[symbol]:
                     self.on_tick_received(quote)
                 else:
-                    self.broadcast(quote, "QUOTE")
+                    self._broadcast_quote(quote)
 
                 self.cash_ticks[symbol] = quote['last']
             else:
-                self.broadcast(quote, "QUOTE")
+                self._broadcast_quote(quote)
 
         except Exception as e:
             pass
 
+    def _broadcast_quote(self, quote):
+        if self.quote_conflator is None:
+            self.broadcast(quote, "QUOTE")
+        else:
+            self.quote_conflator.submit(quote["symbol"], quote)
+
     # -------------------------------------------
-    @asynctools.multitasking.task
     def on_option_computation_received(self, tickerId):
         # try:
         symbol = self.ibConn.tickerSymbol(tickerId)
@@ -582,29 +872,60 @@ class Blotter():
         # otherwise treat as quote
         else:
             tick["kind"] = "QUOTE"
-            self.broadcast(tick, "QUOTE")
+            self._broadcast_quote(tick)
 
         # except Exception as e:
             # pass
 
     # -------------------------------------------
-    @asynctools.multitasking.task
     def on_orderbook_received(self, tickerId):
-        orderbook = self.ibConn.marketDepthData[tickerId].dropna(
-            subset=['bid', 'ask']).fillna(0).to_dict(orient='list')
+        book = self.books.get(tickerId)
+        if book is None:
+            return
 
-        # add symbol data to list
-        symbol = self.ibConn.tickerSymbol(tickerId)
-        orderbook['symbol'] = symbol
-        orderbook["symbol_group"] = tools.gen_symbol_group(symbol)
-        orderbook["asset_class"] = tools.gen_asset_class(symbol)
-        orderbook["kind"] = "ORDERBOOK"
+        now = time.time()
+        state = self._book_state.setdefault(
+            tickerId, {"published": 0, "snapshot": 0, "scheduled": False})
+
+        with book.lock:
+            if not book.changed:
+                return
+
+            # conflate updates until the next message is due
+            wait = state["published"] + \
+                float(self.args['orderbookrate']) - now
+            if wait > 0:
+                if not state["scheduled"]:
+                    state["scheduled"] = True
+                    threading.Timer(wait, self._dispatch, args=(
+                        tickerId, self.on_orderbook_received, tickerId),
+                        kwargs={"policy": self.args['quotepolicy']}).start()
+                return
+
+            state["scheduled"] = False
+            state["published"] = now
 
-        # broadcast
-        self.broadcast(orderbook, "ORDERBOOK")
+            if self.args['orderbookmode'] == "snapshot" or \
+                    now - state["snapshot"] >= \
+                    float(self.args['orderbooksnapshot']):
+                state["snapshot"] = now
+                orderbook = book.snapshot()
+                orderbook["snapshot"] = True
+            else:
+                orderbook = {"levels": book.delta(), "snapshot": False}
+            orderbook["seq"] = book.seq
+
+            # add symbol data to list
+            symbol = self.ibConn.tickerSymbol(tickerId)
+            orderbook['symbol'] = symbol
+            orderbook["symbol_group"] = tools.gen_symbol_group(symbol)
+            orderbook["asset_class"] = tools.gen_asset_class(symbol)
+            orderbook["kind"] = "ORDERBOOK"
+
+            # broadcast (in sequence)
+            self.broadcast(orderbook, "ORDERBOOK")
 
     # -------------------------------------------
-    @asynctools.multitasking.task
     def on_tick_received(self, tick):
         # data
         symbol = tick['symbol']
@@ -621,60 +942,73 @@ class Blotter():
         except Exception as e:
             pass
 
-        # placeholders
-        if symbol not in self._raw_bars:
-            self._raw_bars[symbol] = self._raw_bars['~']
-
-        if symbol not in self._bars:
-            self._bars[symbol] = self._bars['~']
+        # placeholder
+        if symbol not in self._bar_builders:
+            self._bar_builders[symbol] = BarBuilder()
 
         # send tick to message self.broadcast
         tick["kind"] = "TICK"
         self.broadcast(tick, "TICK")
         self.log2db(tick, "TICK")
 
-        # add tick to raw self._bars
-        tick_data = pd.DataFrame(index=['timestamp'],
-                                 data={'timestamp': timestamp,
-                                       'last': tick['last'],
-                                       'volume': tick['lastsize']})
-        tick_data.set_index(['timestamp'], inplace=True)
-        _raw_bars = self._raw_bars[symbol].copy()
-        _raw_bars = _raw_bars.append(tick_data)
-
-        # add tools.resampled raw to self._bars
-        ohlc = _raw_bars['last'].resample('1T').ohlc()
-        vol = _raw_bars['volume'].resample('1T').sum()
-        vol = _raw_bars['volume'].resample('1T').sum()
-
-        opened_bar = ohlc
-        opened_bar['volume'] = vol
-
-        # add bar to self._bars object
-        previous_bar_count = len(self._bars[symbol])
-        self._bars[symbol] = self._bars[symbol].append(opened_bar)
-        self._bars[symbol] = self._bars[symbol].groupby(
-            self._bars[symbol].index).last()
-
-        if len(self._bars[symbol].index) > previous_bar_count:
-
-            bar = self._bars[symbol].to_dict(orient='records')[0]
-            bar["symbol"] = symbol
-            bar["symbol_group"] = tick['symbol_group']
-            bar["asset_class"] = tick['asset_class']
-            bar["timestamp"] = self._bars[symbol].index[0].strftime(
-                ibDataTypes["DATE_TIME_FORMAT_LONG"])
+        # add tick to the symbol's open 1-minute bar
+        finished = self._bar_builders[symbol].update(
+            timestamp, float(tick['last']), int(tick['lastsize']))
+
+        if finished is not None:
+            minute, bar_open, bar_high, bar_low, bar_close, volume = finished
+            bar = {
+                "open":         bar_open,
+                "high":         bar_high,
+                "low":          bar_low,
+                "close":        bar_close,
+                "volume":       volume,
+                "symbol":       symbol,
+                "symbol_group": tick['symbol_group'],
+                "asset_class":  tick['asset_class'],
+                "timestamp":    minute.strftime(
+                    ibDataTypes["DATE_TIME_FORMAT_LONG"]),
+            }
 
             bar["kind"] = "BAR"
             self.broadcast(bar, "BAR")
             self.log2db(bar, "BAR")
 
-            self._bars[symbol] = self._bars[symbol][-1:]
-            _raw_bars.drop(_raw_bars.index[:], inplace=True)
-            self._raw_bars[symbol] = _raw_bars
-
     # -------------------------------------------
     def broadcast(self, data, kind):
+        start = time.perf_counter()
+        try:
+            self._broadcast(data, kind)
+        finally:
+            end = time.perf_counter()
+            self.telemetry.message(kind, data.get("symbol"))
+            self.telemetry.observe("broadcast." + kind, end - start)
+
+            # time since IB's tick callback
+            if kind == "TICK" and self.workers is not None:
+                received = self.workers.task_submitted()
+                if received is not None:
+                    self.telemetry.observe("tick_to_broadcast",
+                                           end - received)
+
+    def _broadcast(self, data, kind):
+        # local algos read ticks/bars/quotes from shared memory
+        if self.shmbus is not None:
+            try:
+                self.shmbus.publish(data, kind)
+            except Exception as e:
+                self.telemetry.count("shm.errors")
+                self.log_blotter.warning(
+                    "Cannot publish to shared memory (%s)", e)
+
+        if self.args["zmqformat"] == "binary":
+            try:
+                self.socket.send_multipart(
+                    protocol.encode(self.args["zmqtopic"], data, kind))
+            except Exception as e:
+                self.telemetry.count("zmq.errors")
+            return
+
         def int64_handler(o):
             if isinstance(o, np_int64):
                 try:
@@ -684,18 +1018,44 @@ class Blotter():
                     return int(o)
             raise TypeError
 
-        string2send = "%s %s" % (
+        # symbol/kind prefix lets clients subscribe selectively
+        string2send = "%s%s %s" % (
+            protocol.text_topic(data["symbol"], kind),
             self.args["zmqtopic"], json.dumps(data, default=int64_handler))
 
         # print(kind, string2send)
         try:
             self.socket.send_string(string2send)
         except Exception as e:
-            pass
+            self.telemetry.count("zmq.errors")
 
     # -------------------------------------------
     def log2db(self, data, kind):
-        if self.args['dbskip'] or len(data["symbol"].split("_")) > 2:
+        start = time.perf_counter()
+        try:
+            return self._log2db(data, kind)
+        finally:
+            self.telemetry.observe(
+                "log2db." + kind, time.perf_counter() - start)
+
+    def _log2db(self, data, kind):
+        if len(data["symbol"].split("_")) > 2:
+            return
+
+        # clients (eg. an algo's backfill) write to the archive directly
+        if self.dbwriter is None and self.args.get("storage") == "archive":
+            self.dbwriter = self._archive_writer()
+            atexit.register(self.dbwriter.stop)
+
+        if self.args['dbskip'] and self.dbwriter is None:
+            return
+
+        # queue for the batched writer (running blotter)
+        if self.dbwriter is not None:
+            greeks = None
+            if kind == "BAR" and data["asset_class"] in ("OPT", "FOP"):
+                greeks = dict(self.cash_ticks.get(data['symbol'], {}))
+            self.dbwriter.write(dict(data), kind, greeks)
             return
 
         # connect to mysql per call (thread safe)
@@ -707,25 +1067,18 @@ class Blotter():
             dbcurr = self.dbcurr
 
         # set symbol details
-        symbol_id = 0
-        symbol = data["symbol"].replace("_" + data["asset_class"], "")
-
-        if symbol in self.symbol_ids.keys():
-            symbol_id = self.symbol_ids[symbol]
-        else:
-            symbol_id = get_symbol_id(
-                data["symbol"], dbconn, dbcurr, self.ibConn)
-            self.symbol_ids[symbol] = symbol_id
+        symbol_id = self._get_symbol_id(data, dbconn, dbcurr)
 
         # insert to db
+        partitioned = self.partitioned
         if kind == "TICK":
             try:
-                mysql_insert_tick(data, symbol_id, dbcurr)
+                mysql_insert_tick(data, symbol_id, dbcurr, partitioned)
             except Exception as e:
                 pass
         elif kind == "BAR":
             try:
-                mysql_insert_bar(data, symbol_id, dbcurr)
+                mysql_insert_bar(data, symbol_id, dbcurr, partitioned)
             except Exception as e:
                 pass
 
@@ -740,6 +1093,157 @@ class Blotter():
             dbcurr.close()
             dbconn.close()
 
+    # -------------------------------------------
+    @property
+    def archive(self):
+        if not hasattr(self, "_archive"):
+            self._archive = Archive(self.args['archive'])
+        return self._archive
+
+    def _journal_path(self):
+        """ journal directory (relative paths are from the caller's) """
+        journal = os.path.join(path['caller'], str(self.args['journal']))
+        if self.shard is not None:
+            journal = os.path.join(journal, "shard%d" % self.shard)
+        return journal
+
+    def _archive_writer(self):
+        return ArchiveWriter(
+            archive=self.archive,
+            expiry=tools.contract_expiry_from_symbol,
+            flush_interval=float(self.args['dbflush']),
+            max_queue=int(self.args['dbqueue']),
+            coverage=self.coverage,
+            rollups=self.rollups,
+            logger=self.log_blotter
+        ).start()
+
+    # -------------------------------------------
+    @property
+    def coverage(self):
+        """ time ranges stored per symbol (None when not storing data) """
+        if not hasattr(self, "_coverage"):
+            if self.args['storage'] == "archive":
+                self._coverage = ArchiveCoverage(self.archive)
+            elif self.args['dbskip']:
+                self._coverage = None
+            else:
+                self._coverage = MySQLCoverage(
+                    connect=self.get_mysql_connection,
+                    symbol_id=lambda symbol, dbconn, dbcurr: get_symbol_id(
+                        symbol, dbconn, dbcurr, self.ibConn))
+        return self._coverage
+
+    # -------------------------------------------
+    @property
+    def rollups(self):
+        """ maintained bar rollup resolutions (see ``qtpylib.rollups``) """
+        return parse_rollups(self.args.get('rollups'))
+
+    def _init_rollups(self):
+        """ builds rollups that have no data yet from the stored bars """
+        for resolution in self.rollups:
+            if self.args['storage'] == "archive":
+                if archive_table(resolution) in self.archive.manifest()[
+                        "partitions"]:
+                    continue
+            elif self.args['dbskip']:
+                return
+            else:
+                self.dbcurr.execute("""SELECT 1 FROM `rollups`
+                    WHERE `resolution`=%s LIMIT 1""", (resolution,))
+                if self.dbcurr.fetchone() is not None:
+                    continue
+
+            self.log_blotter.info(
+                "Building %s rollups from stored bars...", resolution)
+            self.rebuild_rollups(resolutions=[resolution])
+
+    def rebuild_rollups(self, start=None, end=None, resolutions=None):
+        """Rebuilds bar rollups from the stored 1-minute bars
+        (eg. after importing bars directly into the database)
+
+        :Optional:
+            start : str / datetime
+                Rebuild periods from this time (UTC, default: all)
+            end : str / datetime
+                Rebuild periods until this time (UTC, default: all)
+            resolutions : list
+                Rollups to rebuild (default: the ``rollups`` argument)
+        """
+        if resolutions is None:
+            resolutions = self.rollups
+
+        for resolution in resolutions:
+            seconds = resolution_seconds(resolution)
+
+            if self.args['storage'] == "archive":
+                # whole days (partitions)
+                self.archive.rebuild_rollup(
+                    resolution,
+                    None if start is None else str(to_utc(start).date()),
+                    None if end is None else str(to_utc(end).date()))
+                continue
+
+            if self.args['dbskip']:
+                return
+
+            self.mysql_connect()
+            first, last = "1970-01-01", "9999-12-31"
+            if start is not None:
+                first = period_bounds(start, start, seconds)[0]
+            if end is not None:
+                last = period_bounds(end, end, seconds)[1]
+            try:
+                self.dbcurr.execute(REBUILD_SQL, (
+                    resolution, seconds, seconds, first, last))
+                self.dbconn.commit()
+            except Exception as e:
+                self.dbconn.rollback()
+                self.log_blotter.error(
+                    "Cannot build %s rollups (%s)", resolution, e)
+
+    # -------------------------------------------
+    def _get_symbol_id(self, data, dbconn, dbcurr):
+        symbol = data["symbol"].replace("_" + data["asset_class"], "")
+
+        if symbol not in self.symbol_ids.keys():
+            self.symbol_ids[symbol] = get_symbol_id(
+                data["symbol"], dbconn, dbcurr, self.ibConn)
+
+        return self.symbol_ids[symbol]
+
+    # -------------------------------------------
+    def _observe_task(self, name, wait, run):
+        self.telemetry.observe("queue." + name, wait)
+        self.telemetry.observe("handler." + name, run)
+
+    def _start_telemetry(self):
+        """ registers queue gauges and starts the metrics endpoint/log
+        (once, as ``run()`` is called again on reconnection) """
+        if self._telemetry_started:
+            return
+        self._telemetry_started = True
+
+        def stats(name):
+            obj = getattr(self, name)
+            return obj.stats() if obj is not None else None
+
+        self.telemetry.gauge("workers", lambda: stats("workers"))
+        self.telemetry.gauge("dbwriter", lambda: stats("dbwriter"))
+        self.telemetry.gauge("quotes", lambda: stats("quote_conflator"))
+        self.telemetry.gauge("threads", asynctools.multitasking.stats)
+
+        if int(self.args['telemetryport']) > 0:
+            host, port = self.telemetry.serve(
+                int(self.args['telemetryport']) + (self.shard or 0))
+            self.log_blotter.info(
+                "Serving telemetry on http://%s:%d/", host, port)
+
+        if float(self.args['telemetrylog']) > 0:
+            self.telemetry.log_every(
+                float(self.args['telemetrylog']), self.log_blotter)
+
     # -------------------------------------------
     def run(self):
         """Starts the blotter
@@ -748,26 +1252,100 @@ class Blotter():
         and broadcast it over TCP via ZeroMQ (which algo subscribe to)
         """
 
+        # let clients know which wire protocol we publish
+        self.args["zmqversion"] = protocol.VERSION
+
+        if self.args['replay']:
+            return self.replay(self.args['replay'], self.args['replayend'],
+                               speed=self.args['replayspeed'],
+                               csv_path=self.args['replaycsv'])
+
         self._check_unique_blotter()
 
-        # connect to mysql
-        self.mysql_connect()
+        # connect to mysql (ticks/bars stored in the archive don't need it)
+        if self.args['storage'] != "archive":
+            self.mysql_connect()
+
+        # shared housekeeping (done by the proxy when sharded)
+        if self.shard is None:
+            # roll up stored bars (only when a rollup is first enabled)
+            self._init_rollups()
+
+            # add upcoming day partitions / drop expired ticks
+            if self.partitioned and self.dbconn is not None:
+                self._maintain_partitions()
+                self.partitions_timer = asynctools.RecurringTask(
+                    self._maintain_partitions, interval_sec=3600,
+                    init_sec=3600, daemon=True)
+
+        if self.sharded and self.shard is None:
+            return self._run_proxy()
+
+        # start the batched tick/bar writer
+        if self.args['storage'] == "archive":
+            self.dbwriter = self._archive_writer()
+        elif not self.args['dbskip']:
+            self.dbwriter = DBWriter(
+                connect=self.get_mysql_connection,
+                symbol_id=self._get_symbol_id,
+                batch_size=int(self.args['dbbatch']),
+                flush_interval=float(self.args['dbflush']),
+                max_queue=int(self.args['dbqueue']),
+                coverage=self.coverage,
+                rollups=self.rollups,
+                partitioned=self.partitioned,
+                logger=self.log_blotter
+            )
+
+            # journal first, drain into mysql in the background
+            if self.args['journal']:
+                self.dbwriter = Journal(
+                    path=self._journal_path(),
+                    writer=self.dbwriter,
+                    batch_size=int(self.args['dbbatch']),
+                    flush_interval=float(self.args['dbflush']),
+                    logger=self.log_blotter)
+
+            self.dbwriter.start()
 
         self.context = zmq.Context(zmq.REP)
         self.socket = self.context.socket(zmq.PUB)
-        self.socket.bind("tcp://*:" + str(self.args['zmqport']))
+        if self.shard is None:
+            self.socket.bind("tcp://*:" + str(self.args['zmqport']))
+        else:
+            self.socket.connect("tcp://127.0.0.1:%d" % sharding.backend_port(
+                self.args['zmqport'], self.args['zmqbackend']))
+
+        if self.args['shm']:
+            self.shmbus = shmbus.ShmPublisher(self.name)
 
         db_modified = 0
         contracts = []
         prev_contracts = []
         first_run = True
 
+        # market data handlers (one queue per worker thread)
+        self.workers = asynctools.WorkerPool(
+            workers=self.threads, name=self.name,
+            observer=self._observe_task)
+
+        # only publish the latest quote per symbol (every quoterate sec)
+        if float(self.args['quoterate']) > 0:
+            self.quote_conflator = asynctools.Conflator(
+                publish=lambda quote: self.broadcast(quote, "QUOTE"),
+                interval=float(self.args['quoterate']),
+                urgent=quote_moved if self.args['quotemove'] else None,
+                name="%s-quotes" % self.name)
+
+        self._start_telemetry()
+
         self.log_blotter.info("Connecting to Interactive Brokers...")
         self.ibConn = ezIBpy()
         self.ibConn.ibCallback = self.ibCallback
 
         while not self.ibConn.connected:
-            self.ibConn.connect(clientId=int(self.args['ibclient']),
+            self.ibConn.connect(clientId=int(self.args['ibclient']) + (
+                                    self.shard or 0),
                                 port=int(self.args['ibport']), host=str(self.args['ibserver']))
             time.sleep(1)
             if not self.ibConn.connected:
@@ -834,6 +1412,13 @@ class Blotter():
                     df = df[~df['symbol'].str.contains("#")]
                     contracts = [tuple(x) for x in df.values]
 
+                    # this shard's partition of the symbols
+                    if self.shard is not None:
+                        contracts = [contract for contract in contracts
+                                     if sharding.shard_of(
+                                         contract, self.args['shards'])
+                                     == self.shard]
+
                     if first_run:
                         first_run = False
 
@@ -878,78 +1463,270 @@ class Blotter():
                 "\n\n>>> Interrupted with Ctrl-c...\n(waiting for running tasks to be completed)\n")
             # asynctools.multitasking.killall() # stop now
             asynctools.multitasking.wait_for_tasks()  # wait for threads to complete
+            if self.workers is not None:
+                self.workers.stop(timeout=5)
+                self.workers = None
             sys.exit(1)
 
     # -------------------------------------------
-    # CLIENT / STATIC
-    # -------------------------------------------
-    def _fix_history_sequence(self, df, table):
-        """ fix out-of-sequence ticks/bars """
+    @property
+    def sharded(self):
+        return int(self.args.get('shards') or 1) > 1
+
+    def _run_proxy(self):
+        """ republishes the shards' messages on zmqport (until ctrl+c) """
+        backend = sharding.backend_port(self.args['zmqport'],
+                                        self.args['zmqbackend'])
+        proxy = sharding.ShardProxy(self.args['zmqport'], backend).start()
+        self.log_blotter.info(
+            "Republishing %s shards (port %d) on port %s...",
+            self.args['shards'], backend, self.args['zmqport'])
 
-        # remove "Unnamed: x" columns
-        cols = df.columns[df.columns.str.startswith('Unnamed:')].tolist()
-        df.drop(cols, axis=1, inplace=True)
+        try:
+            while True:
+                time.sleep(1)
+        except (KeyboardInterrupt, SystemExit):
+            self.quitting = True
+            proxy.stop()
+            sys.exit(1)
 
-        # remove future dates
-        df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
-        blacklist = df[df['datetime'] > pd.to_datetime('now', utc=True)]
-        df = df.loc[set(df.index) - set(blacklist)]  # .tail()
+    # -------------------------------------------
+    def replay(self, start, end=None, symbols="*", speed=1, csv_path=None,
+               kinds=("TICK", "BAR"), wait=True, chunksize=10000):
+        """Replays stored ticks/bars to algos, instead of streaming from IB
 
-        # loop through data, symbol by symbol
-        dfs = []
-        bad_ids = [blacklist['id'].values.tolist()]
+        Messages are published in timestamp order, same as live data,
+        so algos run normally (``Blotter.stream()`` and handlers).
 
-        for symbol_id in list(df['symbol_id'].unique()):
+        :Parameters:
+            start : str / datetime
+                Replay from (UTC)
 
-            data = df[df['symbol_id'] == symbol_id].copy()
+        :Optional:
+            end : str / datetime
+                Replay until (UTC, default: all)
+            symbols : list
+                Symbols to replay (default: all)
+            speed : float
+                Replay speed, as a multiple of real time. Use 0 to publish
+                as fast as the algos handle the messages (default: 1)
+            csv_path : str
+                Replay ``workflow.prepare_data()`` CSV files from this
+                directory (default: read from the database / archive)
+            kinds : list
+                Message kinds to replay (default: TICK and BAR)
+            wait : bool
+                Wait for an algo to subscribe before starting (default: True)
 
-            # sort by id
-            data.sort_values('id', axis=0, ascending=True, inplace=False)
+        :Returns:
+            stats : dict
+                Published messages, seconds, rate and max lag
+        """
+        if isinstance(symbols, str):
+            symbols = symbols.split(',')
 
-            # convert index to column
-            data.loc[:, "ix"] = data.index
-            data.reset_index(inplace=True)
+        # algos read from zeromq
+        self.args["zmqversion"] = protocol.VERSION
+        self.args['shm'] = False
+        self._check_unique_blotter()
 
-            # find out of sequence ticks/bars
-            malformed = data.shift(1)[(data['id'] > data['id'].shift(1)) & (
-                data['datetime'] < data['datetime'].shift(1))]
+        # publishing blocks (instead of dropping messages)
+        # while subscribers are backlogged
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.XPUB)
+        self.socket.setsockopt(zmq.XPUB_NODROP, 1)
+        self.socket.bind("tcp://*:" + str(self.args['zmqport']))
 
-            # cleanup rows
-            if malformed.empty:
-                # if all rows are in sequence, just remove last row
-                dfs.append(data)
+        streams = []
+        for kind in kinds:
+            if csv_path:
+                chunks = [replay.read_csv(csv_path, kind, symbols,
+                                          start, end)]
             else:
-                # remove out of sequence rows + last row from data
-                index = [
-                    x for x in data.index.values if x not in malformed['ix'].values]
-                dfs.append(data.loc[index])
+                chunks = self._replay_chunks(kind, symbols, start, end,
+                                             chunksize)
+            streams.append(replay.iter_messages(chunks, kind))
+
+        if wait:
+            self.log_blotter.info("Waiting for algos to subscribe...")
+            while not self.socket.poll(1000):
+                pass
+
+        self.log_blotter.info("Replaying %s from %s (speed: %s)...",
+                              ", ".join(kinds), start, speed or "max")
+        replayer = replay.Replayer(publish=self.broadcast, speed=speed,
+                                   logger=self.log_blotter)
+        try:
+            stats = replayer.run(replay.merge(*streams))
+        except (KeyboardInterrupt, SystemExit):
+            self.quitting = True
+            replayer.stop()
+            sys.exit(1)
+
+        self.log_blotter.info(
+            "Replay completed: %(published)d messages in %(seconds).1fs "
+            "(max lag: %(max_lag).3fs)", stats)
+        return stats
+
+    def _replay_chunks(self, kind, symbols, start, end, chunksize):
+        """ raw, time-ordered ticks/bars (from the archive or mysql) """
+        table = "ticks" if kind == "TICK" else "bars"
+
+        if self.args['storage'] == "archive":
+            return self.archive.iter_read(symbols, to_utc(start),
+                                          to_utc(end), table)
+
+        query = """SELECT tbl.*,
+            CONCAT(s.`symbol`, "_", s.`asset_class`) as symbol, s.symbol_group, s.asset_class
+            FROM `{TABLE}` tbl LEFT JOIN `symbols` s ON tbl.symbol_id = s.id
+            WHERE tbl.`datetime` >= %s """.replace('{TABLE}', table)
+        params = [to_utc(start).tz_localize(None).to_pydatetime()]
+
+        if end is not None:
+            query += """ AND tbl.`datetime` <= %s """
+            params.append(to_utc(end).tz_localize(None).to_pydatetime())
+
+        if symbols[0].strip() != "*":
+            query += """ AND CONCAT(s.`symbol`, "_", s.`asset_class`) IN ({SYMBOLS}) """.replace(
+                '{SYMBOLS}', ",".join(["%s"] * len(symbols)))
+            params += [symbol.strip() for symbol in symbols]
+
+        query += """ ORDER BY tbl.`datetime` """
+        return self._query_chunks(query, params, chunksize)
+
+    # -------------------------------------------
+    # CLIENT / STATIC
+    # -------------------------------------------
+    def _fix_history_sequence(self, df, table, cleanup=True):
+        """ fix out-of-sequence ticks/bars
 
-                # add to bad id list (to remove from db)
-                bad_ids.append(list(malformed['id'].values))
+        Future-dated rows are dropped and, when ``cleanup`` is set,
+        deleted from the database. Rows are returned in time order.
+        """
 
-        # combine all lists
-        data = pd.concat(dfs, sort=True)
+        # remove "Unnamed: x" columns
+        cols = df.columns[df.columns.str.startswith('Unnamed:')].tolist()
+        df = df.drop(cols, axis=1)
 
-        # flatten bad ids
-        bad_ids = sum(bad_ids, [])
+        # remove future dates
+        df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
+        bad = (df['datetime'] > pd.to_datetime('now', utc=True)).values
 
         # remove bad ids from db
-        if bad_ids:
-            bad_ids = list(map(str, map(int, bad_ids)))
-            self.dbcurr.execute("DELETE FROM greeks WHERE %s IN (%s)" % (
-                table.lower()[:-1] + "_id", ",".join(bad_ids)))
-            self.dbcurr.execute("DELETE FROM " + table.lower() +
-                                " WHERE id IN (%s)" % (",".join(bad_ids)))
-            try:
-                self.dbconn.commit()
-            except Exception as e:
-                self.dbconn.rollback()
+        if cleanup and bad.any():
+            self._delete_history_rows(table, df['id'].values[bad])
 
         # return
-        return data.drop(['id', 'ix', 'index'], axis=1)
+        df = df[~bad].sort_values('datetime', kind='mergesort')
+        return df.drop('id', axis=1).reset_index(drop=True)
+
+    def _delete_history_rows(self, table, ids, batch_size=1000):
+        """ delete ticks/bars (and their greeks) by id, in batches """
+        ids = [int(x) for x in ids]
+        table = table.lower()
+        try:
+            for ix in range(0, len(ids), batch_size):
+                batch = ids[ix:ix + batch_size]
+                in_ids = ",".join(["%s"] * len(batch))
+                self.dbcurr.execute("DELETE FROM `greeks` WHERE `%s_id` IN (%s)" % (
+                    table[:-1], in_ids), batch)
+                self.dbcurr.execute("DELETE FROM `%s` WHERE `id` IN (%s)" % (
+                    table, in_ids), batch)
+            self.dbconn.commit()
+        except Exception as e:
+            self.dbconn.rollback()
+
+    # -------------------------------------------
+    def history(self, symbols, start, end=None, resolution="1T", tz="UTC",
+                continuous=True, chunksize=None, cleanup=False, cache=False):
+        """Get historical data
+
+        :Parameters:
+            symbols : list
+                Symbols to get (``["*"]`` for all)
+            start : str / datetime
+                Start time (UTC)
+
+        :Optional:
+            end : str / datetime
+                End time (UTC)
+            resolution : str
+                Resolution (default: 1T)
+            tz : str
+                Timezone (default: UTC)
+            continuous : bool
+                Include other contracts of future symbols' groups
+                (default: True)
+            chunksize : int
+                Stream the data: returns a generator yielding a resampled
+                DataFrame per chunk of (about) ``chunksize`` raw rows,
+                in time order (default: None = return one DataFrame)
+            cleanup : bool
+                Delete future-dated ticks/bars from the database
+                (default: False = read-only access)
+            cache : bool / str
+                Serve from (and update) the local history cache, only
+                loading rows newer than the cached data. Use ``refresh``
+                to reload and re-cache everything (default: False)
+
+        :Returns:
+            data : pd.DataFrame / generator
+                Historical data
+        """
+        if not cache or chunksize or resolution[-1] in ("K", "V"):
+            return self._load_history(symbols, start, end, resolution, tz,
+                                      continuous, chunksize, cleanup)
+
+        key = HistoryCache.key(symbols, resolution, continuous, tz,
+                               source=self._history_source())
+        start = to_utc(start)
+        end = to_utc(end)
+        until = end if end is not None else to_utc(datetime.utcnow())
+
+        cached, cached_start, cached_end = (None, None, None) if \
+            cache == "refresh" else self.history_cache.get(key)
+
+        if cached is None or cached.empty or start < cached_start:
+            data = self._load_history(symbols, start, end, resolution, tz,
+                                      continuous, cleanup=cleanup)
+            if not data.empty:
+                self.history_cache.put(key, data, start, until)
+            return data
+
+        # fetch new rows, starting from the (possibly incomplete) last period
+        if until > cached_end:
+            tail_start = to_utc(cached.index[-1])
+            tail = self._load_history(symbols, tail_start, end, resolution,
+                                      tz, continuous, cleanup=cleanup,
+                                      sync_last_timestamp=False)
+            if not tail.empty:
+                cached = pd.concat([cached[cached.index < tail_start], tail],
+                                   sort=False)
+            self.history_cache.put(key, cached, cached_start, until)
+
+        data = cached[cached.index >= start]
+        if end is not None:
+            data = data[data.index <= end]
+        return data.copy()
 
     # -------------------------------------------
-    def history(self, symbols, start, end=None, resolution="1T", tz="UTC", continuous=True):
+    @property
+    def history_cache(self):
+        if not hasattr(self, "_history_cache"):
+            self._history_cache = HistoryCache("%s/qtpylib_cache/%s" % (
+                tempfile.gettempdir(), self.name))
+        return self._history_cache
+
+    def _history_source(self):
+        """ identifies where history comes from (part of the cache key) """
+        if self.args.get("storage") == "archive":
+            return "archive:%s" % self.args['archive']
+        return "mysql:%s:%s/%s" % (self.args['dbhost'], self.args['dbport'],
+                                   self.args['dbname'])
+
+    def _load_history(self, symbols, start, end=None, resolution="1T",
+                      tz="UTC", continuous=True, chunksize=None,
+                      cleanup=False, sync_last_timestamp=True):
         # load runtime/default data
         if isinstance(symbols, str):
             symbols = symbols.split(',')
@@ -973,13 +1750,61 @@ class Blotter():
             except Exception as e:
                 pass
 
+        table = 'ticks' if resolution[-1] in ("K", "V", "S") else 'bars'
+
+        # read bars from the coarsest rollup that fits the resolution
+        # (options' bars, which may be part of "*", aren't rolled up)
+        # and the partial periods at either end from the minute bars
+        ranges = []
+        if table == 'bars' and symbols[0].strip() != "*" and not any(
+                symbol.strip()[-3:] in ("OPT", "FOP") for symbol in symbols):
+            rollup = best_rollup(resolution, self.rollups)
+            if rollup is not None:
+                ranges = rollup_ranges(start, end, rollup)
+
+        # read from the columnar archive
+        if self.args.get("storage") == "archive":
+            kwargs = dict(symbols=symbols,
+                          symbol_groups=symbol_groups if continuous else None)
+            reads = [dict(kwargs, start=range_start, end=range_end,
+                          table=table if rollup is None else archive_table(
+                              rollup))
+                     for rollup, range_start, range_end in ranges or [
+                         (None, start, end)]]
+            if chunksize:
+                return self._stream_history(itertools.chain.from_iterable(
+                    self.archive.iter_read(**read) for read in reads),
+                    table, resolution, tz)
+
+            data = pd.concat([self.archive.read(**read) for read in reads],
+                             ignore_index=True, sort=False)
+            if data.empty:
+                return data
+            return prepare_history(data=data, resolution=resolution,
+                                   tz=tz, continuous=True,
+                                   sync_last_timestamp=sync_last_timestamp)
+
         # connect to mysql
         self.mysql_connect()
 
         # --- build query
-        table = 'ticks' if resolution[-1] in ("K", "V", "S") else 'bars'
-
-        query = """SELECT tbl.*,
+        if ranges:
+            # a query per range (see below)
+            query = """SELECT tbl.`datetime`, tbl.`symbol_id`,
+            tbl.`open`, tbl.`high`, tbl.`low`, tbl.`close`, tbl.`volume`,
+            CONCAT(s.`symbol`, "_", s.`asset_class`) as symbol, s.symbol_group, s.asset_class, s.expiry
+            FROM `{TABLE}` tbl LEFT JOIN `symbols` s ON tbl.symbol_id = s.id
+            WHERE {RANGE} """
+            params = []
+        elif self.partitioned:
+            # greeks are stored inline
+            query = """SELECT tbl.*,
+            CONCAT(s.`symbol`, "_", s.`asset_class`) as symbol, s.symbol_group, s.asset_class, s.expiry
+            FROM `{TABLE}` tbl LEFT JOIN `symbols` s ON tbl.symbol_id = s.id
+            WHERE tbl.`datetime` >= %s """.replace('{TABLE}', table)
+            params = [start]
+        else:
+            query = """SELECT tbl.*,
             CONCAT(s.`symbol`, "_", s.`asset_class`) as symbol, s.symbol_group, s.asset_class, s.expiry,
             g.price AS opt_price, g.underlying AS opt_underlying, g.dividend AS opt_dividend,
             g.volume AS opt_volume, g.iv AS opt_iv, g.oi AS opt_oi,
@@ -987,39 +1812,121 @@ class Blotter():
             g.theta AS opt_theta, g.vega AS opt_vega
             FROM `{TABLE}` tbl LEFT JOIN `symbols` s ON tbl.symbol_id = s.id
             LEFT JOIN `greeks` g ON tbl.id = g.{TABLE_ID}
-            WHERE (`datetime` >= "{START}"{END_SQL}) """.replace(
-            '{START}', start).replace('{TABLE}', table).replace('{TABLE_ID}', table[:-1] + '_id')
+            WHERE tbl.`datetime` >= %s """.replace(
+                '{TABLE}', table).replace('{TABLE_ID}', table[:-1] + '_id')
+            params = [start]
 
-        if end is not None:
-            query = query.replace('{END_SQL}', ' AND `datetime` <= "{END}"')
-            query = query.replace('{END}', end)
-        else:
-            query = query.replace('{END_SQL}', '')
+        if end is not None and not ranges:
+            query += """ AND tbl.`datetime` <= %s """
+            params.append(end)
 
         if symbols[0].strip() != "*":
+            symbols = [symbol.strip() for symbol in symbols]
+            in_symbols = ",".join(["%s"] * len(symbols))
             if continuous:
-                query += """ AND ( s.`symbol_group` in ("{SYMBOL_GROUPS}") or
-                CONCAT(s.`symbol`, "_", s.`asset_class`) IN ("{SYMBOLS}") ) """
-                query = query.replace('{SYMBOLS}', '","'.join(symbols)).replace(
-                    '{SYMBOL_GROUPS}', '","'.join(symbol_groups))
+                query += """ AND ( s.`symbol_group` IN ({GROUPS}) OR
+                CONCAT(s.`symbol`, "_", s.`asset_class`) IN ({SYMBOLS}) ) """.replace(
+                    '{GROUPS}', ",".join(["%s"] * len(symbol_groups))).replace(
+                    '{SYMBOLS}', in_symbols)
+                params += symbol_groups + symbols
             else:
-                query += """ AND ( CONCAT(s.`symbol`, "_", s.`asset_class`) IN ("{SYMBOLS}") ) """
-                query = query.replace('{SYMBOLS}', '","'.join(symbols))
+                query += """ AND ( CONCAT(s.`symbol`, "_", s.`asset_class`) IN ({SYMBOLS}) ) """.replace(
+                    '{SYMBOLS}', in_symbols)
+                params += symbols
+
+        # rollup bars for whole periods, minute bars for the rest
+        if ranges:
+            queries = []
+            range_params = []
+            for rollup, range_start, range_end in ranges:
+                where = """tbl.`datetime` >= %s """
+                values = [range_start]
+                if range_end is not None:
+                    where += """ AND tbl.`datetime` <= %s """
+                    values.append(range_end)
+                if rollup is not None:
+                    where += """ AND tbl.`resolution` = %s """
+                    values.append(rollup)
+                queries.append(query.replace(
+                    '{TABLE}', 'bars' if rollup is None else 'rollups'
+                ).replace('{RANGE}', where))
+                range_params += values + params
+
+            query = """SELECT * FROM ( {QUERIES} ) tbl """.replace(
+                '{QUERIES}', " UNION ALL ".join(queries))
+            params = range_params
         # --- end build query
 
+        # stream using a server-side cursor
+        if chunksize:
+            query += """ ORDER BY tbl.`datetime` """
+            return self._stream_history(
+                self._query_chunks(query, params, chunksize),
+                table, resolution, tz, cleanup)
+
         # print("History Query:", query)
         # get data using pandas
-        data = pd.read_sql(query, self.dbconn)  # .dropna()
+        data = pd.read_sql(query, self.dbconn, params=params)  # .dropna()
 
         # no data in db
         if data.empty:
             return data
 
         # clearup records that are out of sequence
-        data = self._fix_history_sequence(data, table)
+        # (rows are in insert order by id, except in rollups/partitions)
+        if "id" in data.columns:
+            data = self._fix_history_sequence(data, table, cleanup)
 
         # setup dataframe
-        return prepare_history(data=data, resolution=resolution, tz=tz, continuous=True)
+        return prepare_history(data=data, resolution=resolution, tz=tz,
+                               continuous=True,
+                               sync_last_timestamp=sync_last_timestamp)
+
+    # -------------------------------------------
+    def _query_chunks(self, query, params, chunksize):
+        """ yields raw query results in DataFrames of ``chunksize`` rows """
+        dbconn = self.get_mysql_connection()
+        dbcurr = dbconn.cursor(pymysql.cursors.SSCursor)
+        try:
+            dbcurr.execute(query, params)
+            columns = [col[0] for col in dbcurr.description]
+            while True:
+                rows = dbcurr.fetchmany(int(chunksize))
+                if not rows:
+                    break
+                yield pd.DataFrame(list(rows), columns=columns)
+        finally:
+            try:
+                dbcurr.close()
+                dbconn.close()
+            except Exception as e:
+                pass
+
+    def _stream_history(self, chunks, table, resolution, tz, cleanup=False):
+        """ cleans and resamples time-ordered raw chunks """
+        pending = None
+        first = True
+
+        for data in chunks:
+            # clearup records that are out of sequence
+            if "id" in data.columns:
+                data = self._fix_history_sequence(data, table, cleanup)
+
+            if pending is not None:
+                data = pd.concat([pending, data], ignore_index=True, sort=False)
+
+            # hold back the last period, as it may continue in the next chunk
+            data, pending = split_history_period(data, resolution)
+            if data.empty:
+                continue
+
+            yield prepare_history(data=data, resolution=resolution, tz=tz,
+                                  continuous=True, sync_last_timestamp=first)
+            first = False
+
+        if pending is not None and not pending.empty:
+            yield prepare_history(data=pending, resolution=resolution, tz=tz,
+                                  continuous=True, sync_last_timestamp=first)
 
     # -------------------------------------------
     def stream(self, symbols, tick_handler=None, bar_handler=None,
@@ -1029,62 +1936,129 @@ class Blotter():
             symbols = symbols.split(',')
         symbols = list(map(str.strip, symbols))
 
+        # blotters that predate --zmqformat only speak json
+        binary = self.args.get("zmqformat", "json") == "binary"
+
+        # only subscribe to kinds we have handlers for
+        kinds = [kind for kind, handler in (
+            ("TICK", tick_handler), ("BAR", bar_handler),
+            ("QUOTE", quote_handler), ("ORDERBOOK", book_handler)
+        ) if handler is not None]
+
+        # co-located algos read ticks, bars and quotes from shared memory
+        # (remote algos, order books and options use zeromq)
+        shm = None
+        shm_symbols = []
+        if self.args.get("shm") and shmbus.ShmSubscriber.available(
+                self.name):
+            shm_symbols = [symbol for symbol in symbols
+                           if tools.gen_asset_class(symbol)
+                           not in shmbus.ZMQ_ASSET_CLASSES]
+        if shm_symbols:
+            shm = shmbus.ShmSubscriber(self.name, shm_symbols, kinds,
+                                       logger=self.log_blotter)
+
         # connect to zeromq self.socket
+        # (filtered by symbol/kind on blotters that support it)
         self.context = zmq.Context()
         sock = self.context.socket(zmq.SUB)
-        sock.setsockopt_string(zmq.SUBSCRIBE, "")
+        zmq_kinds = [kind for kind in kinds if kind not in shmbus.KINDS]
+        prefixes = set()
+        for subscribed, subscribed_kinds in (
+                (shm_symbols, zmq_kinds),
+                ([symbol for symbol in symbols if symbol not in shm_symbols],
+                 kinds)):
+            if subscribed and subscribed_kinds:
+                prefixes.update(protocol.subscriptions(
+                    self.args["zmqtopic"], subscribed, subscribed_kinds,
+                    binary=binary, version=self.args.get("zmqversion", 1)))
+        for prefix in prefixes:
+            sock.setsockopt(zmq.SUBSCRIBE, prefix)
         sock.connect('tcp://127.0.0.1:' + str(self.args['zmqport']))
 
-        try:
-            while True:
-                message = sock.recv_string()
+        def receive(flags=0):
+            if binary:
+                return protocol.decode(*sock.recv_multipart(flags))
 
-                if self.args["zmqtopic"] in message:
-                    message = message.split(self.args["zmqtopic"])[1].strip()
-                    data = json.loads(message)
+            message = sock.recv_string(flags)
+            if self.args["zmqtopic"] not in message:
+                return None
+            message = message.split(self.args["zmqtopic"])[1].strip()
+            return json.loads(message)
 
-                    if data['symbol'] not in symbols:
-                        continue
+        def handle(data):
+            if data is None or data['symbol'] not in symbols:
+                return
+
+            # convert None to np.nan !!
+            data.update((k, np_nan)
+                        for k, v in data.items() if v is None)
+
+            # quote
+            if data['kind'] == "ORDERBOOK":
+                if book_handler is not None:
+                    book_handler(data)
+                    return
+            # quote
+            if data['kind'] == "QUOTE":
+                if quote_handler is not None:
+                    quote_handler(data)
+                    return
+
+            try:
+                data["datetime"] = data["timestamp"] if isinstance(
+                    data["timestamp"], datetime) else parse_date(
+                        data["timestamp"])
+            except Exception as e:
+                pass
+
+            df = pd.DataFrame(index=[0], data=data)
+            df.set_index('datetime', inplace=True)
+            df.index = pd.to_datetime(df.index, utc=True)
+            df.drop(["timestamp", "kind"], axis=1, inplace=True)
+
+            try:
+                df.index = df.index.tz_convert(tz)
+            except Exception as e:
+                df.index = df.index.tz_localize('UTC').tz_convert(tz)
+
+            # add options columns
+            df = tools.force_options_columns(df)
+
+            if data['kind'] == "TICK":
+                if tick_handler is not None:
+                    tick_handler(df)
+            elif data['kind'] == "BAR":
+                if bar_handler is not None:
+                    bar_handler(df)
 
-                    # convert None to np.nan !!
-                    data.update((k, np_nan)
-                                for k, v in data.items() if v is None)
-
-                    # quote
-                    if data['kind'] == "ORDERBOOK":
-                        if book_handler is not None:
-                            book_handler(data)
-                            continue
-                    # quote
-                    if data['kind'] == "QUOTE":
-                        if quote_handler is not None:
-                            quote_handler(data)
-                            continue
-
-                    try:
-                        data["datetime"] = parse_date(data["timestamp"])
-                    except Exception as e:
-                        pass
-
-                    df = pd.DataFrame(index=[0], data=data)
-                    df.set_index('datetime', inplace=True)
-                    df.index = pd.to_datetime(df.index, utc=True)
-                    df.drop(["timestamp", "kind"], axis=1, inplace=True)
-
-                    try:
-                        df.index = df.index.tz_convert(tz)
-                    except Exception as e:
-                        df.index = df.index.tz_localize('UTC').tz_convert(tz)
-
-                    # add options columns
-                    df = tools.force_options_columns(df)
-
-                    if data['kind'] == "TICK":
-                        if tick_handler is not None:
-                            tick_handler(df)
-                    elif data['kind'] == "BAR":
-                        if bar_handler is not None:
-                            bar_handler(df)
+        try:
+            if shm is None:
+                while True:
+                    handle(receive())
+
+            idle = 0
+            while True:
+                busy = False
+                for data in shm.poll():
+                    handle(data)
+                    busy = True
+
+                # drain zeromq without blocking (skipping what unfiltered
+                # subscriptions also deliver via shared memory)
+                while prefixes and sock.poll(0):
+                    data = receive(zmq.NOBLOCK)
+                    if data is None or data['kind'] not in shmbus.KINDS or \
+                            data['symbol'] not in shm_symbols:
+                        handle(data)
+                    busy = True
+
+                # spin briefly, then back off
+                idle = 0 if busy else idle + 1
+                if idle > 1000:
+                    time.sleep(.001)
+                elif idle:
+                    time.sleep(0)
 
         except (KeyboardInterrupt, SystemExit):
             print(
@@ -1118,6 +2092,10 @@ class Blotter():
         """
         Backfills missing historical data
 
+        Each symbol's missing time ranges are requested from IB in chunks,
+        several symbols at a time, within IB's pacing limits (see the
+        ``backfillpace`` and ``backfillinflight`` arguments).
+
         :Optional:
             data : pd.DataFrame
                 Minimum required bars for backfill attempt
@@ -1143,47 +2121,118 @@ class Blotter():
         start_date = parse_date(start)
         end_date = parse_date(end) if end else datetime.utcnow()
 
-        if data.empty:
-            first_date = datetime.utcnow()
-            last_date = datetime.utcnow()
-        else:
-            first_date = tools.datetime64_to_datetime(data.index.values[0])
-            last_date = tools.datetime64_to_datetime(data.index.values[-1])
-
-        ib_lookback = None
-        if start_date < first_date:
-            ib_lookback = tools.ib_duration_str(start_date)
-        elif end_date > last_date:
-            ib_lookback = tools.ib_duration_str(last_date)
+        self.backfill_resolution = "1 min" if resolution[-1] not in (
+            "K", "V", "S") else "1 sec"
 
-        if not ib_lookback:
+        writer = self._backfill_writer()
+        scheduler = BackfillScheduler(
+            request=self._request_backfill,
+            write=None if writer is None else (
+                lambda job: self._write_backfill(writer, job)),
+            max_requests=int(self.args['backfillpace']),
+            max_inflight=int(self.args['backfillinflight']),
+            logger=self.log_blotter)
+
+        # missing ranges per symbol: not covered by the loaded data
+        # nor by ranges already stored/backfilled
+        kind = "TICK" if "sec" in self.backfill_resolution else "BAR"
+        max_gap = timedelta(seconds=resolution_seconds(resolution) or 60)
+        for symbol in self._backfill_contracts():
+            intervals = []
+            if self.coverage is not None:
+                intervals = self.coverage.intervals(symbol, kind)
+
+            # only the runs actually loaded, not the holes within them
+            index = [] if data.empty else data[data['symbol'] == symbol].index
+            intervals = merge_intervals(
+                intervals + index_intervals(index, max_gap))
+
+            ranges = find_gaps(intervals, start_date, end_date)
+            scheduler.add(symbol, ranges, self.backfill_resolution)
+
+        if not scheduler.busy:
             self.backfilled = True
             return None
 
-        self.backfill_resolution = "1 min" if resolution[-1] not in (
-            "K", "V", "S") else "1 sec"
         self.log_blotter.warning("Backfilling historical data from IB...")
 
-        # request parameters
-        params = {
-            "lookback": ib_lookback,
-            "resolution": self.backfill_resolution,
-            "data": "TRADES",
-            "rth": False,
-            "end_datetime": None,
-            "csv_path": None
-        }
+        # wait for backfill to complete
+        self._backfill_scheduler = scheduler
+        try:
+            progress = scheduler.run()
+        finally:
+            self._backfill_scheduler = None
+            if writer is not None:
+                writer.stop()
 
-        # if connection is active - request data
-        self.ibConn.requestHistoricalData(**params)
+        for symbol, status in progress.items():
+            self.log_blotter.info(
+                "Backfilled %s: %d rows (%d/%d chunks, %d failed)", symbol,
+                status["rows"], status["completed"], status["chunks"],
+                status["failed"])
 
-        # wait for backfill to complete
-        while not self.backfilled:
-            time.sleep(0.01)
+        self.backfilled = True
 
         # otherwise, pass the parameters to the caller
         return True
 
+    # -------------------------------------------
+    def _backfill_contracts(self):
+        """ symbols (ezIBpy formatted) to backfill """
+        return [self.ibConn.tickerSymbol(tickerId)
+                for tickerId in self.ibConn.contracts.keys()
+                if self.ibConn.tickerSymbol(tickerId).upper() != "SYMBOL"]
+
+    def _request_backfill(self, job):
+        contract = self.ibConn.contracts[self.ibConn.tickerId(job.symbol)]
+        self.ibConn.requestHistoricalData(
+            contracts=contract,
+            lookback=job.duration,
+            resolution=job.bar_size,
+            data="TRADES",
+            rth=False,
+            end_datetime=job.end.strftime("%Y%m%d %H:%M:%S") + " GMT",
+            csv_path=None
+        )
+
+    def _backfill_writer(self):
+        """ writer for backfilled rows (flushed directly, not started)
+
+        Rollups aren't merged here: a backfill can fill the start of a
+        period that already holds later live minutes, which an
+        incremental merge would get the open/close of wrong. They are
+        rebuilt from the stored bars after each chunk instead.
+        """
+        if self.args['storage'] == "archive":
+            return ArchiveWriter(
+                archive=self.archive,
+                expiry=tools.contract_expiry_from_symbol,
+                rollups=None,
+                compact=False,
+                logger=self.log_blotter)
+        elif not self.args['dbskip']:
+            return DBWriter(
+                connect=self.get_mysql_connection,
+                symbol_id=self._get_symbol_id,
+                rollups=None,
+                partitioned=self.partitioned,
+                logger=self.log_blotter)
+        return None
+
+    def _write_backfill(self, writer, job):
+        """ bulk-writes a backfilled chunk and marks its range as stored """
+        failed = writer.rows_failed
+        writer.flush([(row, row["kind"], None) for row in job.rows])
+        if isinstance(writer, ArchiveWriter):
+            writer.write_segments()
+
+        kind = "TICK" if "sec" in job.bar_size else "BAR"
+        if kind == "BAR" and self.rollups:
+            self.rebuild_rollups(job.start, job.end)
+
+        if writer.rows_failed == failed and self.coverage is not None:
+            self.coverage.add(job.symbol, kind, job.start, job.end)
+
     # -------------------------------------------
     def register(self, instruments):
 
@@ -1238,8 +2287,28 @@ class Blotter():
         self.dbcurr.execute("SHOW TABLES")
         tables = [table[0] for table in self.dbcurr.fetchall()]
 
-        required = ["bars", "ticks", "symbols",
+        schema = "schema.sql"
+        required = ["bars", "ticks", "symbols", "coverage", "rollups",
                     "trades", "greeks", "_version_"]
+        if self.partitioned:
+            schema = "schema_partitioned.sql"
+            required.remove("greeks")
+
+        # existing ticks/bars tables of the other schema
+        if "ticks" in tables and partitions.is_partitioned(
+                self.dbcurr) != self.partitioned:
+            if self.partitioned:
+                self.log_blotter.error(
+                    "Database uses the default schema. Stop the Blotter "
+                    "and run `python -m qtpylib.partitions migrate` to "
+                    "migrate it to the partitioned schema")
+            else:
+                self.log_blotter.error(
+                    "Database uses the partitioned schema "
+                    "(run the Blotter with --dbschema partitioned)")
+            self._remove_cached_args()
+            sys.exit(1)
+
         if all(item in tables for item in required):
             self.dbcurr.execute("SELECT version FROM `_version_`")
             db_version = self.dbcurr.fetchone()
@@ -1247,7 +2316,7 @@ class Blotter():
                 return
 
         # create database schema
-        self.dbcurr.execute(open(path['library'] + '/schema.sql', "rb").read())
+        self.dbcurr.execute(open(path['library'] + '/' + schema, "rb").read())
         try:
             self.dbconn.commit()
 
@@ -1270,6 +2339,26 @@ class Blotter():
             self._remove_cached_args()
             sys.exit(1)
 
+    # -------------------------------------------
+    @property
+    def partitioned(self):
+        """ using the day-partitioned ticks/bars schema? """
+        return self.args.get('dbschema') == "partitioned"
+
+    def _maintain_partitions(self):
+        """ adds upcoming day partitions and drops expired ticks """
+        dbconn = self.get_mysql_connection()
+        try:
+            partitions.maintain(
+                dbconn.cursor(),
+                tick_retention=int(self.args.get('tickretention') or 0),
+                logger=self.log_blotter)
+            dbconn.commit()
+        except Exception as e:
+            self.log_blotter.error("Cannot maintain partitions (%s)", e)
+        finally:
+            dbconn.close()
+
     # ===========================================
     # Utility functions --->
     # ===========================================
@@ -1425,7 +2514,16 @@ def get_symbol_id(symbol, dbconn, dbcurr, ibConn=None):
 
 
 # -------------------------------------------
-def mysql_insert_tick(data, symbol_id, dbcurr):
+def mysql_insert_tick(data, symbol_id, dbcurr, partitioned=False):
+
+    # partitioned schema (greeks stored inline)
+    if partitioned:
+        greeks = NO_GREEKS
+        if data["asset_class"] in ("OPT", "FOP"):
+            greeks = inline_greeks(data)
+        dbcurr.execute(PARTITIONED_TICKS_SQL,
+                       tick_row(data, symbol_id) + greeks)
+        return
 
     sql = """INSERT IGNORE INTO `ticks` (`datetime`, `symbol_id`,
         `bid`, `bidsize`, `ask`, `asksize`, `last`, `lastsize`)
@@ -1463,12 +2561,22 @@ def mysql_insert_tick(data, symbol_id, dbcurr):
 
 
 # -------------------------------------------
-def mysql_insert_bar(data, symbol_id, dbcurr):
+def mysql_insert_bar(data, symbol_id, dbcurr, partitioned=False):
+
+    # partitioned schema (greeks stored inline)
+    if partitioned:
+        greeks = NO_GREEKS
+        if data["asset_class"] in ("OPT", "FOP"):
+            greeks = inline_greeks(cash_ticks.get(data['symbol'], {}))
+        dbcurr.execute(PARTITIONED_BARS_SQL,
+                       bar_row(data, symbol_id) + greeks)
+        return
+
     sql = """INSERT IGNORE INTO `bars`
         (`datetime`, `symbol_id`, `open`, `high`, `low`, `close`, `volume`)
             VALUES (%s, %s, %s, %s, %s, %s, %s)
         ON DUPLICATE KEY UPDATE
-            `open`=%s, `high`=%s, `low`=%s, `close`=%s, `volume`=`volume`+%s
+            `open`=%s, `high`=%s, `low`=%s, `close`=%s, `volume`=%s
     """
     dbcurr.execute(sql, (data["timestamp"], symbol_id,
                          float(data["open"]), float(data["high"]), float(
@@ -1504,7 +2612,59 @@ def mysql_insert_bar(data, symbol_id, dbcurr):
 # -------------------------------------------
 
 
-def prepare_history(data, resolution="1T", tz="UTC", continuous=True):
+def split_history_period(data, resolution):
+    """Splits raw history into rows of complete periods and the rows of the
+    last period, which may still be incomplete (when streaming history).
+    For Tick/Volume based resolutions, that's each symbol's rows of its
+    last bar.
+    """
+    periods = int("".join([s for s in resolution if s.isdigit()]) or 1)
+
+    try:
+        if resolution[-1] == "K":
+            # every N ticks, per symbol (same as tools.resample())
+            if periods <= 1:
+                return data, None
+            counts = data.groupby('symbol')['symbol'].transform('size')
+            last = data.groupby('symbol').cumcount() >= \
+                counts - counts % periods
+
+        elif resolution[-1] == "V":
+            # a bar starts when the cumulative volume, rounded to N,
+            # changes (tools.resample() counts the volume from each
+            # chunk's first row, so bars can still differ slightly
+            # from resampling all rows at once)
+            if periods <= 1:
+                return data, None
+            size = data['lastsize' if 'last' in data.columns else 'volume']
+            marks = (size.groupby(data['symbol']).cumsum() /
+                     periods).round()
+            groups = (marks.groupby(data['symbol']).diff() > 0).groupby(
+                data['symbol']).cumsum()
+            last = groups == groups.groupby(data['symbol']).transform('max')
+
+        else:
+            times = pd.to_datetime(data['datetime'], utc=True)
+            try:
+                last = times >= times.max().floor(resolution)
+            except ValueError:
+                # non-fixed resolutions (eg. 1W)
+                groups = pd.Series(0, index=pd.DatetimeIndex(times)).groupby(
+                    pd.Grouper(freq=resolution)).ngroup().values
+                last = pd.Series(groups == groups.max(), index=data.index)
+    except Exception as e:
+        return data, None
+
+    return data[~last], data[last]
+
+
+def quote_moved(last, quote):
+    """ did the top of book price change? """
+    return last['bid'] != quote['bid'] or last['ask'] != quote['ask']
+
+
+def prepare_history(data, resolution="1T", tz="UTC", continuous=True,
+                    sync_last_timestamp=True):
 
     # setup dataframe
     data.set_index('datetime', inplace=True)
@@ -1536,7 +2696,8 @@ def prepare_history(data, resolution="1T", tz="UTC", continuous=True):
         data.groupby([data.index, 'symbol'], as_index=False
                      ).last().set_index('datetime').dropna()
 
-    data = tools.resample(data, resolution, tz)
+    data = tools.resample(data, resolution, tz,
+                          sync_last_timestamp=sync_last_timestamp)
     return data
 
 
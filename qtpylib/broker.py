@@ -38,6 +38,7 @@ import pymysql
 import ezibpy
 
 from qtpylib.instrument import Instrument
+from qtpylib.simulator import Simulator
 from qtpylib import (
     tools, sms
 )
@@ -101,6 +102,8 @@ class Broker():
             self.trade_log_dir = None
         if not hasattr(self, 'blotter_name'):
             self.blotter_name = None
+        if not hasattr(self, 'simulator_args'):
+            self.simulator_args = {}
 
         # -----------------------------------
         # connect to IB
@@ -151,6 +154,13 @@ class Broker():
         self.active_trades = {}
         self.trades = []
 
+        # backtest orders are filled by a simulator
+        self.simulator = None
+        if self.backtest:
+            self.simulator = Simulator(on_fill=self._on_simulated_fill,
+                                       on_cancel=self._on_simulated_cancel,
+                                       **self.simulator_args)
+
         # shortcut
         self.account = self.ibConn.account
 
@@ -268,6 +278,13 @@ class Broker():
             # transmit "as-is" to blotter for handling
             self.blotter.ibCallback("handleHistoricalData", msg, **kwargs)
 
+        elif caller == "handleError":
+            # historical data request errors (while backfilling)
+            # (errors may arrive while connecting, before the blotter is set)
+            blotter = getattr(self, "blotter", None)
+            if blotter is not None:
+                blotter._on_backfill_error(msg)
+
         if caller == "handleConnectionClosed":
             self.log_broker.info("Lost conncetion to Interactive Brokers...")
 
@@ -340,6 +357,31 @@ class Broker():
                 time.sleep(0.005)
                 self.on_fill(self.get_instrument(order['symbol']), order)
 
+    # ---------------------------------------
+    def _on_simulated_fill(self, order):
+        """ handles backtest fills (same as IB's FILLED orders) """
+        orderId = order["id"]
+        symbol = order["symbol"]
+
+        try:
+            try:
+                quantity = self.orders.history[symbol][orderId]['quantity']
+            except Exception as e:
+                quantity = self.orders.history[symbol][order['parentId']]['quantity']
+        except Exception as e:
+            quantity = 1
+
+        self._update_order_history(symbol, orderId, quantity, filled=True)
+        self._expire_pending_order(symbol, orderId)
+        self._register_trade(order)
+
+        self.on_fill(self.get_instrument(symbol), order)
+
+    def _on_simulated_cancel(self, order):
+        """ handles expired/cancelled backtest orders """
+        if order["id"] in self.orders.pending_ttls:
+            self._expire_pending_order(order["symbol"], order["id"])
+
     # ---------------------------------------
     def _register_trade(self, order):
         """ constructs trade info from order data """
@@ -454,7 +496,8 @@ class Broker():
         trade = self.active_trades[tradeId].copy()
 
         # sms trades
-        sms._send_trade(trade, self.sms_numbers, self.timezone)
+        if not self.backtest:
+            sms._send_trade(trade, self.sms_numbers, self.timezone)
 
         # rename trade direction
         trade['direction'] = trade['direction'].replace(
@@ -478,8 +521,9 @@ class Broker():
         if trade['entry_time'] is None:
             return
 
-        # connection established
-        if (self.dbconn is not None) & (self.dbcurr is not None):
+        # connection established (backtest trades aren't stored)
+        if (self.dbconn is not None) & (self.dbcurr is not None) & (
+                not self.backtest):
 
             sql = """INSERT INTO trades (
                 `algo`, `symbol`, `direction`,`quantity`,
@@ -627,7 +671,19 @@ class Broker():
             trail_stop_at > 0) | (trail_stop_by > 0)
 
         # create & submit order
-        if not bracket:
+        if self.backtest:
+            order = self.simulator.submit(
+                symbol, order_quantity, limit_price=limit_price,
+                target=target, initial_stop=initial_stop,
+                trail_stop_at=trail_stop_at, trail_stop_by=trail_stop_by,
+                trail_stop_type=trail_stop_type, stop_limit=stop_limit,
+                # (limit orders' expiry starts with the next bar/tick)
+                expiry=0 if order_type == "MARKET" else
+                expiry if expiry > 0 else 60)
+            orderId = order["entryOrderId"]
+            bracket = bracket and not stop_limit
+
+        elif not bracket:
             # simple order
             order = self.ibConn.createOrder(order_quantity, limit_price,
                                             fillorkill=fillorkill,
@@ -678,7 +734,8 @@ class Broker():
                     trail_stop_params["trailPercent"] = trail_stop_by
                 self.ibConn.createTriggerableTrailingStop(**trail_stop_params)
 
-            # add all orders to history
+        # add all orders to history
+        if bracket:
             self._update_order_history(symbol=symbol,
                                        orderId=order["entryOrderId"],
                                        quantity=order_quantity,
@@ -714,12 +771,16 @@ class Broker():
         # add orderId / ttl to (auto-adds to history)
         expiry = expiry * 1000 if expiry > 0 else 60000  # 1min
         self._update_pending_order(symbol, orderId, expiry, order_quantity)
-        time.sleep(0.1)
+        if not self.backtest:
+            time.sleep(0.1)
 
     # ---------------------------------------
     def _cancel_order(self, orderId):
         if orderId is not None and orderId > 0:
-            self.ibConn.cancelOrder(orderId)
+            if self.backtest:
+                self.simulator.cancel(orderId)
+            else:
+                self.ibConn.cancelOrder(orderId)
 
     # ---------------------------------------
     def modify_order_group(self, symbol, orderId, entry=None,
@@ -744,6 +805,10 @@ class Broker():
         if quantity is None and limit_price is None:
             return
 
+        if self.backtest:
+            self.simulator.modify(orderId, quantity, limit_price)
+            return
+
         if symbol in self.orders.history:
             for historyOrderId in self.orders.history[symbol]:
                 if historyOrderId == orderId:
@@ -791,6 +856,10 @@ class Broker():
     # ---------------------------------------
     def _cancel_expired_pending_orders(self):
         """ expires pending orders """
+        # (backtest orders expire by the data's time)
+        if self.backtest:
+            return
+
         # use a copy to prevent errors
         pending = self.orders.pending.copy()
         for symbol in pending:
@@ -812,7 +881,8 @@ class Broker():
 
     # ---------------------------------------------------------
     def _expire_pending_order(self, symbol, orderId):
-        self.ibConn.cancelOrder(orderId)
+        if not self.backtest:
+            self.ibConn.cancelOrder(orderId)
 
         if orderId in self.orders.pending_ttls:
             del self.orders.pending_ttls[orderId]
@@ -904,6 +974,10 @@ class Broker():
     def get_orders(self, symbol):
         symbol = self.get_symbol(symbol)
 
+        if self.backtest:
+            return {order["id"]: order
+                    for order in self.simulator.orders(symbol)}
+
         self.orders.by_symbol = self.ibConn.group_orders("symbol")
         if symbol in self.orders.by_symbol:
             return self.orders.by_symbol[symbol]
@@ -915,17 +989,7 @@ class Broker():
         symbol = self.get_symbol(symbol)
 
         if self.backtest:
-            position = 0
-            avgCost = 0.0
-
-            if self.datastore.recorded is not None:
-                data = self.datastore.recorded
-                col = symbol.upper() + '_POSITION'
-                position = data[col].values[-1]
-                if position != 0:
-                    pos = data[col].diff()
-                    avgCost = data[data.index.isin(pos[pos != 0][-1:].index)
-                                   ][symbol.upper() + '_OPEN'].values[-1]
+            position, avgCost = self.simulator.position(symbol)
             return {
                     "symbol": symbol,
                     "position": position,
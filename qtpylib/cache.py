@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+
+def to_utc(timestamp):
+    """ timestamp (str/datetime, naive = UTC) as a UTC pd.Timestamp """
+    if timestamp is None:
+        return None
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
+
+
+class HistoryCache():
+    """On-disk cache of prepared (resampled) history
+
+    Entries are addressed by a hash of the request's parameters
+    (symbols, resolution, continuous flag, timezone and data source)
+    and store the data along with the time range it was loaded for,
+    so callers can serve requests from the cache and only load rows
+    newer than the cached tail.
+
+    :Parameters:
+        path : str
+            Cache directory (created if needed)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    # -------------------------------------------
+    @staticmethod
+    def key(symbols, resolution, continuous, tz, source=None):
+        """ content address of a history request """
+        if isinstance(symbols, str):
+            symbols = symbols.split(',')
+        params = {
+            "symbols": sorted(symbol.strip() for symbol in symbols),
+            "resolution": resolution,
+            "continuous": bool(continuous),
+            "tz": str(tz),
+            "source": source,
+        }
+        return hashlib.sha1(json.dumps(
+            params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _files(self, key):
+        return (os.path.join(self.path, key + ".pkl"),
+                os.path.join(self.path, key + ".json"))
+
+    # -------------------------------------------
+    def get(self, key):
+        """ returns ``(data, start, end)`` or ``(None, None, None)`` """
+        data_file, meta_file = self._files(key)
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            data = pd.read_pickle(data_file)
+        except Exception as e:
+            return None, None, None
+
+        return data, to_utc(meta["start"]), to_utc(meta["end"])
+
+    def put(self, key, data, start, end):
+        """ stores history loaded for the ``start``-``end`` range """
+        data_file, meta_file = self._files(key)
+        meta = {"start": str(to_utc(start)), "end": str(to_utc(end))}
+
+        # write to temp files first, so readers never see partial entries
+        pid = os.getpid()
+        data.to_pickle("%s.%d.tmp" % (data_file, pid))
+        with open("%s.%d.tmp" % (meta_file, pid), "w") as f:
+            json.dump(meta, f)
+
+        os.replace("%s.%d.tmp" % (data_file, pid), data_file)
+        os.replace("%s.%d.tmp" % (meta_file, pid), meta_file)
+
+    # -------------------------------------------
+    def invalidate(self, key=None):
+        """ removes an entry (or all entries) """
+        if key is None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+            return
+
+        for filename in self._files(key):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Data coverage index: the time ranges for which a symbol's ticks/bars
+were stored (logged by the Blotter, backfilled or imported), kept as
+contiguous ``[start, end]`` intervals per symbol and resolution (``TICK``
+or ``BAR``).
+
+A covered range without rows means there was no data (eg. the market
+was closed), so backfills and imports only need to fetch the gaps.
+"""
+
+import sys
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+RESOLUTIONS = ("TICK", "BAR")
+
+COVERAGE_SQL = """SELECT `start`, `end` FROM `coverage`
+    WHERE `symbol_id`=%s AND `resolution`=%s ORDER BY `start`"""
+
+OVERLAPPING_SQL = """SELECT `id`, `start`, `end` FROM `coverage`
+    WHERE `symbol_id`=%s AND `resolution`=%s
+        AND `start`<=%s AND `end`>=%s FOR UPDATE"""
+
+
+# ---------------------------------------------
+def to_datetime(value):
+    """ str/datetime/timestamp as a naive UTC datetime """
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert("UTC").tz_localize(None)
+    return value.to_pydatetime()
+
+
+def merge_intervals(intervals, tolerance=timedelta(0)):
+    """ merges overlapping (or less than ``tolerance`` apart) intervals """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start - merged[-1][1] <= tolerance:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def index_intervals(index, max_gap):
+    """ contiguous ``(start, end)`` runs of the ``index`` datetimes,
+    split where consecutive datetimes are more than ``max_gap`` apart """
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    index = index.unique().sort_values()
+    if not len(index):
+        return []
+
+    breaks = np.flatnonzero(np.diff(index.values) > np.timedelta64(
+        pd.Timedelta(max_gap)))
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(index) - 1]))
+    return [(index[start].to_pydatetime(), index[end].to_pydatetime())
+            for start, end in zip(starts, ends)]
+
+
+def find_gaps(intervals, start, end):
+    """ parts of ``start``-``end`` not covered by the (merged) intervals """
+    gaps = []
+    for covered_start, covered_end in intervals:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            gaps.append((start, covered_start))
+        start = max(start, covered_end)
+
+    if start < end:
+        gaps.append((start, end))
+    return gaps
+
+
+# ---------------------------------------------
+class Coverage():
+    """In-memory coverage index (base class of the stored ones)
+
+    :Optional:
+        tolerance : timedelta
+            Merge intervals less than this apart (default: 1 minute)
+    """
+
+    def __init__(self, tolerance=timedelta(minutes=1)):
+        self.tolerance = tolerance
+        self._intervals = {}
+
+    # -------------------------------------------
+    def _load(self, symbol, resolution):
+        return self._intervals.get((symbol, resolution), [])
+
+    def _save(self, symbol, resolution, intervals):
+        self._intervals[(symbol, resolution)] = intervals
+
+    # -------------------------------------------
+    def intervals(self, symbol, resolution="BAR"):
+        """ covered ``(start, end)`` intervals (naive UTC datetimes) """
+        return self._load(symbol, resolution)
+
+    def add(self, symbol, resolution, start, end):
+        """ marks ``start``-``end`` as stored """
+        start, end = to_datetime(start), to_datetime(end)
+        if end < start:
+            return
+        self._update(symbol, resolution, [(start, end)])
+
+    def add_index(self, symbol, resolution, index, max_gap=None):
+        """ marks the contiguous runs of the ``index`` datetimes as stored
+        (holes of more than ``max_gap``, default: the tolerance, aren't) """
+        max_gap = max(pd.Timedelta(max_gap or 0), pd.Timedelta(self.tolerance))
+        intervals = index_intervals(index, max_gap)
+        if intervals:
+            self._update(symbol, resolution, intervals)
+
+    def _update(self, symbol, resolution, intervals):
+        self._save(symbol, resolution, merge_intervals(
+            self._load(symbol, resolution) + intervals, self.tolerance))
+
+    # -------------------------------------------
+    def gaps(self, symbol, resolution, start, end):
+        """ uncovered ``(start, end)`` ranges within ``start``-``end`` """
+        return find_gaps(self.intervals(symbol, resolution),
+                         to_datetime(start), to_datetime(end))
+
+    def covered(self, symbol, resolution, index):
+        """ boolean mask of ``index`` datetimes within covered ranges """
+        index = pd.DatetimeIndex(index)
+        if index.tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+
+        mask = np.zeros(len(index), dtype=bool)
+        for start, end in self.intervals(symbol, resolution):
+            mask |= (index >= start) & (index <= end)
+        return mask
+
+
+# ---------------------------------------------
+class MySQLCoverage(Coverage):
+    """Coverage index stored in the Blotter's ``coverage`` table
+
+    :Parameters:
+        connect : callable
+            Returns a new pymysql connection
+        symbol_id : callable
+            ``symbol_id(symbol, dbconn, dbcurr)`` returning the symbol's id
+    """
+
+    def __init__(self, connect, symbol_id, **kwargs):
+        super(MySQLCoverage, self).__init__(**kwargs)
+        self.connect = connect
+        self.symbol_id = symbol_id
+        self._symbol_ids = {}
+
+    def _query(self, func):
+        dbconn = self.connect()
+        dbcurr = dbconn.cursor()
+        try:
+            result = func(dbconn, dbcurr)
+            dbconn.commit()
+            return result
+        except Exception as e:
+            dbconn.rollback()
+            raise
+        finally:
+            dbcurr.close()
+            dbconn.close()
+
+    def _get_symbol_id(self, symbol, dbconn, dbcurr):
+        if symbol not in self._symbol_ids:
+            self._symbol_ids[symbol] = self.symbol_id(symbol, dbconn, dbcurr)
+        return self._symbol_ids[symbol]
+
+    # -------------------------------------------
+    def intervals(self, symbol, resolution="BAR"):
+        def query(dbconn, dbcurr):
+            dbcurr.execute(COVERAGE_SQL, (
+                self._get_symbol_id(symbol, dbconn, dbcurr), resolution))
+            return [(start, end) for start, end in dbcurr.fetchall()]
+        return self._query(query)
+
+    def _update(self, symbol, resolution, intervals):
+        first = min(start for start, _ in intervals) - self.tolerance
+        last = max(end for _, end in intervals) + self.tolerance
+
+        def query(dbconn, dbcurr):
+            symbol_id = self._get_symbol_id(symbol, dbconn, dbcurr)
+
+            # lock (only) the stored intervals the new ones may touch
+            dbcurr.execute(OVERLAPPING_SQL, (
+                symbol_id, resolution, last, first))
+            rows = {(start, end): row_id
+                    for row_id, start, end in dbcurr.fetchall()}
+            merged = merge_intervals(list(rows) + intervals, self.tolerance)
+
+            # drop the rows merged into others, insert the new/extended ones
+            stale = [row_id for interval, row_id in rows.items()
+                     if interval not in merged]
+            if stale:
+                dbcurr.execute("DELETE FROM `coverage` WHERE `id` IN (%s)" %
+                               ",".join(["%s"] * len(stale)), stale)
+            dbcurr.executemany("""INSERT INTO `coverage`
+                (`symbol_id`, `resolution`, `start`, `end`)
+                VALUES (%s, %s, %s, %s)""", [
+                (symbol_id, resolution, start, end)
+                for start, end in merged if (start, end) not in rows])
+        self._query(query)
+
+
+# ---------------------------------------------
+class ArchiveCoverage(Coverage):
+    """Coverage index stored in an ``Archive``'s manifest
+
+    :Parameters:
+        archive : Archive
+            The archive
+    """
+
+    def __init__(self, archive, **kwargs):
+        super(ArchiveCoverage, self).__init__(**kwargs)
+        self.archive = archive
+
+    def _load(self, symbol, resolution):
+        return [(to_datetime(start), to_datetime(end)) for start, end in
+                self.archive.coverage(resolution, symbol)]
+
+    def _update(self, symbol, resolution, intervals):
+        def merge(stored):
+            stored = [(to_datetime(start), to_datetime(end))
+                      for start, end in stored]
+            return [(str(start), str(end)) for start, end in merge_intervals(
+                stored + intervals, self.tolerance)]
+        self.archive.update_coverage(resolution, symbol, merge)
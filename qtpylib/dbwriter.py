@@ -0,0 +1,548 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import queue
+import sys
+
+from datetime import timedelta
+from threading import Thread, Lock
+from time import sleep, time
+
+import numpy as np
+import pandas as pd
+import pymysql
+
+from qtpylib.coverage import to_datetime
+from qtpylib.rollups import (
+    REBUILD_SQL, ROLLUPS_SQL, resolution_seconds, rollup_rows
+)
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# multi-row friendly statements
+# (no placeholders after VALUES, so pymysql can batch them)
+TICKS_SQL = """INSERT IGNORE INTO `ticks` (`datetime`, `symbol_id`,
+    `bid`, `bidsize`, `ask`, `asksize`, `last`, `lastsize`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE `symbol_id`=`symbol_id`
+"""
+
+# (idempotent: a bar written again replaces the stored one)
+BARS_SQL = """INSERT IGNORE INTO `bars`
+    (`datetime`, `symbol_id`, `open`, `high`, `low`, `close`, `volume`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        `open`=VALUES(`open`), `high`=VALUES(`high`), `low`=VALUES(`low`),
+        `close`=VALUES(`close`), `volume`=VALUES(`volume`)
+"""
+
+# greeks reference the tick/bar row id, which multi-row
+# inserts don't return - so look it up by the unique key
+GREEKS_SQL = """INSERT IGNORE INTO `greeks` (
+    `{KIND}_id`, `price`, `underlying`, `dividend`, `volume`,
+    `iv`, `oi`, `delta`, `gamma`, `theta`, `vega`)
+    SELECT `id`, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    FROM `{TABLE}` WHERE `datetime`=%s AND `symbol_id`=%s LIMIT 1
+"""
+
+# partitioned schema (schema_partitioned.sql): greeks are stored inline
+PARTITIONED_TICKS_SQL = """INSERT IGNORE INTO `ticks`
+    (`datetime`, `symbol_id`, `bid`, `bidsize`, `ask`, `asksize`,
+    `last`, `lastsize`,
+    `opt_price`, `opt_underlying`, `opt_dividend`, `opt_volume`, `opt_iv`,
+    `opt_oi`, `opt_delta`, `opt_gamma`, `opt_theta`, `opt_vega`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s,
+            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE `symbol_id`=`symbol_id`
+"""
+
+PARTITIONED_BARS_SQL = """INSERT IGNORE INTO `bars`
+    (`datetime`, `symbol_id`, `open`, `high`, `low`, `close`, `volume`,
+    `opt_price`, `opt_underlying`, `opt_dividend`, `opt_volume`, `opt_iv`,
+    `opt_oi`, `opt_delta`, `opt_gamma`, `opt_theta`, `opt_vega`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s,
+            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        `open`=VALUES(`open`), `high`=VALUES(`high`), `low`=VALUES(`low`),
+        `close`=VALUES(`close`), `volume`=VALUES(`volume`),
+        `opt_price`=VALUES(`opt_price`),
+        `opt_underlying`=VALUES(`opt_underlying`),
+        `opt_dividend`=VALUES(`opt_dividend`),
+        `opt_volume`=VALUES(`opt_volume`), `opt_iv`=VALUES(`opt_iv`),
+        `opt_oi`=VALUES(`opt_oi`), `opt_delta`=VALUES(`opt_delta`),
+        `opt_gamma`=VALUES(`opt_gamma`), `opt_theta`=VALUES(`opt_theta`),
+        `opt_vega`=VALUES(`opt_vega`)
+"""
+
+NO_GREEKS = (None,) * 10
+
+_STOP = object()
+
+# -------------------------------------------
+
+
+def tick_row(data, symbol_id):
+    return (data["timestamp"], symbol_id,
+            float(data["bid"]), int(data["bidsize"]),
+            float(data["ask"]), int(data["asksize"]),
+            float(data["last"]), int(data["lastsize"]))
+
+
+def bar_row(data, symbol_id):
+    return (data["timestamp"], symbol_id,
+            float(data["open"]), float(data["high"]),
+            float(data["low"]), float(data["close"]),
+            int(data["volume"]))
+
+
+def greeks_row(greeks, timestamp, symbol_id):
+    return (round(float(greeks["opt_price"]), 2),
+            round(float(greeks["opt_underlying"]), 5),
+            float(greeks["opt_dividend"]), int(greeks["opt_volume"]),
+            float(greeks["opt_iv"]), float(greeks["opt_oi"]),
+            float(greeks["opt_delta"]), float(greeks["opt_gamma"]),
+            float(greeks["opt_theta"]), float(greeks["opt_vega"]),
+            timestamp, symbol_id)
+
+
+def inline_greeks(greeks):
+    """ greeks columns of a partitioned schema row (NULLs if incomplete) """
+    try:
+        return greeks_row(greeks, None, None)[:-2]
+    except Exception as e:
+        return NO_GREEKS
+
+# -------------------------------------------
+
+
+class DBWriter():
+    """Batched, single-connection MySQL writer (used by the Blotter)
+
+    Rows are queued by the caller and written by a single background
+    thread using multi-row inserts, committing whenever ``batch_size``
+    rows are pending or ``flush_interval`` seconds have passed.
+
+    :Parameters:
+
+        connect : callable
+            Returns a new pymysql connection
+        symbol_id : callable
+            ``symbol_id(data, dbconn, dbcurr)`` returning the row's symbol id
+
+    :Optional:
+
+        batch_size : int
+            Max rows per commit (default: 500)
+        flush_interval : float
+            Max seconds between commits (default: 1)
+        max_queue : int
+            Max pending rows before ``write()`` blocks (default: 100000)
+        retries : int
+            Reconnect attempts per batch on connection errors (default: 3)
+        coverage : Coverage
+            Records the time span of the rows written by this writer
+            (see ``qtpylib.coverage``, default: None)
+        coverage_interval : float
+            Seconds between coverage updates (default: 60)
+        rollups : list
+            Also merge bars into these rollup resolutions
+            (see ``qtpylib.rollups``, default: None)
+        partitioned : bool
+            Write to the partitioned schema, with greeks stored inline
+            (see ``qtpylib.partitions``, default: False)
+        logger : object
+            Logger to use (default: this module's)
+    """
+
+    def __init__(self, connect, symbol_id, batch_size=500, flush_interval=1,
+                 max_queue=100000, retries=3, coverage=None,
+                 coverage_interval=60, rollups=None, partitioned=False,
+                 logger=None):
+
+        self.connect = connect
+        self.symbol_id = symbol_id
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.retries = int(retries)
+        self.log = logger if logger is not None else logging.getLogger(
+            __name__)
+
+        self.dbconn = None
+        self.dbcurr = None
+        self._committing = False
+
+        # last flush failed to reach the database (vs. bad rows)
+        self.offline = False
+
+        # (symbol, kind) -> [[first, last], ...] datetimes of written rows
+        # (rows further apart than the coverage's tolerance start a new
+        # span, so outages aren't recorded as covered)
+        self.coverage = coverage
+        self.coverage_interval = float(coverage_interval)
+        self.span_tolerance = getattr(coverage, "tolerance",
+                                      timedelta(minutes=1))
+        self._spans = {}
+        self._spans_changed = set()
+        self._next_coverage = time() + self.coverage_interval
+
+        self.rollups = list(rollups or [])
+        self.partitioned = bool(partitioned)
+
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread = None
+        self._lock = Lock()
+
+        # metrics
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.blocked_writes = 0
+        self.last_flush_latency = 0.
+        self.max_flush_latency = 0.
+        self._total_flush_latency = 0.
+
+    # -------------------------------------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, daemon=True,
+                                  name="qtpylib-dbwriter")
+            self._thread.start()
+        return self
+
+    # -------------------------------------------
+    def stop(self, timeout=None):
+        """ flush pending rows and stop the writer thread """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+        self._disconnect()
+
+    # -------------------------------------------
+    def write(self, data, kind, greeks=None):
+        """ queue a TICK/BAR row, blocking while the queue is full
+
+        :Parameters:
+            data : dict
+                Tick/Bar data (as broadcasted by the Blotter)
+            kind : str
+                ``TICK`` or ``BAR``
+
+        :Optional:
+            greeks : dict
+                Option values to store with the row (defaults to
+                the ``opt_*`` keys of ``data`` for options)
+        """
+        item = (data, kind, greeks)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # backpressure: slow down the producer instead of dropping
+            with self._lock:
+                self.blocked_writes += 1
+            self.log.warning("DB write queue is full (%d rows), waiting...",
+                             self._queue.maxsize)
+            self._queue.put(item)
+
+    # -------------------------------------------
+    def stats(self):
+        flushes = max(1, self.flushes)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "flushes": self.flushes,
+            "blocked_writes": self.blocked_writes,
+            "last_flush_latency": self.last_flush_latency,
+            "avg_flush_latency": self._total_flush_latency / flushes,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    # -------------------------------------------
+    def _run(self):
+        batch = []
+        deadline = time() + self.flush_interval
+
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self.flush(batch)
+                self.update_coverage(force=True)
+                return
+
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time() >= deadline:
+                self.flush(batch)
+                self.update_coverage()
+                batch = []
+                deadline = time() + self.flush_interval
+
+    # -------------------------------------------
+    def flush(self, batch, rebuild=False):
+        """ write a list of ``(data, kind, greeks)`` items in one commit
+
+        Rows that can't be written are skipped (and counted as failed).
+        Returns False if the database couldn't be reached.
+
+        Ticks and bars can be written again safely, rollups can't (bars
+        are added to them), so batches that may have been committed
+        already (``rebuild``, or retried after losing the connection
+        while committing) rebuild their rollup periods instead.
+        """
+        if not batch:
+            return True
+
+        start = time()
+        for attempt in range(self.retries + 1):
+            try:
+                written = self._write_batch(batch, rebuild)
+                break
+
+            except (pymysql.err.OperationalError,
+                    pymysql.err.InterfaceError) as e:
+                self.log.warning("Lost MySQL connection (%s), retrying...", e)
+                rebuild = rebuild or self._committing
+                self._disconnect()
+                sleep(min(attempt + 1, 5) * .5)
+
+            except Exception as e:
+                # isolate the row(s) the database rejects
+                self.log.warning("Cannot write %d rows to MySQL (%s), "
+                                 "retrying row by row...", len(batch), e)
+                self._rollback()
+                written = self._write_rows(batch, rebuild)
+                break
+        else:
+            self.log.error("Cannot write %d rows to MySQL (connection lost)",
+                           len(batch))
+            self.offline = True
+            self.rows_failed += len(batch)
+            return False
+
+        self.offline = False
+        latency = time() - start
+        self.flushes += 1
+        self._count_written(written)
+        self.rows_failed += len(batch) - written
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self._total_flush_latency += latency
+        return True
+
+    def _count_written(self, rows):
+        self.rows_written += rows
+
+    def _write_rows(self, batch, rebuild=False):
+        """ writes items one commit at a time, returns the rows written """
+        written = 0
+        for item in batch:
+            try:
+                written += self._write_batch([item], rebuild)
+            except Exception as e:
+                self.log.error("Cannot write %s %s row to MySQL (%s)",
+                               item[0].get("symbol"), item[1], e)
+                self._rollback()
+                if isinstance(e, (pymysql.err.OperationalError,
+                                  pymysql.err.InterfaceError)):
+                    self._disconnect()
+        return written
+
+    # -------------------------------------------
+    def _write_batch(self, batch, rebuild=False):
+        """ writes items in one commit, returns the rows written
+        (skipping rows that can't be converted) """
+        self._committing = False
+        if self.dbconn is None:
+            self.dbconn = self.connect()
+            self.dbcurr = self.dbconn.cursor()
+
+        ticks = []
+        bars = []
+        rollups = []
+        tick_greeks = []
+        bar_greeks = []
+        written = []
+
+        for data, kind, greeks in batch:
+            if kind not in ("TICK", "BAR"):
+                continue
+
+            try:
+                symbol_id = self.symbol_id(data, self.dbconn, self.dbcurr)
+                if kind == "TICK":
+                    row = tick_row(data, symbol_id)
+                else:
+                    row = bar_row(data, symbol_id)
+            except (pymysql.err.OperationalError,
+                    pymysql.err.InterfaceError):
+                raise
+            except Exception as e:
+                self.log.error("Cannot write %s %s row to MySQL (%s)",
+                               data.get("symbol"), kind, e)
+                continue
+
+            is_option = data.get("asset_class") in ("OPT", "FOP")
+            written.append((data, kind, greeks))
+
+            if kind == "TICK":
+                rows = ticks
+                greeks = greeks or data
+                target = tick_greeks
+            else:
+                rows = bars
+                target = bar_greeks
+                if self.rollups and not is_option:
+                    rollups.extend(rollup_rows(row, self.rollups))
+
+            # add greeks (skipped when incomplete)
+            values = None
+            if is_option and greeks:
+                try:
+                    values = greeks_row(greeks, data["timestamp"], symbol_id)
+                except Exception as e:
+                    pass
+
+            if self.partitioned:
+                row += values[:-2] if values else NO_GREEKS
+            elif values:
+                target.append(values)
+            rows.append(row)
+
+        if ticks:
+            self.dbcurr.executemany(PARTITIONED_TICKS_SQL if self.partitioned
+                                    else TICKS_SQL, ticks)
+        if bars:
+            self.dbcurr.executemany(PARTITIONED_BARS_SQL if self.partitioned
+                                    else BARS_SQL, bars)
+        if rollups and rebuild:
+            self._rebuild_rollups(rollups)
+        elif rollups:
+            self.dbcurr.executemany(ROLLUPS_SQL, rollups)
+        if tick_greeks:
+            self.dbcurr.executemany(GREEKS_SQL.replace(
+                "{KIND}", "tick").replace("{TABLE}", "ticks"), tick_greeks)
+        if bar_greeks:
+            self.dbcurr.executemany(GREEKS_SQL.replace(
+                "{KIND}", "bar").replace("{TABLE}", "bars"), bar_greeks)
+
+        # a lost connection from here on may or may not have committed
+        self._committing = True
+        self.dbconn.commit()
+        self._committing = False
+        self._track(written)
+        return len(written)
+
+    def _rebuild_rollups(self, rollups):
+        """ rebuilds the periods of ``ROLLUPS_SQL`` rows from the bars """
+        for resolution in self.rollups:
+            periods = [row[1] for row in rollups if row[0] == resolution]
+            seconds = resolution_seconds(resolution)
+            self.dbcurr.execute(REBUILD_SQL, (
+                resolution, seconds, seconds, min(periods),
+                max(periods) + timedelta(seconds=seconds)))
+
+    # -------------------------------------------
+    def _track(self, batch):
+        """ extends the time spans covered by the written rows """
+        times = {}
+        for data, kind, greeks in batch:
+            if kind in ("TICK", "BAR"):
+                times.setdefault((data["symbol"], kind), []).append(
+                    str(data["timestamp"]))
+
+        for key, values in times.items():
+            self._extend_spans(key, pd.to_datetime(
+                values, utc=True).tz_localize(None).values)
+
+    def _extend_spans(self, key, times):
+        """ extends a key's spans with (datetime64) times, breaking
+        them where rows are further apart than ``span_tolerance`` """
+        times = np.sort(times)
+        gaps = np.flatnonzero(
+            np.diff(times) > np.timedelta64(self.span_tolerance))
+        starts = np.r_[0, gaps + 1]
+        ends = np.r_[gaps, len(times) - 1]
+        for first, last in zip(starts, ends):
+            self._extend_span(key, to_datetime(times[first]),
+                              to_datetime(times[last]))
+
+    def _extend_span(self, key, first, last):
+        spans = self._spans.setdefault(key, [])
+        span = spans[-1] if spans else None
+        if span is None or first - span[1] > self.span_tolerance or \
+                span[0] - last > self.span_tolerance:
+            spans.append([first, last])
+        else:
+            span[0] = min(span[0], first)
+            span[1] = max(span[1], last)
+        self._spans_changed.add(key)
+
+    def update_coverage(self, force=False):
+        """ records the spans written so far (every ``coverage_interval``) """
+        if self.coverage is None or not self._spans_changed:
+            return
+        if not force and time() < self._next_coverage:
+            return
+
+        self._next_coverage = time() + self.coverage_interval
+        changed, self._spans_changed = self._spans_changed, set()
+
+        for key in changed:
+            symbol, kind = key
+            spans = self._spans[key]
+            try:
+                for first, last in spans:
+                    self.coverage.add(symbol, kind, first, last)
+            except Exception as e:
+                self.log.warning("Cannot update %s coverage (%s)", symbol, e)
+                self._spans_changed.add(key)
+                continue
+
+            # recorded - only the last span can still be extended
+            del spans[:-1]
+
+    # -------------------------------------------
+    def _rollback(self):
+        try:
+            self.dbconn.rollback()
+        except Exception as e:
+            pass
+
+    def _disconnect(self):
+        try:
+            self.dbcurr.close()
+            self.dbconn.close()
+        except Exception as e:
+            pass
+        self.dbconn = None
+        self.dbcurr = None
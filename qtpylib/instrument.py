@@ -78,7 +78,7 @@ class Instrument(str):
             bars : pd.DataFrame / dict
                 The bars for this instruments
         """
-        bars = self._get_symbol_dataframe(self.parent.bars, self)
+        bars = self.parent._bars.frame(self)
 
         # add signal history to bars
         bars = self.parent._add_signal_history(df=bars, symbol=self)
@@ -120,7 +120,7 @@ class Instrument(str):
             ticks : pd.DataFrame / dict
                 The ticks for this instruments
         """
-        ticks = self._get_symbol_dataframe(self.parent.ticks, self)
+        ticks = self.parent._ticks.frame(self)
 
         lookback = self.tick_window if lookback is None else lookback
         ticks = ticks[-lookback:]
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Local write-ahead journal for the Blotter's ticks/bars (``--journal``).
+
+Rows are appended to segment files (sequential writes, no waiting on
+the database) and drained into the database by a background thread,
+which only moves its checkpoint forward once rows are committed. When
+the database is down (or slow), rows pile up in the journal instead
+of being lost or stalling the Blotter, and are written once it's back
+- including after a restart::
+
+    {path}/000000000001.journal
+    {path}/000000000002.journal
+    {path}/checkpoint
+
+Records are ``qtpylib.protocol`` binary messages, framed by their
+length and CRC32 (torn writes at the end of a segment are skipped).
+Drained segments are deleted.
+
+Delivery is at-least-once: a crash between a commit and the checkpoint
+update writes the last batch again after a restart. Ticks and bars are
+written idempotently, and that first batch rebuilds its rollup periods
+instead of merging into them (see ``DBWriter.flush()``).
+"""
+
+import glob
+import json
+import logging
+import os
+import sys
+import zlib
+
+from struct import Struct
+from threading import Event, Lock, Thread
+from time import time
+
+from qtpylib import protocol
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# record: body length and crc32, then the body:
+# topic length, topic and payload frames
+_HEADER = Struct('<II')
+_TOPIC = Struct('<H')
+
+_SUFFIX = ".journal"
+
+
+# ---------------------------------------------
+def encode_record(data, kind, greeks=None):
+    """ a tick/bar (and its option greeks) as a journal record """
+    if greeks:
+        data = dict(data, **{name: greeks.get(name)
+                             for name in protocol.OPT_FIELDS})
+    topic, payload = protocol.encode("", data, kind)
+    body = _TOPIC.pack(len(topic)) + topic + payload
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_records(filename, offset=0):
+    """Reads a segment's complete records
+
+    :Returns:
+        records : generator
+            ``(end offset, (data, kind, greeks))`` tuples, stopping at
+            the end of the file or at an incomplete/corrupt record
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, crc = _HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                return
+
+            topic_length = _TOPIC.unpack_from(body)[0]
+            start = _TOPIC.size + topic_length
+            data = protocol.decode(body[_TOPIC.size:start], body[start:])
+            kind = data.pop("kind")
+
+            # option bars' greeks travel with the row
+            greeks = None
+            if kind == "BAR" and any(name in data
+                                     for name in protocol.OPT_FIELDS):
+                greeks = data
+
+            offset += _HEADER.size + length
+            yield offset, (data, kind, greeks)
+
+
+# ---------------------------------------------
+class Journal():
+    """Journals ticks/bars to disk, then drains them into a writer
+
+    Has the same ``write()``/``stop()``/``stats()`` interface as the
+    writer it wraps (see ``qtpylib.dbwriter.DBWriter``).
+
+    :Parameters:
+        path : str
+            Journal directory
+        writer : DBWriter
+            Writer to drain the journal into (``flush(batch)``,
+            not started)
+
+    :Optional:
+        segment_size : int
+            Bytes per segment file (default: 64MB)
+        batch_size : int
+            Max rows per database commit (default: 500)
+        flush_interval : float
+            Max seconds between file flushes/commits (default: 1)
+        retry_interval : float
+            Seconds to wait while the database is unreachable (default: 5)
+        logger : object
+            Logger to use (default: this module's)
+    """
+
+    def __init__(self, path, writer, segment_size=64 * 1024 * 1024,
+                 batch_size=500, flush_interval=1, retry_interval=5,
+                 logger=None):
+
+        self.path = path
+        self.writer = writer
+        self.segment_size = int(segment_size)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.retry_interval = float(retry_interval)
+        self.log = logger if logger is not None else logging.getLogger(
+            __name__)
+
+        os.makedirs(self.path, exist_ok=True)
+        self.checkpoint_file = os.path.join(self.path, "checkpoint")
+
+        # never append to a segment from a previous run (may be torn)
+        segments = self.segments()
+        self._segment = segments[-1] + 1 if segments else 1
+
+        # the first batch drained may already have been committed
+        self._replaying = bool(segments)
+        self._file = None
+        self._size = 0
+        self._lock = Lock()
+
+        self._stopping = Event()
+        self._thread = None
+
+        # metrics
+        self.rows_journaled = 0
+        self.rows_drained = 0
+        self.rows_skipped = 0
+        self.offline_since = None
+
+    # -------------------------------------------
+    def segments(self):
+        """ numbers of the segments on disk """
+        return sorted(int(os.path.basename(name)[:-len(_SUFFIX)])
+                      for name in glob.glob(os.path.join(
+                          self.path, "*" + _SUFFIX)))
+
+    def segment_file(self, segment):
+        return os.path.join(self.path, "%012d%s" % (segment, _SUFFIX))
+
+    def checkpoint(self):
+        """ ``(segment, offset)`` of the next record to drain """
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                checkpoint = json.load(f)
+            return checkpoint["segment"], checkpoint["offset"]
+        except Exception as e:
+            segments = self.segments()
+            return (segments[0] if segments else self._segment), 0
+
+    def _save_checkpoint(self, segment, offset):
+        tmp = self.checkpoint_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+        os.replace(tmp, self.checkpoint_file)
+
+    # -------------------------------------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = Thread(target=self._run, daemon=True,
+                                  name="qtpylib-journal")
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ stops draining (undrained rows are kept for the next run) """
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        self.writer.stop()
+
+    # -------------------------------------------
+    def write(self, data, kind, greeks=None):
+        """ appends a TICK/BAR row to the journal
+
+        :Parameters:
+            data : dict
+                Tick/Bar data (as broadcasted by the Blotter)
+            kind : str
+                ``TICK`` or ``BAR``
+
+        :Optional:
+            greeks : dict
+                Option values to store with the row
+        """
+        record = encode_record(data, kind, greeks)
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.segment_file(self._segment), "ab")
+                self._size = self._file.tell()
+
+            self._file.write(record)
+            self._size += len(record)
+            self.rows_journaled += 1
+
+            # rotate (the next segment only appears once this one is
+            # complete, which tells the drain thread it's sealed)
+            if self._size >= self.segment_size:
+                self._file.close()
+                self._file = None
+                self._segment += 1
+
+    def sync(self):
+        """ flushes journaled rows to the OS """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    # -------------------------------------------
+    def stats(self):
+        stats = self.writer.stats()
+        segment, offset = self.checkpoint()
+        pending = sum(os.path.getsize(self.segment_file(number))
+                      for number in self.segments() if number >= segment)
+        stats.update({
+            "journal_segments": len(self.segments()),
+            "journal_pending_bytes": max(0, pending - offset),
+            "rows_journaled": self.rows_journaled,
+            "rows_drained": self.rows_drained,
+            "rows_skipped": self.rows_skipped,
+            "offline_seconds": 0 if self.offline_since is None else
+            time() - self.offline_since,
+        })
+        return stats
+
+    # -------------------------------------------
+    def _run(self):
+        segment, offset = self.checkpoint()
+
+        while not self._stopping.is_set():
+            self.sync()
+            segment, offset, drained = self._drain(segment, offset)
+            if not drained:
+                self._stopping.wait(self.flush_interval)
+
+    def _drain(self, segment, offset):
+        """ writes pending records, returns the new position """
+        filename = self.segment_file(segment)
+        sealed = segment < self._segment
+        if not os.path.exists(filename):
+            # skip missing segments (eg. deleted by hand)
+            if segment < self._segment:
+                return segment + 1, 0, True
+            return segment, offset, False
+
+        batch = []
+        end = offset
+        for end, item in read_records(filename, offset):
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+
+        if batch:
+            failed = self.writer.rows_failed
+            if not self.writer.flush(batch, rebuild=self._replaying) \
+                    and self.writer.offline:
+                # retry the same rows once the database is back
+                if self.offline_since is None:
+                    self.offline_since = time()
+                    self.log.warning(
+                        "Database unreachable, journaling rows...")
+                self._stopping.wait(self.retry_interval)
+                return segment, offset, False
+
+            # rows the database rejects
+            self.rows_skipped += self.writer.rows_failed - failed
+            self._replaying = False
+
+            if self.offline_since is not None:
+                self.log.info("Database is back (after %.0fs), draining "
+                              "the journal...", time() - self.offline_since)
+                self.offline_since = None
+
+            self.rows_drained += len(batch)
+            self.writer.update_coverage()
+            self._save_checkpoint(segment, end)
+            return segment, end, True
+
+        # done with a sealed segment (skipping a torn record at its end)
+        if sealed:
+            if os.path.getsize(filename) > offset:
+                self.log.warning("Skipping %d corrupt bytes at the end of "
+                                 "%s", os.path.getsize(filename) - offset,
+                                 filename)
+            os.remove(filename)
+            self._save_checkpoint(segment + 1, 0)
+            return segment + 1, 0, True
+
+        return segment, offset, False
@@ -0,0 +1,737 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Parameter sweeps and walk-forward optimization of ``Algo`` strategies.
+
+History is loaded once (from the CSV files/Blotter, like a regular
+backtest), then every parameter combination is backtested by a pool
+of worker processes. Workers are forked after the history is loaded,
+so they all share the parent's copy of it (copy-on-write) instead of
+re-loading or receiving it.
+
+Each run's metrics are calculated from its recorded output (positions
+and closing prices, see ``recorded_metrics()``) and its simulated
+fills, and collected into a single results table::
+
+    $ python -m qtpylib.optimizer strategy.py:MyStrategy \\
+        --instruments AAPL --param fast=5:30:5 --param slow=50,100 \\
+        --start 2018-01-01 --end 2018-12-31 --data ~/mycsvdata/ \\
+        --workers 8 --results ~/results.csv
+
+Each worker process connects to IB with its own client id
+(``ibclient`` + worker number).
+"""
+
+import argparse
+import importlib
+import importlib.util
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# metrics where lower is better (when ranking runs)
+_ASCENDING = ("max_drawdown", "commissions")
+
+# set in each worker process (see _init_worker)
+_WORKER = {}
+
+
+# ---------------------------------------------
+def grid(params):
+    """All combinations of parameter values
+
+    :Parameters:
+        params : dict
+            Parameter name => list of values (or a single value)
+
+    :Returns:
+        combinations : list
+            One kwargs dict per combination
+    """
+    names = list(params)
+    values = [_values(params[name]) for name in names]
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*values)]
+
+
+def random_search(params, samples, seed=None):
+    """Random combinations of parameter values
+
+    :Parameters:
+        params : dict
+            Parameter name => list of values, or a function returning
+            a value when called with a ``random.Random`` instance
+        samples : int
+            Number of combinations to draw
+
+    :Optional:
+        seed : int
+            Random seed (for repeatable searches)
+
+    :Returns:
+        combinations : list
+            One kwargs dict per combination (unique when all
+            parameters are lists)
+    """
+    rng = random.Random(seed)
+    names = list(params)
+
+    # lists only: sample the grid (no duplicates)
+    if not any(callable(params[name]) for name in names):
+        values = [_values(params[name]) for name in names]
+        total = int(np.prod([len(value) for value in values]))
+        combinations = []
+        for number in rng.sample(range(total), min(samples, total)):
+            combination = {}
+            for name, value in reversed(list(zip(names, values))):
+                number, ix = divmod(number, len(value))
+                combination[name] = value[ix]
+            combinations.append({name: combination[name] for name in names})
+        return combinations
+
+    return [{name: params[name](rng) if callable(params[name]) else
+             rng.choice(_values(params[name])) for name in names}
+            for _ in range(samples)]
+
+
+def _values(value):
+    if isinstance(value, (list, tuple, range, np.ndarray)):
+        return list(value)
+    return [value]
+
+
+# ---------------------------------------------
+def walkforward_windows(start, end, train, test, step=None, anchored=False):
+    """Train/test periods for walk-forward optimization
+
+    :Parameters:
+        start : str
+            Start of the first training period
+        end : str
+            End of the last test period
+        train : str
+            Length of training periods (pandas timedelta, eg. ``90D``)
+        test : str
+            Length of test periods (eg. ``30D``)
+
+    :Optional:
+        step : str
+            Time between windows (default: ``test``)
+        anchored : bool
+            Training periods all start at ``start`` (default: False)
+
+    :Returns:
+        windows : list
+            ``(train_start, train_end, test_start, test_end)``
+            timestamps (periods exclude their end)
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    train, test = pd.Timedelta(train), pd.Timedelta(test)
+    step = pd.Timedelta(step) if step else test
+    if step <= pd.Timedelta(0):
+        raise ValueError("Walk-forward step must be positive")
+
+    windows = []
+    train_end = start + train
+    while train_end < end:
+        train_start = start if anchored else train_end - train
+        windows.append((train_start, train_end, train_end,
+                        min(train_end + test, end)))
+        train_end += step
+    return windows
+
+
+def _slice(history, start=None, end=None, closed=True):
+    """ history rows from ``start`` to ``end`` """
+    if history.empty:
+        return history
+
+    tz = getattr(history.index, "tz", None)
+    mask = np.ones(len(history.index), dtype=bool)
+    for value, before in ((start, False), (end, True)):
+        if value is None:
+            continue
+        value = pd.Timestamp(value)
+        if tz is not None and value.tz is None:
+            value = value.tz_localize(tz)
+        if not before:
+            mask &= history.index >= value
+        elif closed:
+            mask &= history.index <= value
+        else:
+            mask &= history.index < value
+    return history[mask]
+
+
+def _last_timestamp(history):
+    """ the history's last timestamp (in its timezone, as naive) """
+    last = history.index[-1]
+    return last.tz_localize(None) if last.tz is not None else last
+
+
+# ---------------------------------------------
+def recorded_metrics(recorded):
+    """Performance of a backtest, from its recorded output
+
+    P&L is marked to market on every bar: each symbol's (shifted)
+    ``{SYMBOL}_POSITION`` times the change of its ``{SYMBOL}_CLOSE``.
+
+    :Parameters:
+        recorded : pd.DataFrame
+            The algo's recorded data (``Algo.datastore.recorded``)
+
+    :Returns:
+        metrics : dict
+            ``bars``, ``pnl``, ``max_drawdown``, ``sharpe`` (of the
+            P&L per bar, not annualized), ``exposure`` (share of bars
+            with an open position) and ``position_changes``
+    """
+    metrics = {"bars": 0, "pnl": 0., "max_drawdown": 0., "sharpe": 0.,
+               "exposure": 0., "position_changes": 0}
+    if recorded is None or recorded.empty:
+        return metrics
+
+    pnl = pd.Series(0., index=recorded.index)
+    exposed = pd.Series(False, index=recorded.index)
+    changes = 0
+    for column in recorded.columns:
+        if not column.endswith("_POSITION"):
+            continue
+        close = column[:-len("_POSITION")] + "_CLOSE"
+        if close not in recorded.columns:
+            continue
+
+        position = recorded[column].fillna(0).astype(float)
+        prices = recorded[close].astype(float).ffill()
+        pnl += (position * prices.diff()).fillna(0)
+        exposed |= position != 0
+        changes += int((position.diff().fillna(position) != 0).sum())
+
+    equity = pnl.cumsum()
+    std = pnl.std()
+    metrics.update({
+        "bars": len(recorded.index),
+        "pnl": float(equity.iloc[-1]),
+        "max_drawdown": float((equity.cummax().clip(lower=0) -
+                               equity).max()),
+        "sharpe": float(pnl.mean() / std) if std > 0 else 0.,
+        "exposure": float(exposed.mean()),
+        "position_changes": changes,
+    })
+    return metrics
+
+
+def run_metrics(algo):
+    """Metrics of a backtested algo (recorded output, fills and trades)
+
+    :Parameters:
+        algo : Algo
+            An algo, after ``run()``
+
+    :Returns:
+        metrics : dict
+            ``recorded_metrics()``, plus ``net_pnl`` (less
+            commissions), ``fills``, ``commissions``, ``trades``
+            (closed) and ``win_rate``
+    """
+    metrics = recorded_metrics(algo.datastore.recorded)
+
+    stats = algo.simulator.stats() if algo.simulator is not None else {}
+    metrics["fills"] = stats.get("fills", 0)
+    metrics["commissions"] = stats.get("commissions", 0.)
+    metrics["net_pnl"] = metrics["pnl"] - metrics["commissions"]
+
+    trades = [float(trade["realized_pnl"]) for trade in algo.trades]
+    metrics["trades"] = len(trades)
+    metrics["win_rate"] = sum(pnl > 0 for pnl in trades) / len(trades) \
+        if trades else 0.
+    return metrics
+
+
+# ---------------------------------------------
+@contextmanager
+def _no_cli_args():
+    """ keeps the optimizer's args from being read as the algo's
+    (``Algo`` reads its command-line args when created) """
+    argv = sys.argv
+    sys.argv = argv[:1]
+    try:
+        yield
+    finally:
+        sys.argv = argv
+
+
+def _close(algo):
+    """ disconnects an algo from IB (frees its client id) """
+    try:
+        algo.ibConn.disconnect()
+    except Exception as e:
+        pass
+
+
+def _init_worker(state, counter):
+    """ pool initializer (``state`` is inherited when forking) """
+    with counter.get_lock():
+        counter.value += 1
+        number = counter.value
+    _WORKER.clear()
+    _WORKER.update(state)
+    _WORKER["number"] = number
+
+
+def _backtest(task):
+    """ backtests one parameter combination (in a worker) """
+    run, params, start, end, closed = task
+    kwargs = dict(_WORKER["kwargs"], **params)
+    kwargs.update(
+        backtest=True, start=str(start), end=str(end),
+        output=os.path.join(_WORKER["output"], "%s.pkl" % run),
+        ibclient=_WORKER["ibclient"] + _WORKER["number"])
+
+    result = {"run": run}
+    result.update(params)
+    algo = None
+    try:
+        with _no_cli_args():
+            algo = _WORKER["strategy"](**kwargs)
+        algo.run(history=_slice(_WORKER["history"], start, end, closed))
+        result.update(run_metrics(algo))
+    except (Exception, SystemExit) as e:
+        result["error"] = str(e) or e.__class__.__name__
+    finally:
+        if algo is not None:
+            _close(algo)
+    return result
+
+
+# ---------------------------------------------
+class Optimizer():
+    """Backtests a strategy with many parameter combinations, in parallel
+
+    :Parameters:
+        strategy : class
+            ``Algo`` sub-class to optimize
+        params : dict
+            Parameter name => values to try (passed to the
+            strategy's constructor, see ``grid()``/``random_search()``)
+
+    :Optional:
+        workers : int
+            Number of worker processes (default: CPU count,
+            0 runs in this process)
+        search : str
+            ``grid`` or ``random`` (default: ``grid``)
+        samples : int
+            Combinations to try with random search (default: 10)
+        seed : int
+            Random search seed (default: None)
+        metric : str
+            Metric to rank runs by (default: ``net_pnl``)
+        output : str
+            Directory to save each run's recorded data to
+            (default: None = temporary)
+        ** kwargs : mixed
+            Strategy constructor args shared by all runs
+            (``instruments``, ``resolution``, ``start``, ``end``,
+            ``data``, ``slippage``, ``ibclient``, etc.)
+    """
+
+    def __init__(self, strategy, params, workers=None, search="grid",
+                 samples=10, seed=None, metric="net_pnl", output=None,
+                 **kwargs):
+
+        if search not in ("grid", "random"):
+            raise ValueError("Unknown search type: %s" % search)
+
+        self.strategy = strategy
+        self.params = params
+        self.workers = multiprocessing.cpu_count() if workers is None \
+            else max(0, int(workers))
+        self.search = search
+        self.samples = samples
+        self.seed = seed
+        self.metric = metric
+        self.output = output
+        self.kwargs = kwargs
+        self.kwargs.setdefault("ibclient", 998)
+
+        self.history = None
+        self.log = logging.getLogger(__name__)
+
+    # -------------------------------------------
+    def combinations(self):
+        """ the parameter combinations to backtest """
+        if self.search == "random":
+            return random_search(self.params, self.samples, self.seed)
+        return grid(self.params)
+
+    def load_history(self, start=None, end=None):
+        """Loads (and keeps) the history of all runs, once
+
+        :Optional:
+            start : str
+                Start date (default: the ``start`` arg)
+            end : str
+                End date (default: the ``end`` arg)
+
+        :Returns:
+            history : pd.DataFrame
+                See ``Algo.load_history()``
+        """
+        if self.history is not None:
+            return self.history
+
+        output = tempfile.mkdtemp()
+        kwargs = dict(self.kwargs, backtest=True,
+                      output=os.path.join(output, "history.pkl"))
+        kwargs["start"] = str(start or self.kwargs.get("start"))
+        kwargs["end"] = end or self.kwargs.get("end")
+        if kwargs["end"] is not None:
+            kwargs["end"] = str(kwargs["end"])
+
+        algo = None
+        try:
+            with _no_cli_args():
+                algo = self.strategy(**kwargs)
+                self.history = algo.load_history()
+        finally:
+            if algo is not None:
+                _close(algo)
+            shutil.rmtree(output, ignore_errors=True)
+
+        self.log.info("Loaded %d rows of history", len(self.history.index))
+        return self.history
+
+    # -------------------------------------------
+    def _map(self, tasks):
+        """ backtests tasks in the worker pool, returns their results """
+        output = self.output or tempfile.mkdtemp()
+        os.makedirs(output, exist_ok=True)
+
+        state = {"strategy": self.strategy, "kwargs": self.kwargs,
+                 "history": self.history, "output": output,
+                 "ibclient": int(self.kwargs["ibclient"])}
+
+        results = []
+        try:
+            if self.workers == 0 or len(tasks) == 1:
+                _init_worker(state, multiprocessing.Value("i", 0))
+                results = [_backtest(task) for task in tasks]
+            else:
+                # forked workers share the history (no pickling)
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    "fork" if "fork" in methods else None)
+                counter = context.Value("i", 0)
+                with context.Pool(min(self.workers, len(tasks)),
+                                  initializer=_init_worker,
+                                  initargs=(state, counter)) as pool:
+                    for result in pool.imap_unordered(_backtest, tasks):
+                        results.append(result)
+                        self.log.info("Backtested %d/%d runs",
+                                      len(results), len(tasks))
+        finally:
+            if self.output is None:
+                shutil.rmtree(output, ignore_errors=True)
+
+        return results
+
+    def _table(self, results):
+        results = pd.DataFrame(results)
+        if results.empty or self.metric not in results.columns:
+            return results
+        return results.sort_values(
+            self.metric, ascending=self.metric in _ASCENDING,
+            kind="mergesort").reset_index(drop=True)
+
+    # -------------------------------------------
+    def run(self, start=None, end=None):
+        """Backtests all combinations over the same period
+
+        :Optional:
+            start : str
+                Start date (default: the ``start`` arg)
+            end : str
+                End date (default: the ``end`` arg)
+
+        :Returns:
+            results : pd.DataFrame
+                One row per combination (its params and metrics),
+                best first
+        """
+        start = start or self.kwargs.get("start")
+        end = end or self.kwargs.get("end")
+        if start is None:
+            raise ValueError("Must provide a start date")
+
+        self.load_history(start, end)
+        if end is None and not self.history.empty:
+            end = _last_timestamp(self.history)
+
+        tasks = [(run, params, start, end, True)
+                 for run, params in enumerate(self.combinations())]
+        return self._table(self._map(tasks))
+
+    def walkforward(self, train, test, step=None, anchored=False):
+        """Walk-forward optimization: the best combination of every
+        training period is backtested over the following test period
+
+        :Parameters:
+            train : str
+                Length of training periods (eg. ``90D``)
+            test : str
+                Length of test periods (eg. ``30D``)
+
+        :Optional:
+            step : str
+                Time between windows (default: ``test``)
+            anchored : bool
+                Training periods all start at ``start`` (default: False)
+
+        :Returns:
+            results : pd.DataFrame
+                One row per run, with its ``window`` and ``phase``
+                (``train``/``test``)
+        """
+        start = self.kwargs.get("start")
+        if start is None:
+            raise ValueError("Must provide a start date")
+
+        self.load_history()
+        end = self.kwargs.get("end") or _last_timestamp(self.history)
+        windows = walkforward_windows(start, end, train, test,
+                                      step=step, anchored=anchored)
+        if not windows:
+            raise ValueError("Not enough data for a %s training period"
+                             % train)
+
+        combinations = self.combinations()
+        tables = []
+
+        # training periods of all windows run side by side...
+        tasks = [("%d-%d" % (window, run), params,
+                  train_start, train_end, False)
+                 for window, (train_start, train_end, _, _)
+                 in enumerate(windows)
+                 for run, params in enumerate(combinations)]
+        train_results = self._table(self._map(tasks))
+        if train_results.empty:
+            return train_results
+        train_results["window"] = train_results["run"].str.split(
+            "-").str[0].astype(int)
+        train_results["phase"] = "train"
+        tables.append(train_results)
+
+        # ...then each window's best combination is tested
+        tasks = []
+        for window, (_, _, test_start, test_end) in enumerate(windows):
+            ranked = train_results[train_results["window"] == window]
+            if "error" in ranked.columns:
+                ranked = ranked[ranked["error"].isnull()]
+            if ranked.empty:
+                continue
+            run = ranked["run"].values[0]
+            params = combinations[int(run.split("-")[1])]
+            last = window == len(windows) - 1
+            tasks.append((run + "-test", params, test_start, test_end,
+                          last))
+
+        if tasks:
+            test_results = pd.DataFrame(self._map(tasks))
+            test_results["window"] = test_results["run"].str.split(
+                "-").str[0].astype(int)
+            test_results["phase"] = "test"
+            tables.append(test_results)
+
+        results = pd.concat(tables, sort=False, ignore_index=True)
+        periods = pd.DataFrame(windows, columns=[
+            "train_start", "train_end", "test_start", "test_end"])
+        results = results.join(periods, on="window")
+        return results.sort_values(["window", "phase"], kind="mergesort",
+                                   ascending=[True, False]
+                                   ).reset_index(drop=True)
+
+
+# ---------------------------------------------
+def load_strategy(name):
+    """Loads a strategy class
+
+    :Parameters:
+        name : str
+            ``path/to/strategy.py:ClassName`` or ``module:ClassName``
+    """
+    module, _, classname = name.rpartition(":")
+    if not module or not classname:
+        raise ValueError("Strategy must be given as module:ClassName")
+
+    if module.endswith(".py"):
+        modname = os.path.splitext(os.path.basename(module))[0]
+        spec = importlib.util.spec_from_file_location(modname, module)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[modname] = module
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module)
+
+    return getattr(module, classname)
+
+
+def parse_param(text):
+    """Parses a ``name=values`` command-line parameter
+
+    Values are comma separated (``fast=5,10,20``), or a
+    ``start:stop[:step]`` range (``fast=5:30:5``, stop excluded).
+
+    :Returns:
+        param : tuple
+            ``(name, list of values)``
+    """
+    name, _, values = text.partition("=")
+    if not name or not values:
+        raise argparse.ArgumentTypeError(
+            "Parameters must be given as name=values (%s)" % text)
+
+    if ":" in values and "," not in values:
+        bounds = [_parse_value(value) for value in values.split(":")]
+        start, stop = bounds[0], bounds[1]
+        step = bounds[2] if len(bounds) > 2 else 1
+        if all(isinstance(value, int) for value in bounds):
+            return name, list(range(start, stop, step))
+        return name, [float(value) for value in
+                      np.arange(start, stop, step)]
+
+    return name, [_parse_value(value) for value in values.split(",")]
+
+
+def _parse_value(value):
+    value = value.strip()
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return {"true": True, "false": False, "none": None}.get(
+        value.lower(), value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="QTPyLib strategy optimizer",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('strategy',
+                        help='Strategy class (path/to/file.py:ClassName)')
+    parser.add_argument('--instruments', nargs='+', required=True,
+                        help='Symbols to trade')
+    parser.add_argument('--resolution', default='1T',
+                        help='Bar resolution')
+    parser.add_argument('--param', action='append', default=[],
+                        type=parse_param, dest='params',
+                        help='Parameter values to try (name=1,2,3 or '
+                             'name=start:stop:step)')
+    parser.add_argument('--start', required=True,
+                        help='Backtest start date')
+    parser.add_argument('--end', help='Backtest end date')
+    parser.add_argument('--data', help='Path to backtester CSV files')
+    parser.add_argument('--blotter',
+                        help='Load history from this Blotter\'s MySQL')
+    parser.add_argument('--slippage', default=0, type=float,
+                        help='Slippage of backtest market/stop fills')
+    parser.add_argument('--commission', default=0, type=float,
+                        help='Backtest commission per share/contract')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='Seconds before backtest orders can fill')
+    parser.add_argument('--workers', default=multiprocessing.cpu_count(),
+                        type=int, help='Worker processes')
+    parser.add_argument('--search', default='grid',
+                        choices=['grid', 'random'], help='Search type')
+    parser.add_argument('--samples', default=10, type=int,
+                        help='Combinations to try (random search)')
+    parser.add_argument('--seed', type=int, help='Random search seed')
+    parser.add_argument('--metric', default='net_pnl',
+                        help='Metric to rank runs by')
+    parser.add_argument('--train',
+                        help='Walk-forward training period (eg. 90D)')
+    parser.add_argument('--test',
+                        help='Walk-forward test period (eg. 30D)')
+    parser.add_argument('--step', help='Time between walk-forward windows')
+    parser.add_argument('--anchored', action='store_true',
+                        help='Anchor walk-forward training periods (flag)')
+    parser.add_argument('--output',
+                        help='Directory to save each run\'s recorded data')
+    parser.add_argument('--results', help='Path to save the results (csv)')
+    parser.add_argument('--ibport', default=4001, type=int,
+                        help='IB TWS/GW Port')
+    parser.add_argument('--ibclient', default=998, type=int,
+                        help='IB TWS/GW Client ID (of the first process)')
+    parser.add_argument('--ibserver', default='localhost',
+                        help='IB TWS/GW Server hostname')
+    args = parser.parse_args(argv)
+
+    if bool(args.train) != bool(args.test):
+        parser.error("--train and --test must be used together")
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s]: %(message)s')
+
+    optimizer = Optimizer(
+        load_strategy(args.strategy), dict(args.params),
+        workers=args.workers, search=args.search, samples=args.samples,
+        seed=args.seed, metric=args.metric, output=args.output,
+        instruments=args.instruments, resolution=args.resolution,
+        start=args.start, end=args.end, data=args.data,
+        blotter=args.blotter, slippage=args.slippage,
+        commission=args.commission, latency=args.latency,
+        ibport=args.ibport, ibclient=args.ibclient, ibserver=args.ibserver)
+
+    if args.train:
+        results = optimizer.walkforward(args.train, args.test,
+                                        step=args.step,
+                                        anchored=args.anchored)
+    else:
+        results = optimizer.run()
+
+    if args.results:
+        results.to_csv(args.results, index=False)
+
+    with pd.option_context("display.max_rows", None,
+                           "display.width", 200):
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
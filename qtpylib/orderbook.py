@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Array-backed order books (market depth), maintained by the Blotter from
+IB's level updates and reconstructed by algos from the Blotter's
+messages.
+
+The Blotter publishes ORDERBOOK messages either as full snapshots or as
+deltas holding only the levels that changed since the previous message.
+Both carry a per-symbol sequence number (``seq``). Deltas are only
+applied on top of the message that preceded them, so a client that
+missed a message waits for the next (periodic) snapshot::
+
+    # snapshot
+    {"seq": 7, "snapshot": True, "bid": [..], "bidsize": [..],
+     "ask": [..], "asksize": [..]}
+
+    # delta: [side, position, price, size] per changed level
+    {"seq": 8, "snapshot": False, "levels": [[1, 0, 99.5, 300], ..]}
+"""
+
+import sys
+
+from threading import Lock
+
+import numpy as np
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# IB's market depth operations and sides
+INSERT, UPDATE, DELETE = 0, 1, 2
+ASK, BID = 0, 1
+
+_SIDES = ((BID, 'bid', 'bidsize'), (ASK, 'ask', 'asksize'))
+
+
+class OrderBook():
+    """Order book of one symbol
+
+    :Optional:
+        depth : int
+            Max levels per side (default: 10, IB's maximum)
+    """
+
+    def __init__(self, depth=10):
+        self.depth = int(depth)
+        self.prices = np.zeros((2, self.depth))
+        self.sizes = np.zeros((2, self.depth))
+        self.seq = 0
+        self.synced = False
+        self.lock = Lock()
+        self._dirty = set()
+
+    # -------------------------------------------
+    def update(self, position, operation, side, price, size):
+        """ applies an IB market depth update (``handleMarketDepth``) """
+        if not 0 <= position < self.depth or side not in (ASK, BID):
+            return
+
+        prices, sizes = self.prices[side], self.sizes[side]
+
+        if operation == INSERT:
+            prices[position + 1:] = prices[position:-1].copy()
+            sizes[position + 1:] = sizes[position:-1].copy()
+            changed = range(position, self.depth)
+        elif operation == DELETE:
+            prices[position:-1] = prices[position + 1:].copy()
+            sizes[position:-1] = sizes[position + 1:].copy()
+            prices[-1] = sizes[-1] = 0
+            changed = range(position, self.depth)
+        else:
+            changed = (position,)
+
+        if operation != DELETE:
+            prices[position] = price
+            sizes[position] = size
+
+        self._dirty.update((side, ix) for ix in changed)
+
+    # -------------------------------------------
+    @property
+    def changed(self):
+        """ were there updates since the last ``delta()``? """
+        return bool(self._dirty)
+
+    def delta(self):
+        """ ``[side, position, price, size]`` of levels changed since the
+        last call (next ``seq``) """
+        dirty, self._dirty = sorted(self._dirty), set()
+        self.seq += 1
+        return [[side, ix, float(self.prices[side, ix]),
+                 float(self.sizes[side, ix])] for side, ix in dirty]
+
+    def snapshot(self):
+        """ full book (next ``seq``) """
+        self._dirty = set()
+        self.seq += 1
+        return self.to_dict()
+
+    # -------------------------------------------
+    def to_dict(self):
+        """ ``bid``, ``bidsize``, ``ask`` and ``asksize`` lists """
+        levels = np.flatnonzero((self.sizes > 0).any(axis=0))
+        levels = levels[-1] + 1 if len(levels) else 0
+
+        book = {}
+        for side, price, size in _SIDES:
+            book[price] = self.prices[side, :levels].tolist()
+            book[size] = self.sizes[side, :levels].tolist()
+        return book
+
+    # -------------------------------------------
+    def apply(self, message):
+        """Applies a Blotter ORDERBOOK message (client side)
+
+        :Returns:
+            applied : bool
+                False if the book isn't in sync (waiting for a snapshot)
+        """
+        seq = message["seq"]
+
+        if message.get("snapshot"):
+            self.prices[:] = 0
+            self.sizes[:] = 0
+            for side, price, size in _SIDES:
+                levels = min(len(message[price]), self.depth)
+                self.prices[side, :levels] = message[price][:levels]
+                self.sizes[side, :levels] = message[size][:levels]
+
+        elif not self.synced or seq != self.seq + 1:
+            # missed a message
+            self.synced = False
+            return False
+
+        else:
+            for side, position, price, size in message["levels"]:
+                if 0 <= position < self.depth:
+                    self.prices[int(side), int(position)] = price
+                    self.sizes[int(side), int(position)] = size
+
+        self.seq = seq
+        self.synced = True
+        return True
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Day-partitioned ticks/bars tables (``--dbschema partitioned``, see
+``schema_partitioned.sql``): a clustered ``(symbol_id, datetime)``
+primary key, no secondary indexes and greeks stored inline, partitioned
+by day, so inserts only touch the current partition's index, history
+queries only scan the requested days and old ticks are dropped a whole
+partition at a time.
+
+The Blotter adds partitions ahead of time and applies the retention
+(``--tickretention``). This module is also a command line tool for
+migrating a database created with the default schema (with the Blotter
+stopped), maintaining partitions and benchmarking both schemas::
+
+    $ python -m qtpylib.partitions migrate --dbname qtpy --dbuser root
+    $ python -m qtpylib.partitions maintain --dbname qtpy --retention 30
+    $ python -m qtpylib.partitions benchmark --dbname qtpy_bench
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+
+from datetime import date, datetime, timedelta
+from time import time
+
+import pymysql
+from pymysql.constants.CLIENT import MULTI_STATEMENTS
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+TABLES = ("ticks", "bars")
+MAX_PARTITION = "pmax"
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "schema_partitioned.sql")
+
+_COLUMNS = {
+    "ticks": "`datetime`, `symbol_id`, `bid`, `bidsize`, `ask`, `asksize`, "
+             "`last`, `lastsize`",
+    "bars": "`datetime`, `symbol_id`, `open`, `high`, `low`, `close`, "
+            "`volume`",
+}
+
+_GREEK_COLUMNS = ("price", "underlying", "dividend", "volume", "iv", "oi",
+                  "delta", "gamma", "theta", "vega")
+
+# default schema rows, with their greeks
+COPY_SQL = """INSERT IGNORE INTO `{NEW}` ({COLUMNS}, {OPT_COLUMNS})
+    SELECT {TBL_COLUMNS}, {GREEKS} FROM `{TABLE}` tbl
+    LEFT JOIN `greeks` g ON g.`{KIND}_id` = tbl.`id`
+    WHERE tbl.`datetime` >= %s AND tbl.`datetime` < %s"""
+
+
+# ---------------------------------------------
+def partition_name(day):
+    return "p" + day.strftime("%Y%m%d")
+
+
+def partition_date(name):
+    """ the day held by a ``pYYYYMMDD`` partition (or None) """
+    try:
+        return datetime.strptime(name, "p%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def partitions(dbcurr, table):
+    """ names of a table's partitions (empty if not partitioned) """
+    dbcurr.execute("""SELECT `PARTITION_NAME`
+        FROM `information_schema`.`PARTITIONS`
+        WHERE `TABLE_SCHEMA`=DATABASE() AND `TABLE_NAME`=%s
+            AND `PARTITION_NAME` IS NOT NULL
+        ORDER BY `PARTITION_ORDINAL_POSITION`""", (table,))
+    return [row[0] for row in dbcurr.fetchall()]
+
+
+def is_partitioned(dbcurr, table="ticks"):
+    return MAX_PARTITION in partitions(dbcurr, table)
+
+
+def table_ddl(table, name=None, schema_file=SCHEMA_FILE):
+    """ a table's ``CREATE TABLE`` statement (optionally renamed) """
+    with open(schema_file, "r") as f:
+        schema = f.read()
+    match = re.search(r"CREATE TABLE IF NOT EXISTS `%s` \(.*?;" % table,
+                      schema, re.S)
+    if match is None:
+        raise ValueError("No %s table in %s" % (table, schema_file))
+    return match.group(0).replace("`%s`" % table, "`%s`" % (
+        name or table), 1)
+
+
+# ---------------------------------------------
+def add_partitions(dbcurr, table, until, since=None):
+    """Splits day partitions off the ``pmax`` partition
+
+    :Parameters:
+        table : str
+            ``ticks`` or ``bars``
+        until : date
+            Last day to add
+
+    :Optional:
+        since : date
+            First day to add if the table has no day partitions yet
+            (default: today). Older rows are kept in the first partition
+
+    :Returns:
+        days : list
+            Added days
+    """
+    days = [partition_date(name) for name in partitions(dbcurr, table)]
+    days = [day for day in days if day is not None]
+
+    day = days[-1] + timedelta(days=1) if days else (
+        since or datetime.utcnow().date())
+
+    added = []
+    while day <= until:
+        added.append(day)
+        day += timedelta(days=1)
+
+    if added:
+        dbcurr.execute(
+            "ALTER TABLE `%s` REORGANIZE PARTITION `%s` INTO (%s, "
+            "PARTITION `%s` VALUES LESS THAN MAXVALUE)" % (
+                table, MAX_PARTITION, ", ".join(
+                    "PARTITION `%s` VALUES LESS THAN (TO_DAYS('%s'))" % (
+                        partition_name(day), day + timedelta(days=1))
+                    for day in added), MAX_PARTITION))
+    return added
+
+
+def drop_partitions(dbcurr, table, before):
+    """ drops day partitions older than ``before`` (date) """
+    dropped = [name for name in partitions(dbcurr, table)
+               if partition_date(name) is not None and
+               partition_date(name) < before]
+    if dropped:
+        dbcurr.execute("ALTER TABLE `%s` DROP PARTITION %s" % (
+            table, ", ".join("`%s`" % name for name in dropped)))
+    return dropped
+
+
+def maintain(dbcurr, days_ahead=3, tick_retention=0, bar_retention=0,
+             logger=None):
+    """Adds partitions for the coming days and drops expired ones
+
+    :Optional:
+        days_ahead : int
+            Keep partitions this many days ahead (default: 3)
+        tick_retention : int
+            Drop ticks older than this many days (default: 0 = keep)
+        bar_retention : int
+            Drop bars older than this many days (default: 0 = keep)
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    today = datetime.utcnow().date()
+
+    for table, retention in zip(TABLES, (tick_retention, bar_retention)):
+        added = add_partitions(dbcurr, table,
+                               today + timedelta(days=int(days_ahead)))
+        if added:
+            logger.info("Added %d %s partitions (until %s)",
+                        len(added), table, added[-1])
+
+        if retention and int(retention) > 0:
+            dropped = drop_partitions(dbcurr, table, today - timedelta(
+                days=int(retention)))
+            if dropped:
+                logger.info("Dropped %d %s partitions (%s - %s)",
+                            len(dropped), table, dropped[0], dropped[-1])
+
+
+# ---------------------------------------------
+def migrate(dbconn, batch_days=1, days_ahead=3, keep_old=True, logger=None):
+    """Migrates ticks/bars (and greeks) from the default schema
+
+    The data is copied to new, partitioned tables a batch of days at
+    a time, which then replace the old ones (kept as ``ticks_old``,
+    ``bars_old`` and ``greeks_old`` unless ``keep_old`` is False).
+    Stop the Blotter before migrating, then run it with
+    ``--dbschema partitioned``.
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    dbcurr = dbconn.cursor()
+
+    if is_partitioned(dbcurr, "ticks"):
+        logger.info("Database is already partitioned")
+        return False
+
+    today = datetime.utcnow().date()
+    for table in TABLES:
+        new = table + "_new"
+        dbcurr.execute("DROP TABLE IF EXISTS `%s`" % new)
+        dbcurr.execute(table_ddl(table, new))
+
+        dbcurr.execute("SELECT MIN(`datetime`), MAX(`datetime`) FROM `%s`"
+                       % table)
+        first, last = dbcurr.fetchone()
+        if first is None:
+            add_partitions(dbcurr, new, today + timedelta(days=days_ahead))
+            continue
+
+        add_partitions(dbcurr, new, max(last.date(), today) + timedelta(
+            days=days_ahead), since=first.date())
+
+        sql = COPY_SQL.format(
+            NEW=new, TABLE=table, KIND=table[:-1], COLUMNS=_COLUMNS[table],
+            OPT_COLUMNS=", ".join("`opt_%s`" % name
+                                  for name in _GREEK_COLUMNS),
+            TBL_COLUMNS=_COLUMNS[table].replace("`datetime`", "tbl.`datetime`"
+                                                ).replace(", `", ", tbl.`"),
+            GREEKS=", ".join("g.`%s`" % name for name in _GREEK_COLUMNS))
+
+        day = first.date()
+        while day <= last.date():
+            end = day + timedelta(days=int(batch_days))
+            start_time = time()
+            dbcurr.execute(sql, (day, end))
+            dbconn.commit()
+            logger.info("Copied %s %s - %s: %d rows (%.1fs)", table, day,
+                        end - timedelta(days=1), dbcurr.rowcount,
+                        time() - start_time)
+            day = end
+
+    dbcurr.execute("""RENAME TABLE `ticks` TO `ticks_old`,
+        `ticks_new` TO `ticks`, `bars` TO `bars_old`, `bars_new` TO `bars`,
+        `greeks` TO `greeks_old`""")
+    if not keep_old:
+        dbcurr.execute("DROP TABLE `greeks_old`, `ticks_old`, `bars_old`")
+    dbconn.commit()
+
+    logger.info("Migrated to the partitioned schema")
+    return True
+
+
+# ---------------------------------------------
+def benchmark(dbconn, rows=200000, symbols=20, days=5, queries=20,
+              batch_size=500, logger=None):
+    """Compares the insert rate and history query time of both schemas
+
+    Uses (and drops) ``bench_*`` tables, so use a scratch database.
+
+    :Returns:
+        results : dict
+            ``inserts_per_sec`` and ``query_ms`` (avg) per schema
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    default_schema = os.path.join(os.path.dirname(SCHEMA_FILE), "schema.sql")
+    dbcurr = dbconn.cursor()
+
+    start = datetime.combine(date.today() - timedelta(days=days),
+                             datetime.min.time())
+    step = timedelta(seconds=days * 86400. / (rows / symbols))
+    data = [(start + step * (ix // symbols), ix % symbols + 1,
+             100., 1, 100.25, 1, 100.1, 1) for ix in range(rows)]
+
+    results = {}
+    for schema, ddl, columns in (
+            ("default", table_ddl("ticks", "bench_ticks", default_schema),
+             8),
+            ("partitioned", table_ddl("ticks", "bench_ticks"), 18)):
+
+        dbcurr.execute("DROP TABLE IF EXISTS `bench_ticks`")
+        # foreign keys aren't part of the benchmark
+        dbcurr.execute(re.sub(r",\s*CONSTRAINT .*?\)\s*REFERENCES .*?\)",
+                       "", ddl))
+        if schema == "partitioned":
+            add_partitions(dbcurr, "bench_ticks", date.today(),
+                           since=start.date())
+
+        sql = "INSERT IGNORE INTO `bench_ticks` (%s) VALUES (%s)" % (
+            _COLUMNS["ticks"] + ("" if columns == 8 else ", " + ", ".join(
+                "`opt_%s`" % name for name in _GREEK_COLUMNS)),
+            ", ".join(["%s"] * columns))
+        padding = (None,) * (columns - 8)
+
+        started = time()
+        for ix in range(0, rows, batch_size):
+            dbcurr.executemany(sql, [row + padding for row in
+                                     data[ix:ix + batch_size]])
+            dbconn.commit()
+        inserts = rows / (time() - started)
+
+        # a few hours of one symbol
+        started = time()
+        for ix in range(queries):
+            query_start = start + timedelta(days=days * ix / queries)
+            dbcurr.execute("""SELECT * FROM `bench_ticks`
+                WHERE `symbol_id`=%s AND `datetime` >= %s
+                AND `datetime` <= %s""", (ix % symbols + 1, query_start,
+                                          query_start + timedelta(hours=4)))
+            dbcurr.fetchall()
+        query_ms = (time() - started) * 1000. / queries
+
+        results[schema] = {"inserts_per_sec": round(inserts),
+                           "query_ms": round(query_ms, 2)}
+        logger.info("%s schema: %d inserts/sec, %.2f ms/query",
+                    schema, inserts, query_ms)
+
+    dbcurr.execute("DROP TABLE IF EXISTS `bench_ticks`")
+    return results
+
+
+# ---------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="QTPyLib partitioned schema tool",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'maintain',
+                                            'benchmark'])
+    parser.add_argument('--dbhost', default='localhost')
+    parser.add_argument('--dbport', default='3306')
+    parser.add_argument('--dbname', default='qtpy')
+    parser.add_argument('--dbuser', default='root')
+    parser.add_argument('--dbpass', default='')
+    parser.add_argument('--batchdays', default=1, type=int,
+                        help='Days copied per transaction (migrate)')
+    parser.add_argument('--dropold', action='store_true',
+                        help='Drop the old tables after migrating')
+    parser.add_argument('--daysahead', default=3, type=int,
+                        help='Days to add partitions for')
+    parser.add_argument('--retention', default=0, type=int,
+                        help='Drop ticks older than N days (maintain)')
+    parser.add_argument('--rows', default=200000, type=int,
+                        help='Ticks to insert (benchmark)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s]: %(message)s')
+
+    dbconn = pymysql.connect(
+        client_flag=MULTI_STATEMENTS,
+        host=str(args.dbhost),
+        port=int(args.dbport),
+        user=str(args.dbuser),
+        passwd=str(args.dbpass),
+        db=str(args.dbname)
+    )
+
+    try:
+        if args.command == "migrate":
+            migrate(dbconn, batch_days=args.batchdays,
+                    days_ahead=args.daysahead, keep_old=not args.dropold)
+        elif args.command == "maintain":
+            maintain(dbconn.cursor(), days_ahead=args.daysahead,
+                     tick_retention=args.retention)
+        else:
+            benchmark(dbconn, rows=args.rows)
+    finally:
+        dbconn.close()
+
+
+if __name__ == "__main__":
+    main()
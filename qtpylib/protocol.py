@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Binary wire format used by the Blotter when running with
+``--zmqformat binary``.
+
+Every message is sent as two ZeroMQ frames:
+
+- topic: ``{zmqtopic}|{symbol}|{kind}`` (utf-8)
+- payload: a 1-byte encoding tag and a timestamp, followed by a
+  fixed-layout struct for TICK/BAR/QUOTE, packed level arrays for
+  ORDERBOOK (snapshots, or changed levels for deltas - see
+  ``qtpylib.orderbook``), or JSON for messages that don't fit these schemas
+  (eg. option quotes), and finally ``symbol_group\\0asset_class``.
+
+Timestamps travel as microseconds since epoch (UTC) and are
+decoded into ``datetime`` objects.
+
+Since protocol version 2, json messages are prefixed with
+``{symbol}|{kind}|`` (``{symbol}|{kind}|{zmqtopic} {json}``), which keeps
+them readable by older clients while letting newer ones subscribe to
+specific symbols/kinds, so unwanted messages are filtered by ZeroMQ.
+"""
+
+import json
+import sys
+
+from datetime import datetime, timedelta
+from struct import Struct
+
+from numpy import (
+    integer as np_integer,
+    floating as np_floating,
+    datetime64 as np_datetime64,
+    int64 as np_int64
+)
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+FORMATS = ("json", "binary")
+KINDS = ("TICK", "BAR", "QUOTE", "ORDERBOOK")
+
+# published in the blotter's cached args
+VERSION = 2
+
+OPT_FIELDS = ('opt_price', 'opt_underlying', 'opt_dividend', 'opt_volume',
+              'opt_iv', 'opt_oi', 'opt_delta', 'opt_gamma', 'opt_vega',
+              'opt_theta')
+
+# (fields, struct format) per kind
+SCHEMAS = {
+    "TICK": (('last', 'lastsize', 'bid', 'bidsize', 'ask', 'asksize') +
+             OPT_FIELDS, Struct('<dqdqdq10d')),
+    "BAR": (('open', 'high', 'low', 'close', 'volume'), Struct('<ddddq')),
+    "QUOTE": (('bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize'),
+              Struct('<6d')),
+}
+
+BOOK_FIELDS = ('bid', 'bidsize', 'ask', 'asksize')
+
+META_FIELDS = frozenset(('symbol', 'symbol_group', 'asset_class',
+                         'timestamp', 'kind'))
+
+# expected keys per kind (schema fields + meta fields)
+_SCHEMA_KEYS = {kind: frozenset(SCHEMAS[kind][0]) | META_FIELDS
+                for kind in SCHEMAS}
+_SCHEMA_KEYS["ORDERBOOK"] = frozenset(BOOK_FIELDS) | META_FIELDS
+
+# sequenced order book snapshots/deltas
+_BOOK_KEYS = (_SCHEMA_KEYS["ORDERBOOK"] | {"seq", "snapshot"},
+              META_FIELDS | {"seq", "snapshot", "levels"})
+
+TAG_STRUCT = b'S'
+TAG_BOOK = b'B'
+TAG_JSON = b'J'
+TAG_BOOK_SNAPSHOT = b'O'
+TAG_BOOK_DELTA = b'D'
+
+NO_TIME = -2 ** 63
+
+_HEAD = Struct('<cq')
+_LEVELS = Struct('<I')
+_BOOK_SEQ = Struct('<QI')
+_BOOK_LEVEL = Struct('<BHdd')
+_EPOCH = datetime(1970, 1, 1)
+_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S")
+_DAYS = {}
+_NAN = float("nan")
+
+
+# ---------------------------------------------
+def topic(zmqtopic, symbol=None, kind=None):
+    """ topic frame (or subscription prefix) for a symbol/kind """
+    if symbol is None:
+        return (zmqtopic + "|").encode("utf-8")
+    if kind is None:
+        return ("%s|%s|" % (zmqtopic, symbol)).encode("utf-8")
+    return ("%s|%s|%s" % (zmqtopic, symbol, kind)).encode("utf-8")
+
+
+def text_topic(symbol, kind=None):
+    """ json message prefix (or subscription prefix) for a symbol/kind """
+    if kind is None:
+        return "%s|" % symbol
+    return "%s|%s|" % (symbol, kind)
+
+
+def subscriptions(zmqtopic, symbols, kinds=KINDS, binary=False, version=1):
+    """Subscription prefixes for the given symbols and message kinds
+
+    :Parameters:
+        zmqtopic : str
+            Blotter's ZeroMQ topic
+        symbols : list
+            Symbols to receive
+
+    :Optional:
+        kinds : list
+            Message kinds to receive (default: all)
+        binary : bool
+            Blotter uses the binary format
+        version : int
+            Blotter's protocol version (1 can't be filtered by symbol)
+
+    :Returns:
+        prefixes : list
+            Prefixes (bytes) to pass to ``zmq.SUBSCRIBE``
+    """
+    if not binary and version < 2:
+        return [b""]
+
+    all_kinds = set(kinds) >= set(KINDS)
+    prefixes = []
+    for symbol in symbols:
+        for kind in ([None] if all_kinds else kinds):
+            if binary:
+                prefixes.append(topic(zmqtopic, symbol, kind))
+            else:
+                prefixes.append(text_topic(symbol, kind).encode("utf-8"))
+    return prefixes
+
+
+# ---------------------------------------------
+def to_micros(timestamp):
+    """ microseconds since epoch (UTC) of a str/datetime/int timestamp """
+    if timestamp is None:
+        return NO_TIME
+
+    if isinstance(timestamp, str):
+        return _string_to_micros(timestamp)
+
+    if isinstance(timestamp, np_datetime64):
+        return int(timestamp.astype('datetime64[us]').astype(np_int64))
+
+    if isinstance(timestamp, (int, np_integer)):
+        # same as the json encoder: integers are milliseconds
+        return int(timestamp) * 1000
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None) - timestamp.utcoffset()
+
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _parse_time(string):
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(string, fmt)
+        except ValueError:
+            pass
+
+    raise ValueError("Unknown timestamp format")
+
+
+def _string_to_micros(string):
+    # fast path for "YYYY-MM-DD HH:MM:SS[.fff[fff]]"
+    # (the date part's offset is cached, as it rarely changes)
+    if len(string) in (19, 23, 26) and string[10] == " ":
+        try:
+            day = _DAYS.get(string[:10])
+            if day is None:
+                if len(_DAYS) > 1000:
+                    _DAYS.clear()
+                day = to_micros(datetime.strptime(string[:10], "%Y-%m-%d"))
+                _DAYS[string[:10]] = day
+
+            micros = int(string[20:].ljust(6, "0")) if len(string) > 19 else 0
+            return day + micros + 1000000 * (
+                int(string[11:13]) * 3600 + int(string[14:16]) * 60 +
+                int(string[17:19]))
+        except ValueError:
+            pass
+
+    return to_micros(_parse_time(string))
+
+
+def from_micros(micros):
+    """ naive UTC datetime from microseconds since epoch """
+    if micros == NO_TIME:
+        return None
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _json_default(obj):
+    if isinstance(obj, np_integer):
+        return int(obj)
+    if isinstance(obj, np_floating):
+        return float(obj)
+    if isinstance(obj, datetime):
+        return obj.strftime(_TIME_FORMATS[0])
+    raise TypeError
+
+
+def _pack_fixed(data, kind, micros):
+    if kind in SCHEMAS:
+        names, layout = SCHEMAS[kind]
+        values = [data[name] for name in names]
+        if None in values:
+            values = [_NAN if value is None else value for value in values]
+        return _HEAD.pack(TAG_STRUCT, micros) + layout.pack(*values)
+
+    if kind == "ORDERBOOK":
+        if "levels" in data:
+            return _HEAD.pack(TAG_BOOK_DELTA, micros) + _BOOK_SEQ.pack(
+                data["seq"], len(data["levels"])) + b"".join(
+                    _BOOK_LEVEL.pack(*level) for level in data["levels"])
+
+        values = []
+        for name in BOOK_FIELDS:
+            values.extend(map(float, data[name]))
+        if "seq" in data:
+            head = _HEAD.pack(TAG_BOOK_SNAPSHOT, micros) + _BOOK_SEQ.pack(
+                data["seq"], len(data["bid"]))
+        else:
+            head = _HEAD.pack(TAG_BOOK, micros) + _LEVELS.pack(
+                len(data["bid"]))
+        return head + Struct('<%dd' % len(values)).pack(*values)
+
+    return None
+
+
+# ---------------------------------------------
+def encode(zmqtopic, data, kind):
+    """Encode a Blotter message into ``[topic, payload]`` frames
+
+    :Parameters:
+        zmqtopic : str
+            Blotter's ZeroMQ topic
+        data : dict
+            Message data (as broadcasted by the Blotter)
+        kind : str
+            TICK, BAR, QUOTE or ORDERBOOK
+
+    :Returns:
+        frames : list
+            Topic and payload frames (bytes)
+    """
+    frames = [topic(zmqtopic, data["symbol"], kind)]
+    timestamp = data.get("timestamp")
+    strings = ("%s\0%s" % (data.get("symbol_group", ""),
+                           data.get("asset_class", ""))).encode("utf-8")
+
+    try:
+        micros = to_micros(timestamp)
+    except Exception as e:
+        micros = None
+
+    keys = data.keys() | META_FIELDS
+    if micros is not None and (keys == _SCHEMA_KEYS.get(kind) or (
+            kind == "ORDERBOOK" and keys in _BOOK_KEYS)):
+        try:
+            body = _pack_fixed(data, kind, micros)
+        except Exception as e:
+            body = None
+
+        if body is not None:
+            frames.append(body + strings)
+            return frames
+
+    # doesn't fit a schema
+    payload = {k: v for k, v in data.items() if k not in META_FIELDS}
+    if micros is None:
+        payload["timestamp"] = timestamp
+        micros = NO_TIME
+
+    body = json.dumps(payload, default=_json_default).encode("utf-8")
+    frames.append(_HEAD.pack(TAG_JSON, micros) + _LEVELS.pack(len(body)) +
+                  body + strings)
+    return frames
+
+
+# ---------------------------------------------
+def decode(topic_frame, payload):
+    """Decode ``[topic, payload]`` frames back into a message dict
+
+    Missing numeric values are returned as ``NaN`` (rather than ``None``)
+    and ``timestamp`` as a UTC ``datetime``.
+    """
+    _, symbol, kind = topic_frame.decode("utf-8").rsplit("|", 2)
+    tag, micros = _HEAD.unpack_from(payload)
+    offset = _HEAD.size
+
+    if tag == TAG_STRUCT:
+        names, layout = SCHEMAS[kind]
+        values = layout.unpack_from(payload, offset)
+        data = dict(zip(names, values))
+        offset += layout.size
+
+    elif tag in (TAG_BOOK, TAG_BOOK_SNAPSHOT):
+        if tag == TAG_BOOK:
+            seq = None
+            levels = _LEVELS.unpack_from(payload, offset)[0]
+            offset += _LEVELS.size
+        else:
+            seq, levels = _BOOK_SEQ.unpack_from(payload, offset)
+            offset += _BOOK_SEQ.size
+
+        values = Struct('<%dd' % (levels * 4)).unpack_from(payload, offset)
+        offset += levels * 4 * 8
+        data = {name: list(values[ix * levels:(ix + 1) * levels])
+                for ix, name in enumerate(BOOK_FIELDS)}
+        if seq is not None:
+            data["seq"] = seq
+            data["snapshot"] = True
+
+    elif tag == TAG_BOOK_DELTA:
+        seq, count = _BOOK_SEQ.unpack_from(payload, offset)
+        offset += _BOOK_SEQ.size
+        levels = [list(level) for level in _BOOK_LEVEL.iter_unpack(
+            payload[offset:offset + count * _BOOK_LEVEL.size])]
+        offset += count * _BOOK_LEVEL.size
+        data = {"seq": seq, "snapshot": False, "levels": levels}
+
+    else:
+        length = _LEVELS.unpack_from(payload, offset)[0]
+        offset += _LEVELS.size
+        data = json.loads(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    symbol_group, asset_class = payload[offset:].decode("utf-8").split("\0")
+
+    if micros != NO_TIME or "timestamp" not in data:
+        timestamp = from_micros(micros)
+        if timestamp is not None:
+            data["timestamp"] = timestamp
+
+    data["symbol"] = symbol
+    data["symbol_group"] = symbol_group
+    data["asset_class"] = asset_class
+    data["kind"] = kind
+    return data
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Market data replay (used by ``Blotter.replay()``): stored ticks and
+bars are turned into the same messages the Blotter publishes live and
+published in timestamp order, at a multiple of real time or as fast
+as subscribers keep up with.
+
+Bars are published when they close (same as live 1-minute bars),
+after the ticks they're made of.
+"""
+
+import glob
+import heapq
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+
+from qtpylib import protocol
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+FIELDS = {
+    "TICK": ("bid", "bidsize", "ask", "asksize", "last", "lastsize"),
+    "BAR": ("open", "high", "low", "close", "volume"),
+}
+
+OPTION_FIELDS = ("opt_price", "opt_underlying", "opt_dividend",
+                 "opt_volume", "opt_iv", "opt_oi", "opt_delta",
+                 "opt_gamma", "opt_theta", "opt_vega")
+
+_INT_FIELDS = ("bidsize", "asksize", "lastsize", "volume")
+
+
+# ---------------------------------------------
+def read_csv(path, kind="BAR", symbols=None, start=None, end=None):
+    """Reads ``workflow.prepare_data()`` CSV files
+
+    :Parameters:
+        path : str
+            Directory with ``{symbol}.{kind}.csv`` files
+
+    :Optional:
+        kind : str
+            ``TICK`` or ``BAR`` (default: BAR)
+        symbols : list
+            Symbols to read (default: all files of that kind)
+        start / end : str / datetime
+            Time range (UTC)
+
+    :Returns:
+        data : pd.DataFrame
+            Rows of all symbols, sorted by ``datetime``
+    """
+    if symbols is None or list(symbols)[:1] == ["*"]:
+        files = sorted(glob.glob(os.path.join(path, "*.%s.csv" % kind)))
+    else:
+        files = [os.path.join(path, "%s.%s.csv" % (symbol.strip(), kind))
+                 for symbol in symbols]
+        files = [file for file in files if os.path.exists(file)]
+
+    dfs = [pd.read_csv(file) for file in files]
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame(columns=["datetime", "symbol"])
+
+    data = pd.concat(dfs, sort=False, ignore_index=True)
+    data["datetime"] = pd.to_datetime(data["datetime"], utc=True
+                                      ).dt.tz_localize(None)
+    if start is not None:
+        data = data[data["datetime"] >= pd.to_datetime(start)]
+    if end is not None:
+        data = data[data["datetime"] <= pd.to_datetime(end)]
+
+    return data.sort_values("datetime", kind="mergesort")
+
+
+# ---------------------------------------------
+def iter_messages(chunks, kind, bar_seconds=60):
+    """Turns time-ordered chunks of stored rows into Blotter messages
+
+    :Parameters:
+        chunks : iterable
+            DataFrames with ``datetime``, ``symbol``, ``symbol_group``,
+            ``asset_class`` and the ``kind``'s columns
+        kind : str
+            ``TICK`` or ``BAR``
+
+    :Optional:
+        bar_seconds : int
+            Bars are published this long after they start (default: 60)
+
+    :Returns:
+        messages : generator
+            ``(publish time in microseconds, message)`` tuples
+    """
+    fields = FIELDS[kind]
+    delay = int(bar_seconds * 1000000) if kind == "BAR" else 0
+    time_format = "%Y-%m-%d %H:%M:%S.%f" if kind == "TICK" else \
+        "%Y-%m-%d %H:%M:%S"
+
+    for data in chunks:
+        if data.empty:
+            continue
+        data = data.sort_values("datetime", kind="mergesort")
+        times = pd.to_datetime(data["datetime"])
+        micros = times.values.astype("datetime64[us]").astype("int64")
+        stamps = times.dt.strftime(time_format).values
+        if kind == "TICK":
+            stamps = [stamp[:-3] for stamp in stamps]
+
+        columns = [name for name in fields + OPTION_FIELDS
+                   if name in data.columns]
+        rows = zip(micros, stamps, data["symbol"].values,
+                   data["symbol_group"].values, data["asset_class"].values,
+                   *[data[name].values for name in columns])
+
+        for row in rows:
+            message = {
+                # ezIBpy's formatting
+                "symbol": row[2][:-4] if row[2].endswith("_STK") else row[2],
+                "symbol_group": row[3],
+                "asset_class": row[4],
+                "timestamp": row[1],
+            }
+            for name, value in zip(columns, row[5:]):
+                if name in OPTION_FIELDS and (
+                        value is None or value != value):
+                    continue
+                message[name] = int(value) if name in _INT_FIELDS and \
+                    value == value else float(value)
+            message["kind"] = kind
+            yield int(row[0]) + delay, message
+
+
+def merge(*streams):
+    """ merges ``iter_messages()`` streams in publish time order """
+    return heapq.merge(*streams, key=lambda item: item[0])
+
+
+# ---------------------------------------------
+class Replayer():
+    """Publishes messages at their original pace (or faster)
+
+    :Parameters:
+        publish : func
+            Called with ``(message, kind)`` for each message
+
+    :Optional:
+        speed : float
+            Replay speed, as a multiple of real time. Use 0 to publish
+            as fast as possible (default: 1)
+        logger : object
+            Logger to report progress to
+        log_interval : float
+            Seconds between progress reports (default: 10)
+    """
+
+    def __init__(self, publish, speed=1, logger=None, log_interval=10):
+        self.publish = publish
+        self.speed = float(speed or 0)
+        self.logger = logger if logger is not None else \
+            logging.getLogger(__name__)
+        self.log_interval = log_interval
+
+        self.published = 0
+        self.max_lag = 0.
+        self.started = None
+        self.ended = None
+        self.replay_time = None
+        self._running = False
+
+    # ---------------------------------------------
+    def run(self, messages):
+        """ publishes ``(micros, message)`` tuples (until stopped) """
+        self._running = True
+        self.started = time.time()
+        next_log = self.started + self.log_interval
+        first = None
+
+        for micros, message in messages:
+            if not self._running:
+                break
+
+            if first is None:
+                first = micros
+            self.replay_time = micros
+
+            # wait until it's due
+            if self.speed > 0:
+                due = self.started + (micros - first) / 1e6 / self.speed
+                wait = due - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    self.max_lag = max(self.max_lag, -wait)
+
+            # blocks while subscribers are backlogged
+            self.publish(message, message["kind"])
+            self.published += 1
+
+            if time.time() >= next_log:
+                next_log = time.time() + self.log_interval
+                self.logger.info(
+                    "Replayed %d messages (%s, %d/sec)", self.published,
+                    protocol.from_micros(micros), self.stats()["rate"])
+
+        self._running = False
+        self.ended = time.time()
+        return self.stats()
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        elapsed = (self.ended or time.time()) - (self.started or time.time())
+        return {
+            "published": self.published,
+            "seconds": round(elapsed, 3),
+            "rate": self.published / elapsed if elapsed > 0 else 0,
+            "max_lag": round(self.max_lag, 3),
+            "replay_time": None if self.replay_time is None else
+            protocol.from_micros(self.replay_time),
+        }
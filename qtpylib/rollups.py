@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Multi-resolution bar rollups (eg. ``5T``, ``1H``, ``1D``), maintained by
+the Blotter's writer as 1-minute bars are stored and read by
+``Blotter.history()`` instead of resampling every 1-minute bar.
+
+Each minute bar is merged into its period's rollup bar (open kept,
+high/low extended, close replaced, volume added), so rollups are always
+up to date, including the current period. Periods start at multiples of
+their length since midnight (UTC), same as ``tools.resample()``.
+
+Options' bars aren't rolled up (their greeks are only kept per minute).
+"""
+
+import re
+import sys
+
+import numpy as np
+
+from qtpylib import protocol
+from qtpylib.coverage import to_datetime
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+UNITS = {"T": 60, "H": 3600, "D": 86400}
+
+# ``table`` prefix of rollups in the columnar archive (eg. bars_5T)
+ARCHIVE_PREFIX = "bars_"
+
+SKIP_ASSET_CLASSES = ("OPT", "FOP")
+
+# merge a minute bar (or a partial period) into its period
+ROLLUPS_SQL = """INSERT INTO `rollups` (`resolution`, `datetime`,
+    `symbol_id`, `open`, `high`, `low`, `close`, `volume`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        `high`=GREATEST(`high`, VALUES(`high`)),
+        `low`=LEAST(`low`, VALUES(`low`)),
+        `close`=VALUES(`close`), `volume`=`volume`+VALUES(`volume`)
+"""
+
+# (re)build periods from stored minute bars, server side
+# (open/close are the first item of an ordered GROUP_CONCAT, which
+# is intact even if group_concat_max_len truncates the rest)
+REBUILD_SQL = """INSERT INTO `rollups` (`resolution`, `datetime`,
+    `symbol_id`, `open`, `high`, `low`, `close`, `volume`)
+    SELECT %s, DATE_ADD('1970-01-01', INTERVAL FLOOR(TIMESTAMPDIFF(
+            SECOND, '1970-01-01', b.`datetime`) / %s) * %s SECOND) AS period,
+        b.`symbol_id`,
+        SUBSTRING_INDEX(GROUP_CONCAT(b.`open` ORDER BY b.`datetime`),
+                        ',', 1) + 0,
+        MAX(b.`high`), MIN(b.`low`),
+        SUBSTRING_INDEX(GROUP_CONCAT(b.`close` ORDER BY b.`datetime` DESC),
+                        ',', 1) + 0,
+        SUM(b.`volume`)
+    FROM `bars` b JOIN `symbols` s ON b.`symbol_id` = s.`id`
+    WHERE b.`datetime` >= %s AND b.`datetime` < %s
+        AND s.`asset_class` NOT IN ('OPT', 'FOP')
+    GROUP BY period, b.`symbol_id`
+    ON DUPLICATE KEY UPDATE
+        `open`=VALUES(`open`), `high`=VALUES(`high`), `low`=VALUES(`low`),
+        `close`=VALUES(`close`), `volume`=VALUES(`volume`)
+"""
+
+_RESOLUTION = re.compile(r"^(\d+)\s*(T|MIN|H|D)$")
+
+
+# ---------------------------------------------
+def resolution_seconds(resolution):
+    """ length of a ``T``/``H``/``D`` resolution in seconds (or None) """
+    match = _RESOLUTION.match(str(resolution).strip().upper())
+    if match is None:
+        return None
+    unit = "T" if match.group(2) == "MIN" else match.group(2)
+    return int(match.group(1)) * UNITS[unit]
+
+
+def parse_rollups(value):
+    """Parses the Blotter's ``rollups`` argument
+
+    :Parameters:
+        value : str / list
+            Resolutions, eg. ``"5T,15T,1H,1D"`` (empty = no rollups)
+
+    :Returns:
+        rollups : list
+            Normalized resolutions, from finest to coarsest
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+
+    rollups = {}
+    for resolution in value:
+        resolution = str(resolution).strip().upper()
+        if not resolution:
+            continue
+        seconds = resolution_seconds(resolution)
+        if seconds is None or seconds <= 60 or 86400 % seconds:
+            raise ValueError(
+                "Invalid rollup resolution %s (must be longer than a "
+                "minute and divide a day, eg. 5T, 1H, 1D)" % resolution)
+        rollups[seconds] = resolution.replace("MIN", "T")
+
+    return [rollups[seconds] for seconds in sorted(rollups)]
+
+
+def best_rollup(resolution, rollups):
+    """ coarsest rollup that ``resolution`` can be resampled from """
+    seconds = resolution_seconds(resolution)
+    if seconds is None:
+        return None
+
+    best = None
+    for rollup in rollups:
+        if seconds % resolution_seconds(rollup) == 0:
+            best = rollup
+    return best
+
+
+def archive_table(resolution):
+    return ARCHIVE_PREFIX + resolution
+
+
+def is_archive_table(table):
+    return table.startswith(ARCHIVE_PREFIX)
+
+
+# ---------------------------------------------
+def period_start(micros, seconds):
+    """ start of the period holding a timestamp (microseconds) """
+    period = seconds * 1000000
+    return micros - micros % period
+
+
+def period_bounds(start, end, seconds):
+    """ ``start``-``end`` widened to whole periods (naive UTC datetimes) """
+    start = protocol.from_micros(period_start(
+        protocol.to_micros(to_datetime(start)), seconds))
+    end = protocol.from_micros(period_start(
+        protocol.to_micros(to_datetime(end)), seconds) + seconds * 1000000)
+    return start, end
+
+
+def rollup_ranges(start, end, resolution):
+    """Splits ``start``-``end`` into ranges to read from a rollup (its
+    whole periods) and from the minute bars (the partial periods around
+    them, whose rollup bars hold minutes outside of the range)
+
+    :Parameters:
+        start : str / datetime
+            Start time (UTC)
+        end : str / datetime
+            End time (UTC, inclusive), or None
+        resolution : str
+            Rollup resolution
+
+    :Returns:
+        ranges : list
+            ``(resolution, start, end)`` tuples (inclusive, resolution is
+            None for minute bars), empty if there are no whole periods
+    """
+    seconds = resolution_seconds(resolution)
+    start_micros = protocol.to_micros(to_datetime(start))
+    first = period_start(start_micros + seconds * 1000000 - 1, seconds)
+    last = None if end is None else period_start(
+        protocol.to_micros(to_datetime(end)), seconds)
+    if last is not None and last <= first:
+        return []
+
+    ranges = []
+    if first > start_micros:
+        ranges.append((None, start, protocol.from_micros(first - 1)))
+    ranges.append((resolution, protocol.from_micros(first), None
+                   if last is None else protocol.from_micros(last - 1)))
+    if last is not None:
+        ranges.append((None, protocol.from_micros(last), end))
+    return ranges
+
+
+def rollup_rows(row, rollups):
+    """ ``ROLLUPS_SQL`` rows of a ``dbwriter.bar_row()`` """
+    micros = protocol.to_micros(row[0])
+    return [(resolution, protocol.from_micros(period_start(
+        micros, resolution_seconds(resolution)))) + tuple(row[1:])
+        for resolution in rollups]
+
+
+def merge_rollup(data):
+    """ merges duplicate periods of time-sorted archive columns """
+    times = data["datetime"]
+    first = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+    last = np.r_[first[1:], len(times)] - 1
+
+    merged = {name: values[last] for name, values in data.items()}
+    if "open" in data:
+        merged["open"] = data["open"][first]
+    if "high" in data:
+        merged["high"] = np.maximum.reduceat(data["high"], first)
+    if "low" in data:
+        merged["low"] = np.minimum.reduceat(data["low"], first)
+    if "volume" in data:
+        merged["volume"] = np.add.reduceat(data["volume"], first)
+    return merged
+
+
+def rollup_bars(data, resolution):
+    """Rolls up a symbol's (time-sorted) minute bars
+
+    :Parameters:
+        data : dict / pd.DataFrame
+            Bars with ``datetime`` (microseconds), ``open``, ``high``,
+            ``low``, ``close`` and ``volume`` columns
+        resolution : str
+            Rollup resolution
+
+    :Returns:
+        columns : dict
+            Column arrays (one row per period)
+    """
+    seconds = resolution_seconds(resolution)
+    columns = {name: np.asarray(data[name]) for name in (
+        "datetime", "open", "high", "low", "close", "volume")}
+    columns["datetime"] = period_start(
+        columns["datetime"].astype(np.int64), seconds)
+    return merge_rollup(columns)
@@ -77,6 +77,33 @@ CREATE TABLE IF NOT EXISTS `ticks` (
   CONSTRAINT `tick_symbol` FOREIGN KEY (`symbol_id`) REFERENCES `symbols` (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
+CREATE TABLE IF NOT EXISTS `rollups` (
+  `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
+  `resolution` varchar(4) NOT NULL,
+  `datetime` datetime NOT NULL,
+  `symbol_id` int(11) unsigned NOT NULL,
+  `open` double unsigned DEFAULT NULL,
+  `high` double unsigned DEFAULT NULL,
+  `low` double unsigned DEFAULT NULL,
+  `close` double unsigned DEFAULT NULL,
+  `volume` bigint(20) unsigned DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `key` (`resolution`,`symbol_id`,`datetime`),
+  KEY `resolution_datetime` (`resolution`,`datetime`),
+  CONSTRAINT `rollup_symbol` FOREIGN KEY (`symbol_id`) REFERENCES `symbols` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `coverage` (
+  `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
+  `symbol_id` int(11) unsigned NOT NULL,
+  `resolution` varchar(4) NOT NULL,
+  `start` datetime(3) NOT NULL,
+  `end` datetime(3) NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `symbol_resolution` (`symbol_id`,`resolution`),
+  CONSTRAINT `coverage_symbol` FOREIGN KEY (`symbol_id`) REFERENCES `symbols` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
 CREATE TABLE IF NOT EXISTS `greeks` (
   `id` int(11) unsigned NOT NULL AUTO_INCREMENT,
   `tick_id` int(11) unsigned DEFAULT NULL,
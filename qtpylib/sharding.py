@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Sharded Blotters (``--shards N``): each shard process (``--shard 0``
+... ``--shard N-1``) streams a hash-partition of ``symbols.csv`` using
+its own IB client id and database writer, and publishes to a proxy
+process (started without ``--shard``), which republishes every shard
+on the Blotter's ``zmqport``. Algos keep connecting to that one port,
+and their subscriptions are forwarded to the shards, so messages are
+still filtered before leaving the shard.
+"""
+
+import sys
+import zlib
+
+from threading import Thread
+
+import zmq
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+
+# ---------------------------------------------
+def shard_of(contract, shards):
+    """ shard streaming a contract (by its symbol, same in every run) """
+    symbol = contract[0] if isinstance(contract, (tuple, list)) else contract
+    return zlib.crc32(str(symbol).upper().encode("utf-8")) % int(shards)
+
+
+def backend_port(zmqport, zmqbackend=None):
+    """ port shards publish to (default: the Blotter's ``zmqport`` + 1) """
+    return int(zmqbackend) if zmqbackend else int(zmqport) + 1
+
+
+# ---------------------------------------------
+class ShardProxy():
+    """Republishes the shards' messages on a single port
+
+    :Parameters:
+        frontend : int
+            Port algos subscribe to (the Blotter's ``zmqport``)
+        backend : int
+            Port shards publish to
+
+    :Optional:
+        host : str
+            Interface to bind to (default: all)
+    """
+
+    def __init__(self, frontend, backend, host="*", context=None):
+        self.frontend = int(frontend)
+        self.backend = int(backend)
+        self.host = host
+        self.context = context or zmq.Context.instance()
+        self._control = "inproc://qtpylib-proxy-%d" % id(self)
+        self._thread = None
+
+    # ---------------------------------------------
+    def run(self):
+        """ forwards messages (and subscriptions) until stopped """
+        xpub = self.context.socket(zmq.XPUB)
+        xsub = self.context.socket(zmq.XSUB)
+        control = self.context.socket(zmq.PAIR)
+        sockets = (xpub, xsub, control)
+
+        try:
+            xpub.bind("tcp://%s:%d" % (self.host, self.frontend))
+            xsub.bind("tcp://%s:%d" % (self.host, self.backend))
+            control.bind(self._control)
+            zmq.proxy_steerable(xsub, xpub, None, control)
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            for sock in sockets:
+                sock.close(linger=0)
+
+    def start(self):
+        """ runs the proxy in a background thread """
+        self._thread = Thread(target=self.run, name="shard-proxy",
+                              daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        control = self.context.socket(zmq.PAIR)
+        try:
+            control.connect(self._control)
+            control.send(b"TERMINATE")
+        finally:
+            control.close(linger=100)
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Shared-memory market data bus for algos running on the Blotter's host
+(enabled using the Blotter's ``--shm`` flag).
+
+The Blotter writes every TICK, BAR and QUOTE into a memory-mapped ring
+buffer per symbol (one writer, any number of readers, no locks).
+Each slot holds a fixed-width record framed by its sequence number::
+
+    seq | time (us) | kind | 16 x float64 | seq
+
+The writer zeroes the leading ``seq`` before updating a slot, so readers
+can tell a complete record (both sequence numbers match the one they
+expect) from one being overwritten, and use the sequence numbers to
+detect records they've missed. ORDERBOOK messages (variable length) and
+remote clients keep using ZeroMQ.
+"""
+
+import logging
+import mmap
+import os
+import sys
+import tempfile
+
+from struct import Struct
+from threading import Lock
+from time import time
+
+from qtpylib import protocol
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+KINDS = ("TICK", "BAR", "QUOTE")
+MAGIC = b"QTPYSHM1"
+
+# prefer ram-backed storage
+ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# magic, slot size, capacity, symbol, symbol_group, asset_class
+_HEADER = Struct('<8sIQ64s64s64s')
+_SEQ = Struct('<Q')
+_HEAD_OFFSET = _HEADER.size
+_SLOTS_OFFSET = _HEAD_OFFSET + 64  # head on its own cache line
+
+_FIELDS = 16
+_BODY = Struct('<qQ%dd' % _FIELDS)
+_SLOT_SIZE = _SEQ.size + _BODY.size + _SEQ.size
+
+# options' ticks/quotes carry fields the fixed records can't hold (their
+# contract details), so they're only published via zeromq
+ZMQ_ASSET_CLASSES = ("OPT", "FOP")
+
+_KIND_CODES = {kind: ix for ix, kind in enumerate(KINDS)}
+
+# fields a record can hold per kind
+_KEYS = {kind: frozenset(protocol.SCHEMAS[kind][0]) | protocol.META_FIELDS
+         for kind in KINDS}
+_NAN = float("nan")
+
+# fields restored as integers when reading
+_INT_FIELDS = {
+    "TICK": ('bidsize', 'asksize', 'lastsize'),
+    "BAR": ('volume',),
+    "QUOTE": (),
+}
+
+
+# ---------------------------------------------
+def bus_dir(name):
+    """ directory holding the ring buffers of a Blotter """
+    return os.path.join(ROOT, "qtpylib_%s" % str(name).lower())
+
+
+def ring_path(name, symbol):
+    return os.path.join(bus_dir(name), symbol.replace(os.sep, "-") + ".ring")
+
+
+def _text(value):
+    return str(value or "").encode("utf-8")[:64]
+
+
+# ---------------------------------------------
+class ShmRing():
+    """Memory-mapped ring buffer of one symbol's records
+
+    Use ``ShmRing.create()`` in the (single) writing process and
+    ``ShmRing.open()`` in readers.
+    """
+
+    def __init__(self, path, mm, capacity, writable=False):
+        self.path = path
+        self.mm = mm
+        self.capacity = capacity
+        self.writable = writable
+
+        (_, _, _, symbol, symbol_group,
+         asset_class) = _HEADER.unpack_from(mm, 0)
+        self.symbol = symbol.rstrip(b"\0").decode("utf-8")
+        self.symbol_group = symbol_group.rstrip(b"\0").decode("utf-8")
+        self.asset_class = asset_class.rstrip(b"\0").decode("utf-8")
+
+        try:
+            self.inode = os.stat(path).st_ino
+        except OSError:
+            self.inode = None
+
+    # -------------------------------------------
+    @classmethod
+    def create(cls, path, symbol, symbol_group="", asset_class="",
+               capacity=16384):
+        size = _SLOTS_OFFSET + capacity * _SLOT_SIZE
+
+        # write to a temp file and rename, so readers never
+        # see a half-initialized ring
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w+b") as f:
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+
+        _HEADER.pack_into(mm, 0, MAGIC, _SLOT_SIZE, capacity,
+                          _text(symbol), _text(symbol_group),
+                          _text(asset_class))
+        _SEQ.pack_into(mm, _HEAD_OFFSET, 0)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+        return cls(path, mm, capacity, writable=True)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, slot_size, capacity = _HEADER.unpack_from(mm, 0)[:3]
+        if magic != MAGIC or slot_size != _SLOT_SIZE:
+            mm.close()
+            raise ValueError("Incompatible ring buffer: %s" % path)
+
+        return cls(path, mm, capacity)
+
+    def close(self):
+        try:
+            self.mm.close()
+        except Exception as e:
+            pass
+
+    # -------------------------------------------
+    @property
+    def head(self):
+        """ sequence number of the last written record """
+        return _SEQ.unpack_from(self.mm, _HEAD_OFFSET)[0]
+
+    def _offset(self, seq):
+        return _SLOTS_OFFSET + (seq % self.capacity) * _SLOT_SIZE
+
+    # -------------------------------------------
+    def append(self, micros, kind_code, values):
+        seq = self.head + 1
+        offset = self._offset(seq)
+
+        # invalidate, write, then publish the slot and head
+        _SEQ.pack_into(self.mm, offset, 0)
+        _BODY.pack_into(self.mm, offset + _SEQ.size,
+                        micros, kind_code, *values)
+        _SEQ.pack_into(self.mm, offset + _SEQ.size + _BODY.size, seq)
+        _SEQ.pack_into(self.mm, offset, seq)
+        _SEQ.pack_into(self.mm, _HEAD_OFFSET, seq)
+        return seq
+
+    def read(self, seq):
+        """ record at ``seq`` or ``None`` if it was overwritten """
+        offset = self._offset(seq)
+        if _SEQ.unpack_from(self.mm, offset)[0] != seq:
+            return None
+        body = _BODY.unpack_from(self.mm, offset + _SEQ.size)
+        if _SEQ.unpack_from(self.mm, offset)[0] != seq or _SEQ.unpack_from(
+                self.mm, offset + _SEQ.size + _BODY.size)[0] != seq:
+            return None
+        return body
+
+    def is_stale(self):
+        """ was the ring replaced (eg. by a restarted Blotter)? """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+
+# ---------------------------------------------
+class ShmPublisher():
+    """Writes Blotter messages to per-symbol ring buffers
+
+    :Parameters:
+        name : str
+            Blotter name
+
+    :Optional:
+        capacity : int
+            Records per symbol ring (default: 16384)
+    """
+
+    def __init__(self, name, capacity=16384):
+        self.name = name
+        self.path = bus_dir(name)
+        self.capacity = int(capacity)
+        self.rings = {}
+        self._lock = Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        os.chmod(self.path, 0o755)
+
+    # -------------------------------------------
+    def publish(self, data, kind):
+        """ write a TICK/BAR/QUOTE message (others, and messages with
+        fields the records can't hold, are ignored) """
+        if kind not in _KIND_CODES or not data.keys() <= _KEYS[kind]:
+            return None
+
+        names = protocol.SCHEMAS[kind][0]
+        values = [data.get(name) for name in names]
+        values = [_NAN if value is None else float(value)
+                  for value in values]
+        values += [_NAN] * (_FIELDS - len(values))
+
+        micros = protocol.to_micros(data.get("timestamp"))
+        symbol = data["symbol"]
+
+        # rings have a single writer (handlers may run on several threads)
+        with self._lock:
+            ring = self.rings.get(symbol)
+            if ring is None:
+                ring = ShmRing.create(ring_path(self.name, symbol), symbol,
+                                      data.get("symbol_group"),
+                                      data.get("asset_class"), self.capacity)
+                self.rings[symbol] = ring
+
+            return ring.append(micros, _KIND_CODES[kind], values)
+
+    # -------------------------------------------
+    def close(self, unlink=True):
+        with self._lock:
+            self._close(unlink)
+
+    def _close(self, unlink):
+        for ring in self.rings.values():
+            ring.close()
+            if unlink:
+                try:
+                    os.remove(ring.path)
+                except OSError:
+                    pass
+        self.rings = {}
+
+        if unlink:
+            try:
+                os.rmdir(self.path)
+            except OSError:
+                pass
+
+
+# ---------------------------------------------
+class ShmSubscriber():
+    """Reads Blotter messages from per-symbol ring buffers
+
+    Starts at the newest record, so only data written after
+    subscribing is returned. Rings that don't exist yet (no data for
+    a symbol so far) or that were recreated by a restarted Blotter are
+    (re)opened automatically and read from their first record.
+
+    :Parameters:
+        name : str
+            Blotter name
+        symbols : list
+            Symbols to read
+
+    :Optional:
+        kinds : list
+            Message kinds to return (default: TICK, BAR and QUOTE)
+        logger : object
+            Logger to use (default: this module's)
+    """
+
+    def __init__(self, name, symbols, kinds=KINDS, logger=None):
+        self.name = name
+        self.symbols = list(symbols)
+        self.kinds = set(_KIND_CODES[kind] for kind in kinds
+                         if kind in _KIND_CODES)
+        self.log = logger if logger is not None else logging.getLogger(
+            __name__)
+
+        self.rings = {}
+        self.cursors = {}
+        self.missed = 0
+
+        # rings that already exist are read from their newest record
+        self._subscribed = False
+        self._refresh()
+        self._subscribed = True
+        self._next_check = time() + 1
+
+    # -------------------------------------------
+    @staticmethod
+    def available(name):
+        """ is a local Blotter publishing to shared memory? """
+        return os.path.isdir(bus_dir(name))
+
+    # -------------------------------------------
+    def _refresh(self):
+        for symbol in self.symbols:
+            ring = self.rings.get(symbol)
+            if ring is not None and not ring.is_stale():
+                continue
+
+            path = ring_path(self.name, symbol)
+            if not os.path.exists(path):
+                continue
+
+            try:
+                new_ring = ShmRing.open(path)
+            except (OSError, ValueError) as e:
+                continue
+
+            if ring is not None:
+                ring.close()
+
+            if self._subscribed:
+                # new ring - read it from the start
+                self.cursors[symbol] = max(0, new_ring.head -
+                                           new_ring.capacity)
+            else:
+                self.cursors[symbol] = new_ring.head
+            self.rings[symbol] = new_ring
+
+    # -------------------------------------------
+    def poll(self, max_records=1000):
+        """ returns new messages (dicts, like ``protocol.decode()``) """
+        if time() >= self._next_check:
+            self._refresh()
+            self._next_check = time() + 1
+
+        messages = []
+        for symbol, ring in self.rings.items():
+            cursor = self.cursors[symbol]
+            head = ring.head
+            if head <= cursor:
+                continue
+
+            # fell behind by more than a full ring
+            first = max(cursor + 1, head - ring.capacity + 1)
+            if first > cursor + 1:
+                self._missed(symbol, first - cursor - 1)
+
+            last = min(head, first + max_records - 1)
+            for seq in range(first, last + 1):
+                record = ring.read(seq)
+                if record is None:
+                    self._missed(symbol, 1)
+                    continue
+                if record[1] in self.kinds:
+                    messages.append(self._to_dict(ring, record))
+
+            self.cursors[symbol] = last
+
+        return messages
+
+    def _missed(self, symbol, count):
+        self.missed += count
+        self.log.warning("Missed %d shared memory records for %s",
+                         count, symbol)
+
+    # -------------------------------------------
+    @staticmethod
+    def _to_dict(ring, record):
+        kind = KINDS[record[1]]
+        names = protocol.SCHEMAS[kind][0]
+        ints = _INT_FIELDS[kind]
+
+        data = dict(zip(names, record[2:2 + len(names)]))
+        for name in ints:
+            if data[name] == data[name]:  # not NaN
+                data[name] = int(data[name])
+
+        timestamp = protocol.from_micros(record[0])
+        if timestamp is not None:
+            data["timestamp"] = timestamp
+        data["symbol"] = ring.symbol
+        data["symbol_group"] = ring.symbol_group
+        data["asset_class"] = ring.asset_class
+        data["kind"] = kind
+        return data
+
+    # -------------------------------------------
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
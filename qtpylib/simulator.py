@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Simulated order execution for backtests (used by ``Broker`` in
+``--backtest`` mode, in place of IB).
+
+Orders are matched against the ticks/bars of their symbol as they're
+replayed, starting with the first tick/bar *after* they were submitted
+(and after ``latency`` seconds). Fills are reported as ezIBpy-style
+order dicts, so they go through the same trade registration and
+``on_fill()`` as live fills.
+
+Bars are assumed to trade from open to close: market orders fill at
+the open, limit orders at the open or their limit price, stops at the
+open (gaps) or their stop price. When a bracket's target and stop are
+both hit within the same bar, the stop is assumed to be hit first.
+Orders are always filled in full.
+"""
+
+import sys
+
+from datetime import timedelta
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+OPEN = "OPENED"
+HELD = "HELD"  # bracket children, waiting for the entry to fill
+FILLED = "FILLED"
+CANCELLED = "CANCELLED"
+
+
+# ---------------------------------------------
+class Simulator():
+    """Backtest matching engine
+
+    :Optional:
+        on_fill : func
+            Called with each fill (an ezIBpy-style order dict)
+        on_cancel : func
+            Called with each expired/cancelled order
+        slippage : float
+            Price slippage of market and stop fills (default: 0)
+        slippage_type : str
+            Type of slippage: ``amount`` (default) or ``percent``
+        commission : float
+            Commission per share/contract (default: 0)
+        min_commission : float
+            Minimum commission per order (default: 0)
+        latency : float
+            Seconds before a submitted order can be filled (default: 0)
+    """
+
+    def __init__(self, on_fill=None, on_cancel=None, slippage=0,
+                 slippage_type="amount", commission=0, min_commission=0,
+                 latency=0):
+
+        self.on_fill = on_fill
+        self.on_cancel = on_cancel
+        self.slippage = float(slippage or 0)
+        self.slippage_type = "percent" if slippage_type == "percent" \
+            else "amount"
+        self.commission = float(commission or 0)
+        self.min_commission = float(min_commission or 0)
+        self.latency = timedelta(seconds=float(latency or 0))
+
+        self.time = None
+        self._event = 0
+        self._next_id = 1
+
+        self._orders = {}  # symbol => live orders, in submission order
+        self._by_id = {}
+        self._positions = {}  # symbol => [position, avg. cost, pnl]
+
+        # metrics
+        self.fills = 0
+        self.commissions = 0.
+
+    # ---------------------------------------------
+    def _new_order(self, symbol, quantity, order_type, price=0, stop=0,
+                   parentId=0, status=OPEN, expiry=0):
+        order = {
+            "id": self._next_id,
+            "parentId": parentId,
+            "symbol": symbol,
+            "quantity": quantity,
+            "type": order_type,
+            "price": price,
+            "stop": stop,
+            "status": status,
+            "event": self._event,
+            "active": self.time + self.latency if self.time else None,
+            "expiry": expiry,
+            "expires": None,
+            "children": [],
+            "trail_at": 0,
+            "trail_by": 0,
+            "trail_type": "percent",
+            "trailing": False,
+        }
+        self._next_id += 1
+        self._by_id[order["id"]] = order
+        self._orders.setdefault(symbol, []).append(order)
+        return order
+
+    def submit(self, symbol, quantity, limit_price=0, target=0,
+               initial_stop=0, trail_stop_at=0, trail_stop_by=0,
+               trail_stop_type="percent", stop_limit=False, expiry=0):
+        """Submits an order (same options as ``Broker._create_order``)
+
+        :Parameters:
+            symbol : str
+                Instrument's symbol
+            quantity : int
+                Order quantity (negative for SELL orders)
+
+        :Optional:
+            limit_price : float
+                Limit price (default: 0 = market order)
+            target / initial_stop : float
+                Bracket's target/stop prices
+            trail_stop_at : float
+                Price at which to start trailing the stop
+            trail_stop_by : float
+                Trailing stop's distance from the price
+            trail_stop_type : str
+                ``percent`` (default) or ``amount``
+            stop_limit : bool
+                Place a STOP LIMIT order at ``limit_price`` instead
+                of a bracket order (same as live orders)
+            expiry : float
+                Cancel the (entry) order if not filled *n* seconds
+                after the first bar/tick it could fill on (default:
+                0 = never). Market orders don't expire
+
+        :Returns:
+            ids : dict
+                ``entryOrderId``, ``targetOrderId`` and ``stopOrderId``
+                (0 when not part of the order)
+        """
+        trailing = trail_stop_at != 0 and trail_stop_by != 0
+        bracket = target > 0 or initial_stop > 0 or \
+            trail_stop_at > 0 or trail_stop_by > 0
+
+        # stop limit
+        if bracket and stop_limit:
+            entry = self._new_order(symbol, quantity, "STOP_LIMIT",
+                                    price=limit_price, stop=limit_price,
+                                    expiry=expiry)
+            bracket = False
+        else:
+            entry = self._new_order(
+                symbol, quantity, "LIMIT" if limit_price else "MARKET",
+                price=limit_price, expiry=expiry if limit_price else 0)
+
+        ids = {"entryOrderId": entry["id"], "targetOrderId": 0,
+               "stopOrderId": 0}
+        if not bracket:
+            return ids
+
+        # children (stop first: assumed to be hit
+        # first when both are hit by the same bar)
+        if initial_stop > 0 or trailing:
+            stop = self._new_order(symbol, -quantity, "STOP",
+                                   stop=initial_stop, parentId=entry["id"],
+                                   status=HELD)
+            if trailing:
+                stop["trail_at"] = trail_stop_at
+                stop["trail_by"] = trail_stop_by
+                stop["trail_type"] = "amount" \
+                    if trail_stop_type == "amount" else "percent"
+            entry["children"].append(stop["id"])
+            ids["stopOrderId"] = stop["id"]
+
+        if target > 0:
+            target = self._new_order(symbol, -quantity, "LIMIT",
+                                     price=target, parentId=entry["id"],
+                                     status=HELD)
+            entry["children"].append(target["id"])
+            ids["targetOrderId"] = target["id"]
+
+        return ids
+
+    def cancel(self, orderId):
+        """ cancels an unfilled order (and its bracket orders) """
+        order = self._by_id.get(orderId)
+        if order is None or order["status"] not in (OPEN, HELD):
+            return False
+
+        for childId in order["children"]:
+            self.cancel(childId)
+        self._close(order, CANCELLED)
+        return True
+
+    def modify(self, orderId, quantity=None, limit_price=None):
+        """ changes an unfilled order's quantity and/or limit/stop price """
+        order = self._by_id.get(orderId)
+        if order is None or order["status"] not in (OPEN, HELD):
+            return False
+
+        if quantity:
+            order["quantity"] = abs(quantity) if order["quantity"] > 0 \
+                else -abs(quantity)
+        if limit_price:
+            if order["type"] == "STOP":
+                order["stop"] = limit_price
+            else:
+                order["price"] = limit_price
+        return True
+
+    # ---------------------------------------------
+    def position(self, symbol):
+        """ ``(position, avg. cost)`` of a symbol """
+        position = self._positions.get(symbol)
+        return (0, 0.) if position is None else (position[0], position[1])
+
+    def orders(self, symbol=None):
+        """ unfilled orders (of a symbol) """
+        if symbol is not None:
+            return list(self._orders.get(symbol, []))
+        return [order for orders in self._orders.values()
+                for order in orders]
+
+    def stats(self):
+        return {
+            "fills": self.fills,
+            "commissions": self.commissions,
+            "realized_pnl": sum(position[2] for position
+                                in self._positions.values()),
+            "open_orders": len(self.orders()),
+        }
+
+    # ---------------------------------------------
+    def on_bar(self, symbol, time, open, high, low, close):
+        """Matches a symbol's orders against a bar
+
+        :Returns:
+            fills : list
+                Fills (also passed to ``on_fill``)
+        """
+        return self._match(symbol, time, open, high, low)
+
+    def on_tick(self, symbol, time, last, bid=None, ask=None):
+        """Matches a symbol's orders against a tick
+
+        Market orders are filled at the ask (buy) / bid (sell)
+        when available, else at the last price.
+
+        :Returns:
+            fills : list
+                Fills (also passed to ``on_fill``)
+        """
+        return self._match(symbol, time, last, last, last, bid, ask)
+
+    # ---------------------------------------------
+    def _slip(self, price, side):
+        if not self.slippage:
+            return price
+        slippage = self.slippage if self.slippage_type == "amount" \
+            else price * self.slippage / 100
+        # (rounded, so 10.8 + .05 fills at 10.85)
+        return round(price + slippage * side, 10)
+
+    def _match(self, symbol, time, open, high, low, bid=None, ask=None):
+        self._event += 1
+        self.time = time
+
+        orders = self._orders.get(symbol)
+        if not orders:
+            return []
+
+        fills = []
+        for order in list(orders):
+            if order["status"] != OPEN:
+                continue
+
+            # submitted while handling this event (or just now)
+            if order["event"] >= self._event or (
+                    order["active"] is not None and order["active"] > time):
+                continue
+
+            # (expiry starts with the first event it can fill on)
+            if order["expiry"] and order["expires"] is None:
+                order["expires"] = time + timedelta(seconds=order["expiry"])
+            elif order["expires"] is not None and time > order["expires"]:
+                self.cancel(order["id"])
+                continue
+
+            price = self._fill_price(order, open, high, low, bid, ask)
+            if price is not None:
+                fills.append(self._fill(order, price, time))
+
+        for fill in fills:
+            if self.on_fill is not None:
+                self.on_fill(fill)
+        return fills
+
+    def _fill_price(self, order, open, high, low, bid, ask):
+        side = 1 if order["quantity"] > 0 else -1
+        order_type = order["type"]
+
+        if order_type == "MARKET":
+            price = ask if side > 0 else bid
+            return self._slip(price if price else open, side)
+
+        if order_type == "LIMIT":
+            limit = order["price"]
+            if side > 0:
+                return open if open <= limit else limit if low <= limit \
+                    else None
+            return open if open >= limit else limit if high >= limit \
+                else None
+
+        if order_type == "STOP_LIMIT":
+            stop = order["stop"]
+            if side > 0:
+                triggered = high >= stop
+                price = stop if triggered and low <= stop else None
+            else:
+                triggered = low <= stop
+                price = stop if triggered and high >= stop else None
+            if triggered and price is None:
+                # gapped through: now a limit order
+                order["type"] = "LIMIT"
+            return price
+
+        # stop (hard or trailing)
+        stop = order["stop"]
+        price = None
+        if stop > 0:
+            if side > 0:
+                price = open if open >= stop else stop if high >= stop \
+                    else None
+            else:
+                price = open if open <= stop else stop if low <= stop \
+                    else None
+
+        if price is None and order["trail_by"]:
+            self._trail(order, side, high, low)
+        return None if price is None else self._slip(price, side)
+
+    @staticmethod
+    def _trail(order, side, high, low):
+        """ moves a trailing stop (once its trigger price is reached) """
+        # sell stops protect longs, buy stops protect shorts
+        best = high if side < 0 else low
+        if not order["trailing"]:
+            order["trailing"] = best >= order["trail_at"] if side < 0 \
+                else best <= order["trail_at"]
+            if not order["trailing"]:
+                return
+
+        offset = order["trail_by"] if order["trail_type"] == "amount" \
+            else best * order["trail_by"] / 100
+        if side < 0:
+            order["stop"] = max(order["stop"], best - offset)
+        else:
+            order["stop"] = best + offset if order["stop"] <= 0 \
+                else min(order["stop"], best + offset)
+
+    def _fill(self, order, price, time):
+        symbol = order["symbol"]
+        quantity = order["quantity"]
+
+        # commission
+        commission = 0.
+        if self.commission or self.min_commission:
+            commission = max(abs(quantity) * self.commission,
+                             self.min_commission)
+        self.commissions += commission
+        self.fills += 1
+
+        # position / avg. cost / realized pnl
+        position = self._positions.setdefault(symbol, [0, 0., 0.])
+        current, cost = position[0], position[1]
+        if current == 0 or (current > 0) == (quantity > 0):
+            cost = (current * cost + quantity * price) / (current + quantity)
+        else:
+            closed = min(abs(current), abs(quantity))
+            position[2] += (price - cost) * closed * (1 if current > 0
+                                                      else -1)
+            if abs(quantity) > abs(current):
+                cost = price  # reversed
+        current += quantity
+        position[0] = current
+        position[1] = cost if current != 0 else 0.
+        position[2] -= commission
+
+        self._close(order, FILLED)
+
+        # bracket: activate children / cancel the other child
+        for childId in order["children"]:
+            child = self._by_id[childId]
+            child["status"] = OPEN
+            child["event"] = self._event
+            child["active"] = time
+        if order["parentId"]:
+            parent = self._by_id.get(order["parentId"])
+            if parent is not None:
+                for childId in parent["children"]:
+                    self.cancel(childId)
+
+        return {
+            "id": order["id"],
+            "parentId": order["parentId"],
+            "symbol": symbol,
+            "quantity": abs(quantity),
+            "action": "BUY" if quantity > 0 else "SELL",
+            "order_type": order["type"],
+            "status": FILLED,
+            "reason": None,
+            "avgFillPrice": price,
+            "commission": commission,
+            "time": time,
+            "account": "Backtest",
+        }
+
+    def _close(self, order, status):
+        cancelled = order["status"] in (OPEN, HELD) and status == CANCELLED
+        order["status"] = status
+        orders = self._orders.get(order["symbol"], [])
+        if order in orders:
+            orders.remove(order)
+        if cancelled and self.on_cancel is not None:
+            self.on_cancel(order)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Runtime telemetry (used by the Blotter): counters, latency histograms,
+messages/sec per kind and symbol, and gauges (eg. queue depths),
+served as JSON on a local HTTP port (``--telemetryport``) and/or
+logged periodically (``--telemetrylog``)::
+
+    $ curl http://127.0.0.1:5005/
+"""
+
+import json
+import logging
+import sys
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread, Lock, Event
+from time import time
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+# histogram bucket upper bounds (seconds)
+BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+           .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., float("inf"))
+
+
+# ---------------------------------------------
+class Histogram():
+    """ latency histogram (fixed, log-scale buckets) """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """ upper bound of the bucket holding the ``q`` percentile """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(.5),
+            "p90": self.percentile(.9),
+            "p99": self.percentile(.99),
+            "max": self.max,
+            "buckets": {str(bound): count for bound, count in zip(
+                BUCKETS, self.counts) if count},
+        }
+
+
+# ---------------------------------------------
+class Telemetry():
+    """Collects runtime metrics
+
+    :Optional:
+        rate_window : float
+            Min seconds covered by messages/sec rates (default: 10)
+    """
+
+    def __init__(self, rate_window=10):
+        self.rate_window = float(rate_window)
+        self.started = time()
+
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._kinds = {}
+        self._symbols = {}
+        self._gauges = {}
+
+        # (time, kind totals, symbol totals) rate baselines
+        self._baseline = self._previous = (self.started, {}, {})
+
+        self._server = None
+        self._stop = Event()
+
+    # -------------------------------------------
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """ adds a latency sample (in seconds) """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def message(self, kind, symbol=None):
+        """ counts a published message """
+        with self._lock:
+            self._kinds[kind] = self._kinds.get(kind, 0) + 1
+            if symbol is not None:
+                self._symbols[symbol] = self._symbols.get(symbol, 0) + 1
+
+    def gauge(self, name, func):
+        """ registers ``func()``, returning the gauge's current value(s) """
+        self._gauges[name] = func
+
+    # -------------------------------------------
+    def _rates(self, now, kinds, symbols):
+        # move the baseline forward every rate_window seconds,
+        # so rates always cover rate_window - 2 x rate_window seconds
+        if now - self._baseline[0] >= self.rate_window:
+            self._previous = self._baseline
+            self._baseline = (now, kinds, symbols)
+
+        since, prev_kinds, prev_symbols = self._previous
+        elapsed = max(now - since, 1e-9)
+        return (
+            {key: {"total": total, "per_sec": round(
+                (total - prev_kinds.get(key, 0)) / elapsed, 3)}
+             for key, total in kinds.items()},
+            {key: {"total": total, "per_sec": round(
+                (total - prev_symbols.get(key, 0)) / elapsed, 3)}
+             for key, total in symbols.items()},
+        )
+
+    def snapshot(self):
+        """ all metrics as a (json serializable) dict """
+        now = time()
+        with self._lock:
+            counters = dict(self._counters)
+            latency = {name: histogram.to_dict()
+                       for name, histogram in self._histograms.items()}
+            kinds = dict(self._kinds)
+            symbols = dict(self._symbols)
+            kinds, symbols = self._rates(now, kinds, symbols)
+
+        gauges = {}
+        for name, func in list(self._gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                gauges[name] = None
+
+        return {
+            "uptime": round(now - self.started, 3),
+            "counters": counters,
+            "latency": latency,
+            "messages": kinds,
+            "symbols": symbols,
+            "gauges": gauges,
+        }
+
+    # -------------------------------------------
+    def serve(self, port, host="127.0.0.1"):
+        """ serves ``snapshot()`` as JSON over HTTP (in a thread) """
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(telemetry.snapshot(), default=str,
+                                  indent=1).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server((host, int(port)), Handler)
+        Thread(target=self._server.serve_forever, daemon=True,
+               name="qtpylib-telemetry").start()
+        return self._server.server_address
+
+    def log_every(self, interval, logger=None):
+        """ logs a summary every ``interval`` seconds (in a thread) """
+        logger = logger if logger is not None else logging.getLogger(
+            __name__)
+
+        def run():
+            while not self._stop.wait(float(interval)):
+                logger.info("Telemetry: %s", json.dumps(
+                    self.summary(), default=str))
+
+        Thread(target=run, daemon=True, name="qtpylib-telemetry-log").start()
+
+    def summary(self):
+        """ snapshot without per-symbol rates and histogram buckets """
+        snapshot = self.snapshot()
+        del snapshot["symbols"]
+        for histogram in snapshot["latency"].values():
+            del histogram["buckets"]
+        return snapshot
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
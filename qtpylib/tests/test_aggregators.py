@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pandas as pd
+
+from nose.tools import eq_
+from qtpylib.aggregators import BarBuilder, BarResampler
+
+
+def test_bar_builder_rolls_minutes():
+    """Test that bars are emitted once the minute rolls"""
+    builder = BarBuilder()
+    ticks = [
+        (datetime(2019, 1, 1, 10, 0, 5), 10., 1),
+        (datetime(2019, 1, 1, 10, 0, 20), 11., 2),
+        (datetime(2019, 1, 1, 10, 0, 40), 9., 3),
+        (datetime(2019, 1, 1, 10, 0, 50), 10.5, 4),
+        (datetime(2019, 1, 1, 10, 1, 10), 12., 5),
+        (datetime(2019, 1, 1, 10, 1, 30), 12.5, 6),
+        (datetime(2019, 1, 1, 10, 3, 0), 13., 7),
+    ]
+    bars = [bar for bar in (builder.update(*tick) for tick in ticks) if bar]
+
+    eq_(bars, [
+        # first tick of the symbol
+        (datetime(2019, 1, 1, 10, 0), 10., 10., 10., 10., 1),
+        # built from the ticks following the opening tick
+        (datetime(2019, 1, 1, 10, 0), 11., 11., 9., 10.5, 9),
+        (datetime(2019, 1, 1, 10, 1), 12.5, 12.5, 12.5, 12.5, 6),
+    ])
+    eq_(builder.as_tuple(), (datetime(2019, 1, 1, 10, 3), 13., 13., 13., 13., 7))
+
+
+def _minute(time, close, volume=1):
+    return pd.Timestamp("2019-01-02 " + time, tz="US/Eastern"), {
+        "symbol": "ES", "symbol_group": "ES", "asset_class": "FUT",
+        "open": close - .5, "high": close + 1, "low": close - 1,
+        "close": close, "volume": volume}
+
+
+def test_bar_resampler_folds_bars():
+    """Test that minute bars are folded into the open 5-minute bar"""
+    resampler = BarResampler("5T")
+    out = []
+    for time, close in [("09:58", 9.), ("10:01", 10.), ("10:02", 12.),
+                        ("10:04", 11.), ("10:05", 13.)]:
+        out.append(resampler.update(*_minute(time, close, volume=2)))
+
+    # every update returns the open bar
+    eq_([[str(time.time()) for time, bar in bars] for bars in out],
+        [["09:55:00"], ["10:00:00"], ["10:00:00"], ["10:00:00"],
+         ["10:05:00"]])
+    eq_(out[3][0][1]["open"], 9.5)
+    eq_(out[3][0][1]["high"], 13.)
+    eq_(out[3][0][1]["low"], 9.)
+    eq_(out[3][0][1]["close"], 11.)
+    eq_(out[3][0][1]["volume"], 6)
+
+    # already resampled
+    eq_(resampler.update(*_minute("10:05", 99.)), out[4])
+
+
+def test_bar_resampler_fills_empty_periods():
+    """Test that periods without bars are filled with the last close"""
+    resampler = BarResampler("5T")
+    resampler.seed(*_minute("10:00", 10.))
+
+    bars = resampler.update(*_minute("10:16", 12.))
+    eq_([str(time.time()) for time, bar in bars],
+        ["10:05:00", "10:10:00", "10:15:00"])
+    eq_(bars[0][1]["open"], 10.)
+    eq_(bars[0][1]["high"], 10.)
+    eq_(bars[0][1]["volume"], 0)
+    eq_(bars[-1][1]["high"], 13.)
+
+    # days are aligned to local midnight
+    resampler = BarResampler("1D")
+    eq_(str(resampler.update(*_minute("10:00", 1.))[0][0]),
+        "2019-01-02 00:00:00-05:00")
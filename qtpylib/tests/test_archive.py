@@ -0,0 +1,65 @@
+import tempfile
+
+from nose.tools import eq_
+from qtpylib.archive import Archive, ArchiveWriter
+
+
+def _bar(timestamp, close, volume, symbol="AAPL_STK"):
+    return {"symbol": symbol, "symbol_group": symbol.split("_")[0],
+            "asset_class": "STK", "timestamp": timestamp, "open": close,
+            "high": close, "low": close, "close": close, "volume": volume}
+
+
+def test_archive_roundtrip():
+    """Test that archived bars are read back by symbol and time range"""
+    archive = Archive(tempfile.mkdtemp())
+    writer = ArchiveWriter(archive, flush_interval=60).start()
+
+    writer.write(_bar("2019-01-01 23:59:00", 10, 1), "BAR")
+    writer.write(_bar("2019-01-02 00:00:00", 11, 2), "BAR")
+    writer.write(_bar("2019-01-02 00:01:00", 12, 3), "BAR")
+    # updated bar (replaced, like the db's upsert)
+    writer.write(_bar("2019-01-02 00:01:00", 13, 4), "BAR")
+    writer.write(_bar("2019-01-02 00:01:00", 99, 5, "MSFT_STK"), "BAR")
+    writer.stop()
+
+    eq_(sorted(archive.manifest()["partitions"]["bars"]["AAPL_STK"]),
+        ["2019-01-01", "2019-01-02"])
+
+    data = archive.read(["AAPL_STK"], "2019-01-02", table="bars",
+                        columns=["close", "volume"])
+    eq_(list(data.columns), ["datetime", "close", "volume", "symbol",
+                             "symbol_group", "asset_class", "expiry"])
+    eq_(data["close"].tolist(), [11, 13])
+    eq_(data["volume"].tolist(), [2, 4])
+    eq_(str(data["datetime"].iloc[-1]), "2019-01-02 00:01:00")
+
+    data = archive.read("*", "2019-01-01", "2019-01-01 23:59:59")
+    eq_(data["close"].tolist(), [10])
+    eq_(len(archive.read(["ZZZ_STK"], "2019-01-01")), 0)
+
+    chunks = list(archive.iter_read(["AAPL_STK"], "2019-01-01"))
+    eq_([chunk["close"].tolist() for chunk in chunks], [[10], [11, 13]])
+
+
+def test_archive_writer_counts_and_compacts_segments():
+    """Test that rows count as written once on disk, and that sealed
+    partitions are compacted at the day roll"""
+    archive = Archive(tempfile.mkdtemp())
+    writer = ArchiveWriter(archive)
+
+    for minute in range(3):
+        writer.flush([(_bar("2019-01-02 10:0%d:00" % minute, 1, 1),
+                       "BAR", None)])
+        writer.write_segments()
+    writer.flush([(_bar("2019-01-02 10:03:00", 1, 1), "BAR", None)])
+    eq_(writer.stats()["rows_written"], 3)
+    eq_(writer.stats()["rows_buffered"], 1)
+    eq_(len(archive.segments("bars", "2019-01-02", "AAPL_STK")), 3)
+
+    # next day
+    writer._day = "2019-01-02"
+    writer.write_segments()
+    eq_(writer.stats()["rows_written"], 4)
+    eq_(len(archive.segments("bars", "2019-01-02", "AAPL_STK")), 1)
+    eq_(len(archive.read(["AAPL_STK"], "2019-01-02", table="bars")), 4)
@@ -0,0 +1,60 @@
+from threading import Event
+from time import sleep
+
+from nose.tools import eq_
+from qtpylib.asynctools import Conflator, WorkerPool
+
+
+def test_worker_pool_keeps_order_per_key():
+    """Test that tasks sharing a key run in submission order"""
+    pool = WorkerPool(workers=3)
+    results = {}
+
+    def handler(key, value):
+        results.setdefault(key, []).append(value)
+
+    for value in range(200):
+        for key in ("ES", "NQ", "CL", "GC"):
+            pool.submit(key, handler, key, value)
+    pool.stop()
+
+    for key in ("ES", "NQ", "CL", "GC"):
+        eq_(results[key], list(range(200)))
+    eq_(pool.stats()["processed"], 800)
+
+
+def test_worker_pool_coalesces_pending_tasks():
+    """Test that a waiting coalesced task only runs with its latest args"""
+    pool = WorkerPool(workers=1)
+    release = Event()
+    seen = []
+
+    pool.submit("ES", release.wait)
+    for value in range(10):
+        pool.submit("ES", seen.append, value, policy="coalesce")
+    release.set()
+    pool.stop()
+
+    eq_(seen, [9])
+    eq_(pool.stats()["coalesced"], 9)
+
+
+def test_conflator_publishes_latest_message():
+    """Test that conflated messages keep the latest state per key"""
+    published = []
+    conflator = Conflator(published.append, interval=0.05,
+                          urgent=lambda last, msg: msg["bid"] != last["bid"])
+
+    for size in range(100):
+        conflator.submit("ES", {"symbol": "ES", "bid": 1., "bidsize": size})
+    # urgent (price move) - published right away
+    conflator.submit("ES", {"symbol": "ES", "bid": 2., "bidsize": 1})
+    conflator.submit("ES", {"symbol": "ES", "bid": 2., "bidsize": 2})
+    conflator.submit("NQ", {"symbol": "NQ", "bid": 1., "bidsize": 1})
+    sleep(0.2)
+
+    eq_([(msg["symbol"], msg["bid"], msg["bidsize"]) for msg in published], [
+        ("ES", 1., 0), ("ES", 2., 1), ("NQ", 1., 1), ("ES", 2., 2)])
+    eq_(conflator.stats(), {"received": 103, "published": 4,
+                            "conflated": 99, "pending": 0, "errors": 0})
+    conflator.stop()
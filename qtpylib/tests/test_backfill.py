@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from threading import Lock, Timer
+from time import time
+
+from nose.tools import eq_
+from qtpylib.backfill import BackfillScheduler
+
+
+def test_scheduler_with_fake_source():
+    """Test that chunks are paced, one in-flight request per symbol"""
+    requests = []
+    times = []
+    written = []
+    inflight = set()
+    lock = Lock()
+
+    def request(job):
+        with lock:
+            # a single request per symbol at any time
+            eq_(job.symbol in inflight, False)
+            inflight.add(job.symbol)
+            requests.append(job)
+            times.append(time())
+
+        # fail each symbol's first request once, answer the rest
+        def respond():
+            with lock:
+                inflight.discard(job.symbol)
+            if job.attempts == 1 and len(requests) <= 2:
+                return scheduler.failed(job.symbol, "pacing violation")
+            scheduler.received(job.symbol, {"timestamp": job.start})
+            scheduler.completed(job.symbol)
+
+        Timer(0.01, respond).start()
+
+    scheduler = BackfillScheduler(
+        request, write=lambda job: written.extend(job.rows),
+        max_requests=4, period=0.2, max_inflight=2, timeout=5)
+
+    start = datetime(2019, 1, 1)
+    eq_(scheduler.add("AAPL", [(start, start + timedelta(days=3))]), 3)
+    eq_(scheduler.add("ES", [(start, start + timedelta(hours=36))]), 2)
+    eq_(scheduler.add("NQ", [], "1 min"), 0)
+
+    progress = scheduler.run(timeout=10)
+    eq_(progress, {
+        "AAPL": {"chunks": 3, "completed": 3, "failed": 0, "rows": 3},
+        "ES": {"chunks": 2, "completed": 2, "failed": 0, "rows": 2}})
+    eq_(len(requests), 7)
+    eq_(sorted(row["timestamp"] for row in written), sorted(
+        [start + timedelta(days=d) for d in range(3)] +
+        [start, start + timedelta(days=1)]))
+
+    # pacing: no more than 4 requests within any 0.2 sec window
+    for ix in range(len(times) - 4):
+        eq_(times[ix + 4] - times[ix] > 0.19, True)
+
+
+def test_late_answers_are_ignored():
+    """Test that a timed out request's late rows don't reach its retry"""
+    requests = []
+    written = []
+
+    def request(job):
+        requests.append(job.attempts)
+        if job.attempts == 1:
+            # answered after the timeout (and the retry's answer)
+            def respond():
+                scheduler.received(job.symbol, {"attempt": 1})
+                scheduler.completed(job.symbol)
+            Timer(1.5, respond).start()
+        else:
+            def respond():
+                scheduler.received(job.symbol, {"attempt": 2})
+                scheduler.completed(job.symbol)
+            Timer(0.01, respond).start()
+
+    scheduler = BackfillScheduler(
+        request, write=lambda job: written.extend(job.rows), timeout=0.1)
+    start = datetime(2019, 1, 1)
+    scheduler.add("AAPL", [(start, start + timedelta(hours=1))])
+
+    eq_(scheduler.run(timeout=5)["AAPL"]["completed"], 1)
+    eq_(requests, [1, 2])
+    eq_(written, [{"attempt": 2}])
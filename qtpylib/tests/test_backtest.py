@@ -0,0 +1,36 @@
+import pandas as pd
+
+from nose.tools import eq_
+from qtpylib.backtest import BacktestRunner
+
+
+def _history():
+    index = pd.DatetimeIndex(["2019-01-02 10:01", "2019-01-02 10:00",
+                              "2019-01-02 10:01", "2019-01-02 10:00"],
+                             name="datetime").tz_localize("UTC")
+    return pd.DataFrame(index=index, data={
+        "symbol": ["AAPL", "AAPL", "MSFT", "MSFT"],
+        "close": [2., 1., 4., 3.]})
+
+
+def test_runner_feeds_rows_in_order():
+    """Test that history is handled one row at a time, in time order"""
+    handled = []
+
+    def handler(bar):
+        eq_(len(bar.index), 1)
+        handled.append((bar["symbol"].values[0], bar["close"].values[0]))
+
+    runner = BacktestRunner(handler)
+    stats = runner.run(_history())
+
+    # rows with the same timestamp keep their order
+    eq_(handled, [("AAPL", 1.), ("MSFT", 3.), ("AAPL", 2.), ("MSFT", 4.)])
+    eq_(stats["events"], 4)
+    eq_(stats["backtest_time"], "2019-01-02 10:01:00+00:00")
+
+
+def test_runner_stop():
+    """Test that a backtest can be stopped by the handler"""
+    runner = BacktestRunner(lambda bar: runner.stop())
+    eq_(runner.run(_history())["events"], 1)
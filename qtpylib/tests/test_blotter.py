@@ -0,0 +1,134 @@
+from unittest import SkipTest
+
+import pandas as pd
+
+from nose.tools import eq_
+
+try:
+    from qtpylib.blotter import Blotter
+    from qtpylib.backfill import BackfillJob
+except ImportError:
+    raise SkipTest("IbPy2 can't be imported")
+
+
+class FakeCursor():
+    def __init__(self):
+        self.deleted = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith("DELETE FROM bars") or \
+                sql.startswith("DELETE FROM `bars`"):
+            ids = params if params is not None else sql.split("(")[-1][
+                :-1].split(",")
+            self.deleted.extend(int(x) for x in ids)
+
+
+class FakeConnection():
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _baseline_fix_history_sequence(self, df, table):
+    """ _fix_history_sequence() as it was before it was vectorized """
+    cols = df.columns[df.columns.str.startswith('Unnamed:')].tolist()
+    df.drop(cols, axis=1, inplace=True)
+
+    df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
+    blacklist = df[df['datetime'] > pd.to_datetime('now', utc=True)]
+    df = df.loc[list(set(df.index) - set(blacklist))]
+
+    dfs = []
+    bad_ids = [blacklist['id'].values.tolist()]
+
+    for symbol_id in list(df['symbol_id'].unique()):
+        data = df[df['symbol_id'] == symbol_id].copy()
+        data.sort_values('id', axis=0, ascending=True, inplace=False)
+        data.loc[:, "ix"] = data.index
+        data.reset_index(inplace=True)
+
+        malformed = data.shift(1)[(data['id'] > data['id'].shift(1)) & (
+            data['datetime'] < data['datetime'].shift(1))]
+
+        if malformed.empty:
+            dfs.append(data)
+        else:
+            index = [
+                x for x in data.index.values if x not in malformed['ix'].values]
+            dfs.append(data.loc[index])
+            bad_ids.append(list(malformed['id'].values))
+
+    data = pd.concat(dfs, sort=True)
+    bad_ids = sum(bad_ids, [])
+    if bad_ids:
+        bad_ids = list(map(str, map(int, bad_ids)))
+        self.dbcurr.execute("DELETE FROM " + table.lower() +
+                            " WHERE id IN (%s)" % (",".join(bad_ids)))
+
+    return data.drop(['id', 'ix', 'index'], axis=1)
+
+
+def _bars():
+    """ live bars (ids 1-5), backfilled earlier bars (6-10), a future bar """
+    times = list(pd.date_range("2019-01-02 10:00", periods=5, freq="1T")) + \
+        list(pd.date_range("2019-01-02 09:55", periods=5, freq="1T")) + \
+        [pd.Timestamp("2100-01-01")]
+    data = pd.DataFrame({"id": range(1, 12), "symbol_id": 7,
+                         "datetime": times, "close": range(11)})
+    # as queried (by datetime)
+    return data.sort_values("datetime").reset_index(drop=True)
+
+
+def test_fix_history_sequence_matches_baseline():
+    """Test that only future-dated rows are dropped, in time order"""
+    blotter = Blotter.__new__(Blotter)
+    blotter.dbcurr = FakeCursor()
+    blotter.dbconn = FakeConnection()
+
+    data = blotter._fix_history_sequence(_bars(), "bars", cleanup=True)
+    deleted = blotter.dbcurr.deleted
+
+    blotter.dbcurr = FakeCursor()
+    expected = _baseline_fix_history_sequence(blotter, _bars(), "bars")
+    eq_(deleted, blotter.dbcurr.deleted)
+    eq_(deleted, [11])
+
+    # the baseline kept the future row in the frame
+    expected = expected[expected["close"] != 10].sort_values("datetime")
+    eq_(data["close"].tolist(), expected["close"].tolist())
+    eq_(data["datetime"].is_monotonic_increasing, True)
+    eq_(list(data.columns), ["symbol_id", "datetime", "close"])
+
+
+class FakeWriter():
+    def __init__(self):
+        self.rows_failed = 0
+        self.flushed = []
+
+    def flush(self, rows):
+        self.flushed.extend(rows)
+
+
+def test_write_backfill_rebuilds_rollups():
+    """Test that backfilled bars rebuild (not merge) their rollups"""
+    blotter = Blotter.__new__(Blotter)
+    blotter.args = {"rollups": ["1H"]}
+    blotter._coverage = None
+    rebuilt = []
+    blotter.rebuild_rollups = lambda start, end: rebuilt.append((start, end))
+
+    job = BackfillJob("ES_FUT", "2019-01-02 09:00", "2019-01-02 10:00")
+    job.rows = [{"kind": "BAR", "symbol": "ES_FUT"}]
+    writer = FakeWriter()
+    blotter._write_backfill(writer, job)
+    eq_(len(writer.flushed), 1)
+    eq_(rebuilt, [("2019-01-02 09:00", "2019-01-02 10:00")])
+
+    # ticks have no rollups
+    job = BackfillJob("ES_FUT", "2019-01-02 09:00", "2019-01-02 10:00",
+                      bar_size="1 secs")
+    job.rows = []
+    blotter._write_backfill(writer, job)
+    eq_(len(rebuilt), 1)
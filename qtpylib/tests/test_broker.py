@@ -0,0 +1,106 @@
+import logging
+
+from datetime import datetime, timedelta
+from unittest import SkipTest
+
+from nose.tools import eq_
+
+try:
+    from qtpylib import tools
+    from qtpylib.blotter import Blotter
+    from qtpylib.broker import Broker
+    from qtpylib.simulator import Simulator
+except ImportError:
+    raise SkipTest("IbPy2 can't be imported")
+
+START = datetime(2019, 1, 2, 10, 0)
+
+
+class BacktestBroker(Broker):
+    """ Broker in backtest mode, without an IB connection """
+
+    def __init__(self):
+        self.strategy = "TestStrategy"
+        self.backtest = True
+        self.timezone = "UTC"
+        self.tick_window = 1
+        self.bar_window = 100
+        self.last_price = {}
+        self.sms_numbers = []
+        self.trade_log_dir = None
+        self.dbconn = None
+        self.dbcurr = None
+        self.log_broker = logging.getLogger(__name__)
+        self.active_trades = {}
+        self.trades = []
+        self.fills = []
+        self.simulator = Simulator(on_fill=self._on_simulated_fill,
+                                   on_cancel=self._on_simulated_cancel)
+        self.orders = tools.make_object(
+            by_tickerid={}, by_symbol={}, pending_ttls={}, pending={},
+            filled={}, active={}, history={}, nextId=1, recent={})
+
+    def get_contract_details(self, symbol):
+        return {"m_minTick": .25}
+
+    def get_contract(self, symbol):
+        return None
+
+    def on_fill(self, instrument, order):
+        self.fills.append(order)
+
+
+def _bar(broker, minutes, price):
+    broker.simulator.on_bar("ES", START + timedelta(minutes=minutes),
+                            price, price + 1, price - 1, price)
+
+
+def test_backtest_orders_fill_on_5min_bars():
+    """Test that orders without an expiry fill on the next 5T bar"""
+    broker = BacktestBroker()
+    _bar(broker, 0, 100)
+    broker._create_order("ES", "BUY", 1)
+    _bar(broker, 5, 101)
+
+    eq_([order["action"] for order in broker.fills], ["BUY"])
+    eq_(broker.get_positions("ES")["position"], 1)
+    eq_(broker.orders.pending, {})
+
+    # limit orders get (at least) the next bar too
+    broker._create_order("ES", "SELL", 1, limit_price=101.5)
+    _bar(broker, 10, 101)
+    eq_(broker.get_positions("ES")["position"], 0)
+    eq_(len(broker.trades), 1)
+
+
+def test_backfill_errors_reach_the_blotter():
+    """Test that the algo's backfill sees "no data" and pacing errors"""
+    completed = []
+    failed = []
+
+    broker = BacktestBroker()
+    broker.blotter = Blotter.__new__(Blotter)
+    broker.blotter.ibConn = tools.make_object(
+        tickerSymbol=lambda tickerId: "ES")
+    broker.blotter._backfill_scheduler = tools.make_object(
+        completed=completed.append,
+        failed=lambda symbol, error, retry=True: failed.append(symbol))
+
+    def error(message):
+        return tools.make_object(id=1, errorCode=162, errorMsg=message)
+
+    broker.ibCallback("handleError", error(
+        "Historical Market Data Service error message:HMDS query returned "
+        "no data: ESH9@GLOBEX Trades"))
+    broker.ibCallback("handleError", error(
+        "Historical Market Data Service error message:Historical data "
+        "request pacing violation"))
+    eq_(completed, ["ES"])
+    eq_(failed, ["ES"])
+
+
+def test_errors_before_the_blotter_is_set():
+    """Test that errors while connecting (before self.blotter) are ignored"""
+    broker = BacktestBroker()
+    broker.ibCallback("handleError", tools.make_object(
+        id=1, errorCode=200, errorMsg="No security definition found"))
@@ -0,0 +1,27 @@
+import tempfile
+
+import pandas as pd
+from nose.tools import eq_
+from qtpylib.cache import HistoryCache
+
+
+def test_history_cache_roundtrip():
+    """Test that cached history is stored with its time range by key"""
+    cache = HistoryCache(tempfile.mkdtemp())
+
+    key = HistoryCache.key("AAPL,MSFT", "1T", True, "UTC")
+    eq_(key, HistoryCache.key(["MSFT", "AAPL"], "1T", True, "UTC"))
+    eq_(key == HistoryCache.key(["MSFT", "AAPL"], "5T", True, "UTC"), False)
+    eq_(cache.get(key), (None, None, None))
+
+    data = pd.DataFrame({"close": [1., 2.]}, index=pd.date_range(
+        "2019-01-01 10:00", periods=2, freq="1T", tz="US/Eastern"))
+    cache.put(key, data, "2019-01-01", "2019-01-02 12:00:00")
+
+    cached, start, end = cache.get(key)
+    eq_(cached.equals(data), True)
+    eq_(str(start), "2019-01-01 00:00:00+00:00")
+    eq_(str(end), "2019-01-02 12:00:00+00:00")
+
+    cache.invalidate(key)
+    eq_(cache.get(key)[0], None)
@@ -0,0 +1,133 @@
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+from nose.tools import eq_
+from qtpylib.archive import Archive, ArchiveWriter
+from qtpylib.coverage import ArchiveCoverage, Coverage, MySQLCoverage
+
+
+def test_coverage_gaps():
+    """Test that stored ranges are merged and only gaps are returned"""
+    coverage = Coverage()
+    coverage.add("AAPL", "BAR", "2019-01-01 10:00", "2019-01-01 11:00")
+    coverage.add("AAPL", "BAR", "2019-01-01 13:00", "2019-01-01 14:00")
+    # touching (within tolerance) - merged
+    coverage.add("AAPL", "BAR", "2019-01-01 11:01", "2019-01-01 12:00")
+
+    eq_(coverage.intervals("AAPL", "BAR"), [
+        (datetime(2019, 1, 1, 10), datetime(2019, 1, 1, 12)),
+        (datetime(2019, 1, 1, 13), datetime(2019, 1, 1, 14))])
+    eq_(coverage.intervals("AAPL", "TICK"), [])
+
+    eq_(coverage.gaps("AAPL", "BAR", "2019-01-01 09:00", "2019-01-01 15:00"), [
+        (datetime(2019, 1, 1, 9), datetime(2019, 1, 1, 10)),
+        (datetime(2019, 1, 1, 12), datetime(2019, 1, 1, 13)),
+        (datetime(2019, 1, 1, 14), datetime(2019, 1, 1, 15))])
+    eq_(coverage.gaps("AAPL", "BAR", "2019-01-01 10:30", "2019-01-01 11:30"),
+        [])
+
+    index = pd.to_datetime(["2019-01-01 09:59", "2019-01-01 12:00",
+                            "2019-01-01 12:30"]).tz_localize("UTC")
+    eq_(list(coverage.covered("AAPL", "BAR", index)), [False, True, False])
+
+
+def test_coverage_add_index():
+    """Test that only the contiguous runs of loaded rows are covered"""
+    coverage = Coverage()
+    index = pd.date_range("2019-01-01 10:00", periods=5, freq="1T").append(
+        pd.date_range("2019-01-01 11:00", periods=5, freq="1T"))
+    coverage.add_index("AAPL", "BAR", index)
+
+    eq_(coverage.intervals("AAPL", "BAR"), [
+        (datetime(2019, 1, 1, 10), datetime(2019, 1, 1, 10, 4)),
+        (datetime(2019, 1, 1, 11), datetime(2019, 1, 1, 11, 4))])
+    eq_(coverage.gaps("AAPL", "BAR", "2019-01-01 10:00", "2019-01-01 11:00"),
+        [(datetime(2019, 1, 1, 10, 4), datetime(2019, 1, 1, 11))])
+
+    # 5-minute bars are contiguous at their own resolution
+    coverage.add_index("MSFT", "BAR", index[::5], max_gap="1H")
+    eq_(coverage.intervals("MSFT", "BAR"), [
+        (datetime(2019, 1, 1, 10), datetime(2019, 1, 1, 11))])
+
+
+class FakeCoverageCursor():
+    """ the ``coverage`` table, as a {id: (start, end)} dict """
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = []
+
+    def execute(self, sql, params):
+        if sql.startswith("SELECT"):
+            last, first = params[2:]
+            self.rows = [(row_id, start, end)
+                         for row_id, (start, end) in self.table.items()
+                         if start <= last and end >= first]
+        elif sql.startswith("DELETE"):
+            for row_id in params:
+                del self.table[row_id]
+
+    def executemany(self, sql, rows):
+        for _, _, start, end in rows:
+            self.table[max(self.table, default=0) + 1] = (start, end)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeCoverageConnection():
+    def __init__(self):
+        self.table = {}
+
+    def cursor(self):
+        return FakeCoverageCursor(self.table)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_mysql_coverage_updates_overlapping_rows():
+    """Test that only the stored intervals touching a new one are changed"""
+    conn = FakeCoverageConnection()
+    coverage = MySQLCoverage(lambda: conn, lambda symbol, c, cur: 7)
+    for hour in (10, 12, 14):
+        coverage.add("AAPL", "TICK", datetime(2019, 1, 1, hour),
+                     datetime(2019, 1, 1, hour, 30))
+    eq_(sorted(conn.table), [1, 2, 3])
+
+    # extends the 12:00 interval, the others are left alone
+    coverage.add("AAPL", "TICK", "2019-01-01 12:20", "2019-01-01 13:00")
+    eq_(conn.table, {
+        1: (datetime(2019, 1, 1, 10), datetime(2019, 1, 1, 10, 30)),
+        3: (datetime(2019, 1, 1, 14), datetime(2019, 1, 1, 14, 30)),
+        4: (datetime(2019, 1, 1, 12), datetime(2019, 1, 1, 13))})
+
+    # already covered - nothing written
+    coverage.add("AAPL", "TICK", "2019-01-01 10:05", "2019-01-01 10:10")
+    eq_(sorted(conn.table), [1, 3, 4])
+
+
+def test_archive_writer_coverage():
+    """Test that archived rows are recorded in the archive's coverage"""
+    archive = Archive(tempfile.mkdtemp())
+    coverage = ArchiveCoverage(archive)
+    writer = ArchiveWriter(archive, coverage=coverage,
+                           flush_interval=60).start()
+
+    for minute in range(3):
+        writer.write({"symbol": "AAPL_STK", "symbol_group": "AAPL",
+                      "asset_class": "STK",
+                      "timestamp": "2019-01-02 10:0%d:00" % minute,
+                      "open": 1, "high": 1, "low": 1, "close": 1,
+                      "volume": 1}, "BAR")
+    writer.stop()
+
+    eq_(ArchiveCoverage(Archive(archive.path)).intervals("AAPL_STK", "BAR"), [
+        (datetime(2019, 1, 2, 10), datetime(2019, 1, 2, 10, 2))])
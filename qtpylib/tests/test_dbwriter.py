@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+
+import pymysql
+
+from nose.tools import eq_
+from qtpylib.dbwriter import DBWriter
+
+
+def _table(sql):
+    words = sql.split()
+    return words[words.index("INTO") + 1]
+
+
+class FakeCursor():
+    def __init__(self, log):
+        self.log = log
+
+    def executemany(self, sql, rows):
+        # the database rejects negative prices
+        if any(row[6] < 0 for row in rows):
+            raise ValueError("Out of range value for column 'last'")
+        self.log.append((_table(sql), list(rows)))
+
+    def execute(self, sql, params):
+        self.log.append((_table(sql), [params]))
+
+    def close(self):
+        pass
+
+
+class FakeConnection():
+    def __init__(self):
+        self.log = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _tick(n):
+    return {"symbol": "AAPL_STK", "asset_class": "STK",
+            "timestamp": "2019-01-01 10:00:%02d.000" % n,
+            "bid": 1, "bidsize": 1, "ask": 2, "asksize": 1,
+            "last": 1.5, "lastsize": 100 + n}
+
+
+def test_dbwriter_batches_rows():
+    """Test that queued rows are written with one executemany per table"""
+    conn = FakeConnection()
+    writer = DBWriter(lambda: conn, lambda data, c, cur: 7,
+                      batch_size=100, flush_interval=60).start()
+
+    for n in range(10):
+        writer.write(_tick(n), "TICK")
+    writer.write({"symbol": "AAPL_STK", "asset_class": "STK",
+                  "timestamp": "2019-01-01 10:00:00", "open": 1, "high": 2,
+                  "low": 1, "close": 2, "volume": 500}, "BAR")
+    writer.stop()
+
+    eq_(conn.commits, 1)
+    eq_([(table, len(rows)) for table, rows in conn.log],
+        [("`ticks`", 10), ("`bars`", 1)])
+    eq_(conn.log[0][1][3], ("2019-01-01 10:00:03.000", 7,
+                            1., 1, 2., 1, 1.5, 103))
+    eq_(writer.stats()["rows_written"], 11)
+    eq_(writer.stats()["queue_depth"], 0)
+
+
+def test_dbwriter_skips_bad_rows():
+    """Test that only the rows that can't be written are dropped"""
+    conn = FakeConnection()
+    writer = DBWriter(lambda: conn, lambda data, c, cur: 7)
+
+    ticks = [_tick(n) for n in range(5)]
+    ticks[1]["lastsize"] = None
+    eq_(writer.flush([(tick, "TICK", None) for tick in ticks]), True)
+    eq_(len(conn.log[0][1]), 4)
+
+    # rejected by the database: written row by row
+    ticks[1]["lastsize"] = 100
+    ticks[3]["last"] = -1
+    del conn.log[:]
+    eq_(writer.flush([(tick, "TICK", None) for tick in ticks]), True)
+    eq_([rows[0][7] for table, rows in conn.log], [100, 100, 102, 104])
+    eq_((writer.rows_written, writer.rows_failed), (8, 2))
+
+
+class FakeCoverage():
+    tolerance = timedelta(minutes=1)
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, symbol, resolution, start, end):
+        self.added.append((start.strftime("%H:%M"), end.strftime("%H:%M")))
+
+
+def test_dbwriter_coverage_skips_outages():
+    """Test that gaps between written rows aren't recorded as covered"""
+    coverage = FakeCoverage()
+    writer = DBWriter(lambda: FakeConnection(), lambda data, c, cur: 7,
+                      coverage=coverage)
+
+    def bars(*minutes):
+        writer.flush([({"symbol": "AAPL_STK", "asset_class": "STK",
+                        "timestamp": "2019-01-01 10:%02d:00" % minute,
+                        "open": 1, "high": 2, "low": 1, "close": 2,
+                        "volume": 5}, "BAR", None) for minute in minutes])
+
+    bars(0, 1, 2, 20, 21)
+    bars(22, 45)
+    writer.update_coverage(force=True)
+    eq_(coverage.added, [("10:00", "10:02"), ("10:20", "10:22"),
+                         ("10:45", "10:45")])
+
+    # recorded spans are dropped, the last one is extended
+    del coverage.added[:]
+    bars(46)
+    writer.update_coverage(force=True)
+    eq_(coverage.added, [("10:45", "10:46")])
+
+
+class LostCommitConnection(FakeConnection):
+    """ loses the connection while committing (the first time) """
+
+    def __init__(self):
+        super(LostCommitConnection, self).__init__()
+        self.lost = False
+
+    def commit(self):
+        if not self.lost:
+            self.lost = True
+            raise pymysql.err.OperationalError(2013, "Lost connection")
+        super(LostCommitConnection, self).commit()
+
+
+def test_dbwriter_retried_commit_rebuilds_rollups():
+    """Test that a batch retried after a lost commit rebuilds its rollups
+    (instead of adding its bars to them twice)"""
+    conn = LostCommitConnection()
+    writer = DBWriter(lambda: conn, lambda data, c, cur: 7,
+                      rollups=["5T"])
+    writer.flush([({"symbol": "AAPL_STK", "asset_class": "STK",
+                    "timestamp": "2019-01-01 10:0%d:00" % minute,
+                    "open": 1, "high": 2, "low": 1, "close": 2,
+                    "volume": 5}, "BAR", None) for minute in (3, 6)])
+
+    eq_([table for table, rows in conn.log],
+        ["`bars`", "`rollups`", "`bars`", "`rollups`"])
+    # merged the first time, rebuilt from the bars on retry
+    eq_(len(conn.log[1][1]), 2)
+    eq_(conn.log[3][1], [("5T", 300, 300, datetime(2019, 1, 1, 10),
+                          datetime(2019, 1, 1, 10, 10))])
+    eq_((writer.rows_written, writer.rows_failed), (2, 0))
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+
+from nose.tools import eq_
+from qtpylib.journal import Journal
+
+
+class FakeWriter():
+    """ DBWriter stand-in, unreachable while ``offline`` is set """
+
+    def __init__(self, offline=False):
+        self.offline = offline
+        self.rows = []
+        self.rows_failed = 0
+        self.rebuilds = []
+
+    def flush(self, batch, rebuild=False):
+        if self.offline:
+            return False
+        self.rows.extend(batch)
+        self.rebuilds.append(rebuild)
+        return True
+
+    def update_coverage(self, force=False):
+        pass
+
+    def stats(self):
+        return {"rows_written": len(self.rows)}
+
+    def stop(self):
+        pass
+
+
+def _bar(minute):
+    return {"symbol": "AAPL", "symbol_group": "AAPL", "asset_class": "STK",
+            "timestamp": "2019-01-02 10:%02d:00" % minute, "open": 1.,
+            "high": 2., "low": .5, "close": 1.5, "volume": minute,
+            "kind": "BAR"}
+
+
+def _wait(func, timeout=5):
+    deadline = time.time() + timeout
+    while not func() and time.time() < deadline:
+        time.sleep(.01)
+
+
+def test_journal_survives_outages_and_restarts():
+    """Test that journaled rows are drained once the database is back"""
+    path = tempfile.mkdtemp()
+    writer = FakeWriter(offline=True)
+    journal = Journal(path, writer, segment_size=500, batch_size=4,
+                      flush_interval=.01, retry_interval=.01).start()
+
+    for minute in range(20):
+        journal.write(_bar(minute), "BAR")
+    _wait(lambda: journal.offline_since is not None)
+    eq_(writer.rows, [])
+    assert len(journal.segments()) > 1
+
+    # restart while the database is down: rows stay on disk
+    journal.stop()
+    writer = FakeWriter(offline=True)
+    journal = Journal(path, writer, batch_size=4, flush_interval=.01,
+                      retry_interval=.01).start()
+    journal.write(_bar(20), "BAR")
+    time.sleep(.05)
+
+    writer.offline = False
+    _wait(lambda: len(writer.rows) == 21)
+    journal.stop()
+
+    eq_([data["volume"] for data, kind, greeks in writer.rows],
+        list(range(21)))
+    eq_(str(writer.rows[3][0]["timestamp"]), "2019-01-02 10:03:00")
+
+    # the first batch after a restart may replay committed rows
+    eq_(writer.rebuilds[0], True)
+    eq_(set(writer.rebuilds[1:]), {False})
+
+    # drained segments are removed, the checkpoint points past them
+    eq_(journal.segments(), [journal.checkpoint()[0]])
+    eq_(journal.stats()["journal_pending_bytes"], 0)
+
+
+def test_journal_skips_torn_records():
+    """Test that a partial record at the end of a segment is skipped"""
+    path = tempfile.mkdtemp()
+    journal = Journal(path, FakeWriter(offline=True))
+    journal.write(_bar(1), "BAR")
+    journal.write(_bar(2), "BAR")
+    journal.stop()
+
+    filename = journal.segment_file(journal.segments()[0])
+    with open(filename, "rb+") as f:
+        f.truncate(os.path.getsize(filename) - 3)
+
+    writer = FakeWriter()
+    journal = Journal(path, writer, flush_interval=.01).start()
+    _wait(lambda: not os.path.exists(filename))
+    journal.stop()
+
+    eq_([data["volume"] for data, kind, greeks in writer.rows], [1])
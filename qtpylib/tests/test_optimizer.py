@@ -0,0 +1,103 @@
+import pandas as pd
+
+from nose.tools import eq_
+from qtpylib import optimizer
+from qtpylib.optimizer import (
+    Optimizer, grid, parse_param, random_search, recorded_metrics,
+    walkforward_windows
+)
+
+
+def _history():
+    index = pd.date_range("2019-01-01", periods=10, freq="D", tz="UTC",
+                          name="datetime")
+    return pd.DataFrame(index=index, data={
+        "symbol": "AAPL", "close": [float(day) for day in range(10)]})
+
+
+class FakeDataStore():
+    def __init__(self, recorded):
+        self.recorded = recorded
+
+
+class FakeStrategy():
+    """ Algo stand-in: holds ``size`` shares from the first bar on """
+
+    def __init__(self, instruments, size=1, backtest=False, start=None,
+                 end=None, output=None, ibclient=None, **kwargs):
+        self.size = size
+        self.start = start
+        self.simulator = None
+        self.trades = []
+
+    def load_history(self):
+        return _history()
+
+    def run(self, history=None):
+        self.datastore = FakeDataStore(pd.DataFrame(index=history.index, data={
+            "AAPL_CLOSE": history["close"].values,
+            "AAPL_POSITION": [0] + [self.size] * (len(history.index) - 1)}))
+
+
+def test_search_combinations():
+    """Test grid/random search and command-line params"""
+    params = {"fast": [5, 10], "slow": [50, 100, 200], "mode": "long"}
+    combinations = grid(params)
+    eq_(len(combinations), 6)
+    eq_(combinations[0], {"fast": 5, "slow": 50, "mode": "long"})
+
+    sampled = random_search(params, 4, seed=1)
+    eq_(len(sampled), 4)
+    eq_(len({tuple(sorted(c.items())) for c in sampled}), 4)
+    assert all(combination in combinations for combination in sampled)
+    eq_(random_search(params, 4, seed=1), sampled)
+    eq_(len(random_search(params, 100)), 6)
+
+    eq_(parse_param("fast=5:20:5"), ("fast", [5, 10, 15]))
+    eq_(parse_param("stop=.5,1,x"), ("stop", [.5, 1, "x"]))
+
+
+def test_walkforward_windows():
+    """Test rolling and anchored walk-forward periods"""
+    windows = walkforward_windows("2019-01-01", "2019-01-10", "4D", "2D")
+    eq_([(str(train_start.date()), str(test_end.date()))
+         for train_start, _, _, test_end in windows],
+        [("2019-01-01", "2019-01-07"), ("2019-01-03", "2019-01-09"),
+         ("2019-01-05", "2019-01-10")])
+    eq_(windows[0][1], windows[0][2])
+
+    windows = walkforward_windows("2019-01-01", "2019-01-10", "4D", "2D",
+                                  anchored=True)
+    eq_({str(window[0].date()) for window in windows}, {"2019-01-01"})
+
+
+def test_recorded_metrics():
+    """Test that P&L is marked to market from recorded positions"""
+    recorded = pd.DataFrame(index=pd.date_range("2019-01-01", periods=5),
+                            data={"AAPL_CLOSE": [10., 11., 9., 12., 12.],
+                                  "AAPL_POSITION": [0, 1, 1, -1, 0]})
+    metrics = recorded_metrics(recorded)
+    eq_(metrics["pnl"], 1 - 2 - 3 + 0.)
+    eq_(metrics["max_drawdown"], 5.)
+    eq_(metrics["exposure"], .6)
+    eq_(metrics["position_changes"], 3)
+    eq_(recorded_metrics(None)["pnl"], 0)
+
+
+def test_optimizer_runs_in_parallel():
+    """Test that all combinations are backtested and ranked"""
+    params = {"size": [1, 3, 2]}
+    results = Optimizer(FakeStrategy, params, workers=2,
+                        instruments=["AAPL"], start="2019-01-01").run()
+    eq_(list(results["size"]), [3, 2, 1])
+    eq_(list(results["pnl"]), [27., 18., 9.])
+    assert "error" not in results.columns
+
+    walkforward = Optimizer(FakeStrategy, params, workers=0,
+                            instruments=["AAPL"], start="2019-01-01"
+                            ).walkforward("4D", "3D")
+    tests = walkforward[walkforward["phase"] == "test"]
+    eq_(list(tests["size"]), [3, 3])
+    eq_(list(tests["pnl"]), [6., 6.])
+    eq_(len(walkforward.index), 8)
+    eq_(optimizer._WORKER["number"], 1)
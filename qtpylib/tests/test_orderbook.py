@@ -0,0 +1,74 @@
+import random
+
+from nose.tools import eq_
+from qtpylib import protocol
+from qtpylib.orderbook import (
+    OrderBook, INSERT, UPDATE, DELETE, ASK, BID
+)
+
+
+def _message(data):
+    data.update(symbol="ES", symbol_group="ES_F", asset_class="FUT",
+                kind="ORDERBOOK")
+    # over the (binary) wire
+    return protocol.decode(*protocol.encode("t", data, "ORDERBOOK"))
+
+
+def test_orderbook_updates():
+    """Test that IB depth operations shift levels like the exchange book"""
+    book = OrderBook(depth=3)
+    book.update(0, INSERT, BID, 100., 5)
+    book.update(0, INSERT, BID, 101., 2)
+    book.update(1, UPDATE, BID, 100., 7)
+    book.update(0, INSERT, ASK, 102., 1)
+    eq_(book.to_dict(), {"bid": [101., 100.], "bidsize": [2., 7.],
+                         "ask": [102., 0.], "asksize": [1., 0.]})
+
+    book.update(0, DELETE, BID, 0, 0)
+    eq_(book.to_dict(), {"bid": [100.], "bidsize": [7.],
+                         "ask": [102.], "asksize": [1.]})
+
+    # out of range levels are ignored
+    book.update(3, INSERT, BID, 99., 1)
+    eq_(book.to_dict()["bid"], [100.])
+
+
+def test_orderbook_deltas_rebuild_book():
+    """Test that clients rebuild the book from snapshots and deltas"""
+    random.seed(7)
+    book = OrderBook()
+    client = OrderBook()
+
+    # deltas before the first snapshot are ignored
+    book.update(0, INSERT, BID, 100., 1)
+    eq_(client.apply(_message({"levels": book.delta(), "snapshot": False,
+                               "seq": book.seq})), False)
+
+    snapshot = book.snapshot()
+    snapshot.update(snapshot=True, seq=book.seq)
+    eq_(client.apply(_message(snapshot)), True)
+
+    for _ in range(200):
+        for _ in range(random.randint(1, 5)):
+            book.update(random.randint(0, 9), random.choice(
+                (INSERT, UPDATE, DELETE)), random.choice((ASK, BID)),
+                random.randint(90, 110) * 1., random.randint(1, 50))
+        message = _message({"levels": book.delta(), "snapshot": False,
+                            "seq": book.seq})
+        eq_(client.apply(message), True)
+        eq_(client.to_dict(), book.to_dict())
+
+    # missed a delta - out of sync until the next snapshot
+    book.update(0, UPDATE, ASK, 120., 1)
+    book.delta()
+    book.update(0, UPDATE, ASK, 121., 1)
+    eq_(client.apply(_message({"levels": book.delta(), "snapshot": False,
+                               "seq": book.seq})), False)
+    book.update(1, UPDATE, ASK, 122., 1)
+    eq_(client.apply(_message({"levels": book.delta(), "snapshot": False,
+                               "seq": book.seq})), False)
+
+    snapshot = book.snapshot()
+    snapshot.update(snapshot=True, seq=book.seq)
+    eq_(client.apply(_message(snapshot)), True)
+    eq_(client.to_dict(), book.to_dict())
@@ -0,0 +1,84 @@
+from datetime import date
+
+from nose.tools import eq_
+from qtpylib import partitions
+from qtpylib.dbwriter import DBWriter
+
+
+class FakeCursor():
+    def __init__(self, partitions=()):
+        self.partitions = list(partitions)
+        self.log = []
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def executemany(self, sql, rows):
+        self.log.append((sql, list(rows)))
+
+    def fetchall(self):
+        return [(name,) for name in self.partitions]
+
+
+class FakeConnection():
+    def __init__(self):
+        self.dbcurr = FakeCursor()
+
+    def cursor(self):
+        return self.dbcurr
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_partition_ddl():
+    """Test adding and dropping day partitions"""
+    eq_(partitions.partition_name(date(2019, 1, 2)), "p20190102")
+    eq_(partitions.partition_date("p20190102"), date(2019, 1, 2))
+    eq_(partitions.partition_date("pmax"), None)
+
+    dbcurr = FakeCursor(["p20190101", "p20190102", "pmax"])
+    eq_(partitions.add_partitions(dbcurr, "ticks", date(2019, 1, 4)),
+        [date(2019, 1, 3), date(2019, 1, 4)])
+    eq_(dbcurr.log[-1],
+        "ALTER TABLE `ticks` REORGANIZE PARTITION `pmax` INTO ("
+        "PARTITION `p20190103` VALUES LESS THAN (TO_DAYS('2019-01-04')), "
+        "PARTITION `p20190104` VALUES LESS THAN (TO_DAYS('2019-01-05')), "
+        "PARTITION `pmax` VALUES LESS THAN MAXVALUE)")
+
+    eq_(partitions.drop_partitions(dbcurr, "ticks", date(2019, 1, 2)),
+        ["p20190101"])
+    eq_(dbcurr.log[-1], "ALTER TABLE `ticks` DROP PARTITION `p20190101`")
+
+    ddl = partitions.table_ddl("bars", "bars_new")
+    assert ddl.startswith("CREATE TABLE IF NOT EXISTS `bars_new` (")
+    assert "PARTITION `pmax` VALUES LESS THAN MAXVALUE" in ddl
+
+
+def test_dbwriter_inline_greeks():
+    """Test that the partitioned schema stores greeks in the same row"""
+    conn = FakeConnection()
+    writer = DBWriter(lambda: conn, lambda data, c, cur: 7,
+                      partitioned=True)
+
+    option = {"symbol": "AAPL20190118C00150000_OPT", "asset_class": "OPT",
+              "timestamp": "2019-01-02 10:00:00", "bid": 1, "bidsize": 1,
+              "ask": 2, "asksize": 1, "last": 1.5, "lastsize": 3,
+              "opt_price": 1.5, "opt_underlying": 150, "opt_dividend": 0,
+              "opt_volume": 10, "opt_iv": .2, "opt_oi": 100,
+              "opt_delta": .5, "opt_gamma": .1, "opt_theta": -.1,
+              "opt_vega": .2}
+    writer.flush([(option, "TICK", None),
+                  (dict(option, symbol="AAPL_STK", asset_class="STK"),
+                   "TICK", None)])
+
+    # no separate greeks statement
+    eq_(len(conn.dbcurr.log), 1)
+    sql, rows = conn.dbcurr.log[0]
+    assert "`opt_vega`" in sql
+    eq_(rows[0], ("2019-01-02 10:00:00", 7, 1., 1, 2., 1, 1.5, 3,
+                  1.5, 150., 0., 10, .2, 100., .5, .1, -.1, .2))
+    eq_(rows[1][8:], (None,) * 10)
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from nose.tools import eq_
+from qtpylib import protocol
+
+OPT_NONE = {col: None for col in protocol.OPT_FIELDS}
+
+
+def test_protocol_tick_roundtrip():
+    """Test that ticks survive binary encoding"""
+    tick = dict(symbol="ESZ2019_FUT", symbol_group="ES_F", asset_class="FUT",
+                timestamp="2019-11-01 10:00:01.250", last=3050.25,
+                lastsize=3, bid=3050., bidsize=12, ask=3050.25, asksize=9,
+                kind="TICK", **OPT_NONE)
+
+    frames = protocol.encode("_qtpylib_blotter_", tick, "TICK")
+    eq_(frames[0], b"_qtpylib_blotter_|ESZ2019_FUT|TICK")
+
+    data = protocol.decode(*frames)
+    eq_(data.pop("timestamp"), datetime(2019, 11, 1, 10, 0, 1, 250000))
+    tick.pop("timestamp")
+
+    # missing values are decoded as NaN
+    for col in protocol.OPT_FIELDS:
+        value = data.pop(col)
+        eq_(value != value, True)
+        tick.pop(col)
+    eq_(data, tick)
+
+
+def test_protocol_orderbook_and_fallback():
+    """Test packed order books and json fallback for unknown fields"""
+    book = {"bid": [1., .5], "bidsize": [10., 20.], "ask": [1.5, 2.],
+            "asksize": [5., 7.], "symbol": "AAPL", "symbol_group": "AAPL",
+            "asset_class": "STK", "kind": "ORDERBOOK"}
+    eq_(protocol.decode(*protocol.encode("t", book, "ORDERBOOK")), book)
+
+    quote = {"bid": 1., "ask": 2., "strike": 100., "type": "C",
+             "symbol": "AAPL_OPT", "symbol_group": "AAPL_OPT",
+             "asset_class": "OPT", "kind": "QUOTE"}
+    frames = protocol.encode("t", quote, "QUOTE")
+    eq_(frames[1][:1], protocol.TAG_JSON)
+    eq_(protocol.decode(*frames), quote)
+
+
+def test_subscriptions_filter_by_symbol_and_kind():
+    """Test subscription prefixes match only the wanted messages"""
+    prefixes = protocol.subscriptions(
+        "_qtpy", ["AAPL"], ["TICK", "BAR"], binary=True)
+    eq_(prefixes, [b"_qtpy|AAPL|TICK", b"_qtpy|AAPL|BAR"])
+    eq_(protocol.subscriptions("_qtpy", ["AAPL"], binary=True),
+        [b"_qtpy|AAPL|"])
+
+    # json messages start with their prefix, legacy blotters aren't filtered
+    eq_(protocol.subscriptions("_qtpy", ["AAPL"], ["TICK"], version=2),
+        [b"AAPL|TICK|"])
+    eq_(protocol.subscriptions("_qtpy", ["AAPL"], ["TICK"], version=1),
+        [b""])
@@ -0,0 +1,63 @@
+import tempfile
+
+import pandas as pd
+
+from nose.tools import eq_
+from qtpylib import replay
+
+
+def _write_csv(path):
+    meta = {"symbol_group": "AAPL", "asset_class": "STK", "expiry": None}
+    ticks = pd.DataFrame([
+        dict(meta, datetime="2019-01-02 10:00:30.250", bid=1., bidsize=1,
+             ask=2., asksize=2, last=1.5, lastsize=10),
+        dict(meta, datetime="2019-01-02 10:01:00.000", bid=1., bidsize=1,
+             ask=2., asksize=2, last=1.6, lastsize=5),
+    ]).assign(symbol="AAPL")
+    bars = pd.DataFrame([
+        dict(meta, datetime="2019-01-02 10:00:00", open=1.5, high=1.5,
+             low=1.5, close=1.5, volume=10),
+    ]).assign(symbol="AAPL")
+    ticks.to_csv("%s/AAPL.TICK.csv" % path, index=False)
+    bars.to_csv("%s/AAPL.BAR.csv" % path, index=False)
+
+
+def test_replay_messages_in_order():
+    """Test that stored ticks/bars are published as live messages"""
+    path = tempfile.mkdtemp()
+    _write_csv(path)
+
+    streams = [replay.iter_messages(
+        [replay.read_csv(path, kind, ["AAPL"], "2019-01-02")], kind)
+        for kind in ("TICK", "BAR")]
+
+    published = []
+    replayer = replay.Replayer(
+        publish=lambda message, kind: published.append(message), speed=0)
+    stats = replayer.run(replay.merge(*streams))
+    eq_(stats["published"], 3)
+
+    # bars are published when they close, after that minute's ticks
+    eq_([(message["kind"], message["timestamp"]) for message in published],
+        [("TICK", "2019-01-02 10:00:30.250"),
+         ("TICK", "2019-01-02 10:01:00.000"),
+         ("BAR", "2019-01-02 10:00:00")])
+    eq_(published[0], {"symbol": "AAPL", "symbol_group": "AAPL",
+                       "asset_class": "STK",
+                       "timestamp": "2019-01-02 10:00:30.250",
+                       "bid": 1., "bidsize": 1, "ask": 2., "asksize": 2,
+                       "last": 1.5, "lastsize": 10, "kind": "TICK"})
+    eq_(published[2]["volume"], 10)
+
+
+def test_replay_speed():
+    """Test that messages are paced by their timestamps"""
+    messages = [(ix * 100000, {"symbol": "AAPL", "kind": "TICK"})
+                for ix in range(6)]
+    replayer = replay.Replayer(publish=lambda message, kind: None,
+                               speed=10)
+    stats = replayer.run(iter(messages))
+
+    # 0.5 seconds of ticks at 10x
+    eq_(stats["published"], 6)
+    assert .04 <= stats["seconds"] < .3, stats
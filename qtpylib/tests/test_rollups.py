@@ -0,0 +1,89 @@
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from nose.tools import eq_, assert_raises
+from qtpylib.archive import Archive, ArchiveWriter
+from qtpylib.rollups import (
+    best_rollup, parse_rollups, rollup_ranges, rollup_rows
+)
+
+
+def test_rollup_resolutions():
+    """Test parsing rollups and picking the coarsest usable one"""
+    rollups = parse_rollups("1h, 5T,15min,1D")
+    eq_(rollups, ["5T", "15T", "1H", "1D"])
+    assert_raises(ValueError, parse_rollups, "7T")
+    assert_raises(ValueError, parse_rollups, "1T")
+
+    eq_(best_rollup("1T", rollups), None)
+    eq_(best_rollup("10T", rollups), "5T")
+    eq_(best_rollup("30T", rollups), "15T")
+    eq_(best_rollup("4H", rollups), "1H")
+    eq_(best_rollup("1D", rollups), "1D")
+    eq_(best_rollup("1000K", rollups), None)
+
+    eq_(rollup_rows(("2019-01-02 10:07:00", 7, 1., 2., .5, 1.5, 10),
+                    ["5T", "1H"]),
+        [("5T", pd.Timestamp("2019-01-02 10:05").to_pydatetime(),
+          7, 1., 2., .5, 1.5, 10),
+         ("1H", pd.Timestamp("2019-01-02 10:00").to_pydatetime(),
+          7, 1., 2., .5, 1.5, 10)])
+
+
+def test_rollup_ranges():
+    """Test that rollups are only read for whole periods in the range"""
+    def ranges(start, end):
+        return [(resolution, str(range_start), str(range_end))
+                for resolution, range_start, range_end in rollup_ranges(
+                    start, end, "1H")]
+
+    eq_(ranges("2019-01-02 09:30:00", "2019-01-02 12:10:00"), [
+        (None, "2019-01-02 09:30:00", "2019-01-02 09:59:59.999999"),
+        ("1H", "2019-01-02 10:00:00", "2019-01-02 11:59:59.999999"),
+        (None, "2019-01-02 12:00:00", "2019-01-02 12:10:00")])
+    eq_(ranges("2019-01-02 09:00:00", None), [
+        ("1H", "2019-01-02 09:00:00", "None")])
+    eq_(ranges("2019-01-02 09:30:00", "2019-01-02 10:30:00"), [])
+
+
+def test_archive_rollups_match_resampled_bars():
+    """Test that rollups maintained per bar equal resampled minute bars"""
+    archive = Archive(tempfile.mkdtemp())
+    writer = ArchiveWriter(archive, rollups=["15T", "1H"])
+
+    index = pd.date_range("2019-01-02 09:30", periods=300, freq="1T")
+    prices = 100 + np.random.RandomState(0).randn(len(index)).cumsum()
+    batch = [({"symbol": "AAPL_STK", "symbol_group": "AAPL",
+               "asset_class": "STK", "timestamp": str(timestamp),
+               "open": price, "high": price + 1, "low": price - 1,
+               "close": price + .5, "volume": ix + 1}, "BAR", None)
+             for ix, (timestamp, price) in enumerate(zip(index, prices))]
+
+    # periods split across segments
+    writer.flush(batch[:100])
+    writer.write_segments()
+    writer.flush(batch[100:])
+    writer.stop()
+    eq_(len(archive.segments("bars_1H", "2019-01-02", "AAPL_STK")), 2)
+
+    bars = archive.read(["AAPL_STK"], "2019-01-02").set_index("datetime")
+    expected = bars[["open", "high", "low", "close", "volume"]].resample(
+        "1H").agg({"open": "first", "high": "max", "low": "min",
+                   "close": "last", "volume": "sum"})
+
+    rollup = archive.read(["AAPL_STK"], "2019-01-02", table="bars_1H")
+    eq_(rollup["datetime"].tolist(), expected.index.tolist())
+    for name in ("open", "high", "low", "close", "volume"):
+        np.testing.assert_allclose(rollup[name].values,
+                                   expected[name].values)
+
+    # rebuilding from the stored bars gives the same rollup
+    archive.rebuild_rollup("1H")
+    rebuilt = archive.read(["AAPL_STK"], "2019-01-02", table="bars_1H")
+    np.testing.assert_allclose(rebuilt["close"].values,
+                               expected["close"].values)
+    eq_(rebuilt["volume"].tolist(), expected["volume"].tolist())
+
+    eq_(len(archive.read(["AAPL_STK"], "2019-01-02", table="bars_15T")), 20)
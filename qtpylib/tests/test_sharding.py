@@ -0,0 +1,71 @@
+import socket
+import time
+
+import zmq
+
+from nose.tools import eq_
+from qtpylib import protocol
+from qtpylib.sharding import ShardProxy, shard_of
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_shard_of():
+    """Test that contracts are spread over shards by symbol"""
+    symbols = ["SYM%d" % ix for ix in range(200)]
+    shards = [shard_of((symbol, "STK", "SMART"), 4) for symbol in symbols]
+    eq_(sorted(set(shards)), [0, 1, 2, 3])
+    assert min(shards.count(shard) for shard in range(4)) > 25
+
+    # same shard for all of a symbol's contracts, in every run
+    eq_(shard_of(("ES", "FUT", "GLOBEX", "USD", 201609), 4),
+        shard_of(("ES", "FUT", "GLOBEX", "USD", 201612), 4))
+    eq_(shard_of("AAPL", 4), shard_of(("aapl", "STK"), 4))
+
+
+def test_proxy_republishes_shards():
+    """Test that subscribers get every shard's messages on one port"""
+    context = zmq.Context()
+    frontend, backend = _free_port(), _free_port()
+    proxy = ShardProxy(frontend, backend, host="127.0.0.1",
+                       context=context).start()
+
+    shards = []
+    for ix in range(2):
+        sock = context.socket(zmq.PUB)
+        sock.connect("tcp://127.0.0.1:%d" % backend)
+        shards.append(sock)
+
+    sub = context.socket(zmq.SUB)
+    for prefix in protocol.subscriptions(
+            "_qtpylib_test_", ["AAPL_STK", "MSFT_STK"], ["BAR"], version=2):
+        sub.setsockopt(zmq.SUBSCRIBE, prefix)
+    sub.connect("tcp://127.0.0.1:%d" % frontend)
+
+    def publish():
+        for sock, symbol in zip(shards, ("AAPL_STK", "MSFT_STK")):
+            for kind in ("BAR", "TICK"):
+                sock.send_string("%s_qtpylib_test_ %s" % (
+                    protocol.text_topic(symbol, kind), symbol))
+
+    # subscriptions reach the shards asynchronously
+    received = []
+    deadline = time.time() + 5
+    while time.time() < deadline and len(set(received)) < 2:
+        publish()
+        while sub.poll(100):
+            received.append(sub.recv_string())
+
+    proxy.stop()
+    for sock in shards + [sub]:
+        sock.close(linger=0)
+    context.term()
+
+    eq_(sorted(set(received)), ["AAPL_STK|BAR|_qtpylib_test_ AAPL_STK",
+                                "MSFT_STK|BAR|_qtpylib_test_ MSFT_STK"])
@@ -0,0 +1,78 @@
+import tempfile
+
+from datetime import datetime
+
+from nose.tools import eq_
+from qtpylib import shmbus
+
+
+def test_shmbus_ring_roundtrip():
+    """Test that subscribers get new records in order and detect overruns"""
+    root, shmbus.ROOT = shmbus.ROOT, tempfile.mkdtemp()
+    try:
+        publisher = shmbus.ShmPublisher("test", capacity=8)
+        bar = {"symbol": "AAPL_STK", "symbol_group": "AAPL",
+               "asset_class": "STK", "timestamp": "2019-01-01 10:00:00",
+               "open": 1, "high": 2, "low": 0.5, "close": 1.5, "volume": 10}
+        publisher.publish(bar, "BAR")
+
+        subscriber = shmbus.ShmSubscriber("test", ["AAPL_STK"], ["BAR"])
+        eq_(subscriber.poll(), [])
+
+        publisher.publish(dict(bar, volume=20), "BAR")
+        publisher.publish({"symbol": "AAPL_STK", "bid": 1, "bidsize": 1,
+                           "ask": 2, "asksize": 1, "last": 1.5,
+                           "lastsize": 1}, "QUOTE")
+        messages = subscriber.poll()
+        eq_(len(messages), 1)
+        eq_(messages[0]["volume"], 20)
+        eq_(messages[0]["kind"], "BAR")
+        eq_(messages[0]["symbol_group"], "AAPL")
+        eq_(messages[0]["timestamp"], datetime(2019, 1, 1, 10))
+
+        for volume in range(20):
+            publisher.publish(dict(bar, volume=volume), "BAR")
+        eq_([data["volume"] for data in subscriber.poll()],
+            list(range(12, 20)))
+        eq_(subscriber.missed, 12)
+
+        # symbols that start streaming after subscribing
+        subscriber.close()
+        subscriber = shmbus.ShmSubscriber("test", ["AAPL_STK", "ES_FUT"],
+                                          ["BAR"])
+        subscriber._next_check = 0
+        publisher.publish(dict(bar, symbol="ES_FUT", volume=1), "BAR")
+        publisher.publish(dict(bar, symbol="ES_FUT", volume=2), "BAR")
+        eq_([data["volume"] for data in subscriber.poll()], [1, 2])
+
+        subscriber.close()
+        publisher.close()
+        eq_(shmbus.ShmSubscriber.available("test"), False)
+    finally:
+        shmbus.ROOT = root
+
+
+def test_shmbus_skips_extra_fields():
+    """Test that messages with fields the records can't hold aren't
+    published (they'd lose them), while schema messages are"""
+    root, shmbus.ROOT = shmbus.ROOT, tempfile.mkdtemp()
+    try:
+        publisher = shmbus.ShmPublisher("test", capacity=8)
+        quote = {"symbol": "AAPL_OPT", "symbol_group": "AAPL_OPT",
+                 "asset_class": "OPT", "timestamp": "2019-01-01 10:00:00",
+                 "bid": 1, "bidsize": 1, "ask": 2, "asksize": 1,
+                 "last": 1.5, "lastsize": 1}
+        subscriber = shmbus.ShmSubscriber("test", ["AAPL_OPT"], ["QUOTE"])
+        subscriber._next_check = 0
+
+        eq_(publisher.publish(dict(quote, type="C", strike=150,
+                                   opt_delta=0.5), "QUOTE"), None)
+        publisher.publish(quote, "QUOTE")
+        messages = subscriber.poll()
+        eq_(len(messages), 1)
+        eq_("strike" in messages[0], False)
+
+        subscriber.close()
+        publisher.close()
+    finally:
+        shmbus.ROOT = root
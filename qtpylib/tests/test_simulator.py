@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+from nose.tools import eq_
+from qtpylib.simulator import Simulator
+
+START = datetime(2019, 1, 2, 10)
+
+
+def _bars(simulator, bars, symbol="AAPL"):
+    """ 1-minute bars, following the simulator's last one """
+    fills = []
+    for open, high, low, close in bars:
+        time = START if simulator.time is None else \
+            simulator.time + timedelta(minutes=1)
+        fills.extend(simulator.on_bar(symbol, time, open, high, low, close))
+    return fills
+
+
+def test_market_order_fills_on_next_bar():
+    """Test that orders fill at the next bar's open, with slippage"""
+    fills = []
+    simulator = Simulator(on_fill=fills.append, slippage=.05,
+                          commission=.01, min_commission=1)
+    _bars(simulator, [(10, 11, 9, 10.5)])
+
+    simulator.submit("AAPL", 100)
+    eq_(simulator.position("AAPL"), (0, 0.))
+
+    _bars(simulator, [(10.8, 11, 10, 10.2)])
+    eq_(len(fills), 1)
+    eq_(fills[0]["action"], "BUY")
+    eq_(fills[0]["quantity"], 100)
+    eq_(fills[0]["avgFillPrice"], 10.85)
+    eq_(fills[0]["commission"], 1)
+    eq_(fills[0]["time"], START + timedelta(minutes=1))
+    eq_(simulator.position("AAPL"), (100, 10.85))
+
+    # exit
+    simulator.submit("AAPL", -100)
+    _bars(simulator, [(11, 11, 11, 11)])
+    eq_(simulator.position("AAPL"), (0, 0.))
+    # (10.95 - 10.85) * 100, less $2 commissions
+    eq_(round(simulator.stats()["realized_pnl"], 2), 8.)
+
+
+def test_limit_and_expiry():
+    """Test that limit orders fill at their price or expire"""
+    cancelled = []
+    simulator = Simulator(on_cancel=cancelled.append)
+    _bars(simulator, [(10, 10, 10, 10)])
+    simulator.submit("AAPL", 100, limit_price=9.5, expiry=30)
+
+    fills = _bars(simulator, [(10, 10.2, 9.8, 10), (9.9, 10, 9.4, 9.6)])
+    eq_(fills, [])
+    eq_(len(cancelled), 1)
+
+    simulator = Simulator()
+    _bars(simulator, [(10, 10, 10, 10)])
+    simulator.submit("AAPL", 100, limit_price=9.5, expiry=60)
+    fills = _bars(simulator, [(10, 10.2, 9.8, 10), (9.9, 10, 9.4, 9.6)])
+    eq_([fill["avgFillPrice"] for fill in fills], [9.5])
+
+    # gaps below the limit fill at the open
+    simulator = Simulator()
+    _bars(simulator, [(10, 10, 10, 10)])
+    simulator.submit("AAPL", 100, limit_price=9.5)
+    eq_(_bars(simulator, [(9, 9.2, 8.8, 9)])[0]["avgFillPrice"], 9)
+
+
+def test_expiry_starts_with_the_next_bar():
+    """Test that orders get matched at least once at any resolution"""
+    simulator = Simulator()
+    simulator.on_bar("ES", START, 10, 10, 10, 10)
+    simulator.submit("ES", 1, expiry=60)
+    simulator.submit("ES", 1, limit_price=9, expiry=60)
+
+    fills = simulator.on_bar("ES", START + timedelta(minutes=5),
+                             10, 10, 8, 9)
+    eq_([fill["order_type"] for fill in fills], ["MARKET", "LIMIT"])
+    eq_(simulator.position("ES")[0], 2)
+
+
+def test_bracket_order():
+    """Test that targets/stops are activated by the entry, one cancels
+    the other"""
+    fills = []
+    cancelled = []
+    simulator = Simulator(on_fill=fills.append, on_cancel=cancelled.append)
+    _bars(simulator, [(10, 10, 10, 10)])
+    ids = simulator.submit("AAPL", 100, target=11, initial_stop=9)
+
+    # entry fills; children wait for the next bar
+    _bars(simulator, [(10, 10, 10, 10), (10, 10, 10, 10),
+                      (10, 11.5, 10, 11)])
+    eq_([(fill["id"], fill["avgFillPrice"]) for fill in fills],
+        [(ids["entryOrderId"], 10), (ids["targetOrderId"], 11)])
+    eq_(fills[1]["parentId"], ids["entryOrderId"])
+    eq_([order["id"] for order in cancelled], [ids["stopOrderId"]])
+    eq_(simulator.orders(), [])
+    eq_(simulator.position("AAPL"), (0, 0.))
+
+    # stop is assumed to be hit first
+    fills = []
+    simulator = Simulator(on_fill=fills.append)
+    _bars(simulator, [(10, 10, 10, 10)])
+    ids = simulator.submit("AAPL", -100, target=9, initial_stop=11)
+    _bars(simulator, [(10, 10, 10, 10), (10, 11.5, 8.5, 10)])
+    eq_([fill["id"] for fill in fills],
+        [ids["entryOrderId"], ids["stopOrderId"]])
+    eq_(fills[1]["action"], "BUY")
+    eq_(fills[1]["avgFillPrice"], 11)
+
+
+def test_trailing_stop():
+    """Test that a stop trails the price once triggered"""
+    fills = []
+    simulator = Simulator(on_fill=fills.append)
+    _bars(simulator, [(10, 10, 10, 10)])
+    ids = simulator.submit("AAPL", 100, initial_stop=9, trail_stop_at=11,
+                           trail_stop_by=.5, trail_stop_type="amount")
+    stop = [order for order in simulator.orders()
+            if order["id"] == ids["stopOrderId"]][0]
+
+    _bars(simulator, [(10, 10, 10, 10), (10, 10.8, 10, 10.5)])
+    eq_(stop["stop"], 9)
+
+    _bars(simulator, [(10.5, 12, 10.5, 11.8)])
+    eq_(stop["stop"], 11.5)
+    _bars(simulator, [(11.8, 11.9, 11.6, 11.7)])
+    eq_(stop["stop"], 11.5)
+
+    _bars(simulator, [(11.6, 11.7, 11, 11.2)])
+    eq_(fills[-1]["avgFillPrice"], 11.5)
+    eq_(simulator.position("AAPL")[0], 0)
+
+
+def test_latency_and_ticks():
+    """Test latency and tick fills at the bid/ask"""
+    simulator = Simulator(latency=2)
+    simulator.on_tick("AAPL", START, 10, bid=9.9, ask=10.1)
+    simulator.submit("AAPL", -10)
+
+    eq_(simulator.on_tick("AAPL", START + timedelta(seconds=1), 10,
+                          bid=9.9, ask=10.1), [])
+    fills = simulator.on_tick("AAPL", START + timedelta(seconds=2), 10,
+                              bid=9.8, ask=10.1)
+    eq_(fills[0]["avgFillPrice"], 9.8)
+    eq_(simulator.position("AAPL"), (-10, 9.8))
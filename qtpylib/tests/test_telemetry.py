@@ -0,0 +1,57 @@
+import json
+
+from urllib.request import urlopen
+
+from nose.tools import eq_, ok_
+from qtpylib.asynctools import WorkerPool
+from qtpylib.telemetry import Histogram, Telemetry
+
+
+def test_histogram_percentiles():
+    """Test that percentiles return their bucket's upper bound"""
+    histogram = Histogram()
+    for _ in range(90):
+        histogram.observe(0.0002)
+    for _ in range(10):
+        histogram.observe(0.3)
+
+    eq_(histogram.count, 100)
+    eq_(histogram.percentile(.5), 0.00025)
+    eq_(histogram.percentile(.9), 0.00025)
+    eq_(histogram.percentile(.99), 0.3)  # capped at the max
+    eq_(histogram.max, 0.3)
+
+
+def test_telemetry_snapshot_and_endpoint():
+    """Test counters, message rates, gauges and the HTTP endpoint"""
+    telemetry = Telemetry()
+    telemetry.count("zmq.errors")
+    telemetry.gauge("queue", lambda: {"depth": 3})
+    telemetry.gauge("broken", lambda: 1 / 0)
+    for _ in range(5):
+        telemetry.message("TICK", "ES")
+    telemetry.message("BAR", "NQ")
+
+    # task queue/run times are reported by the worker pool
+    pool = WorkerPool(workers=1, observer=lambda name, wait, run:
+                      telemetry.observe("handler." + name, run))
+
+    def on_tick():
+        ok_(pool.task_submitted() is not None)
+
+    pool.submit("ES", on_tick)
+    pool.stop()
+
+    host, port = telemetry.serve(0)
+    try:
+        snapshot = json.loads(urlopen(
+            "http://%s:%d/" % (host, port), timeout=5).read().decode())
+    finally:
+        telemetry.stop()
+
+    eq_(snapshot["counters"], {"zmq.errors": 1})
+    eq_(snapshot["messages"]["TICK"]["total"], 5)
+    eq_(snapshot["symbols"]["NQ"]["total"], 1)
+    eq_(snapshot["gauges"], {"queue": {"depth": 3}, "broken": None})
+    eq_(snapshot["latency"]["handler.on_tick"]["count"], 1)
+    eq_(pool.errors, 0)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from nose.tools import eq_
+from qtpylib.windows import RingBuffer, WindowStore
+
+
+def _bars(symbol, minutes, group=None, tz="America/New_York"):
+    index = pd.DatetimeIndex(
+        ["2019-01-02 15:%02d:00" % minute for minute in minutes],
+        name="datetime").tz_localize("UTC").tz_convert(tz)
+    return pd.DataFrame(index=index, data={
+        "symbol": symbol, "symbol_group": group or symbol,
+        "asset_class": "STK", "close": [float(m) for m in minutes],
+        "volume": list(minutes)})
+
+
+def test_window_per_symbol():
+    """Test that each symbol keeps its own fixed-size window"""
+    store = WindowStore(capacity=3)
+    for minute in range(10):
+        store.append(_bars("AAPL", [minute]))
+        if minute % 2:
+            store.append(_bars("ESH2019_FUT", [minute], group="ES_F"))
+
+    aapl = store.frame("AAPL")
+    eq_(list(aapl["volume"]), [7, 8, 9])
+    eq_(str(aapl.index.tz), "America/New_York")
+    eq_(aapl.index.name, "datetime")
+    eq_(list(aapl.columns), ["symbol", "symbol_group", "asset_class",
+                             "close", "volume"])
+
+    # by symbol group, all symbols, lookback
+    eq_(list(store.frame("ES_F")["volume"]), [5, 7, 9])
+    eq_(list(store.frame()["volume"]), [5, 7, 7, 8, 9, 9])
+    eq_(list(store.frame("AAPL", lookback=1)["close"]), [9.])
+    assert "ES_F" in store and "MSFT" not in store
+    assert store.frame("MSFT").empty
+    eq_(store.last_index(), aapl.index[-1])
+
+
+def test_same_timestamp_replaces_row():
+    """Test that rows with an existing timestamp replace it"""
+    store = WindowStore(capacity=5)
+    store.append(_bars("AAPL", [1, 2, 4]))
+    store.append(_bars("AAPL", [4]).assign(volume=40))
+    store.append(_bars("AAPL", [3]))
+    store.append(_bars("AAPL", [1]).assign(volume=10))
+
+    eq_(list(store.frame("AAPL")["volume"]), [10, 2, 3, 40])
+
+
+def test_dtypes():
+    """Test that columns are upcasted/filled as needed"""
+    buffer = RingBuffer(capacity=2)
+    buffer.append(1, {"last": 1, "opt_iv": None})
+    buffer.append(2, {"last": 1.5, "opt_iv": .2, "opt_delta": .5})
+    buffer.append(3, {"last": 2, "opt_iv": None})
+
+    data = buffer.frame()
+    eq_(data["last"].dtype, np.dtype(float))
+    eq_(list(data["last"]), [1.5, 2.])
+    eq_(data["opt_iv"].tolist(), [.2, None])
+    assert np.isnan(data["opt_delta"].values[-1])
+
+
+def test_unbounded_buffer():
+    """Test that unbounded windows grow until truncated"""
+    buffer = RingBuffer()
+    for ix in range(1000):
+        buffer.append(ix, {"last": ix})
+    eq_(len(buffer), 1000)
+
+    buffer.truncate(10)
+    for ix in range(1000, 1005):
+        buffer.append(ix, {"last": ix})
+    eq_(list(buffer.frame()["last"]), list(range(990, 1005)))
+
+
+def test_load_history():
+    """Test that history is loaded into per-symbol windows"""
+    history = pd.concat([_bars("AAPL", range(10)),
+                         _bars("MSFT", range(5, 8))]).sort_index()
+    history["symbol"] = history["symbol"].astype("category")
+
+    store = WindowStore(capacity=4)
+    store.load(history)
+    eq_(sorted(store.symbols), ["AAPL", "MSFT"])
+    eq_(list(store.frame("AAPL")["volume"]), [6, 7, 8, 9])
+    eq_(list(store.frame("MSFT")["volume"]), [5, 6, 7])
+
+    store.append(_bars("MSFT", [8]))
+    eq_(len(store), 8)
+
+
+def test_append_row():
+    """Test that single rows can be added without a DataFrame"""
+    store = WindowStore(capacity=2)
+    store.append(_bars("AAPL", range(2)))
+    timestamp = store.frame("AAPL").index[-1]
+
+    store.append_row(timestamp, {"symbol": "AAPL", "volume": 10})
+    store.append_row(timestamp + pd.Timedelta("1min"),
+                     {"symbol": "AAPL", "volume": 11})
+    eq_(list(store.frame("AAPL")["volume"]), [10, 11])
+    eq_(str(store.frame("AAPL").index.tz), "America/New_York")
+
+    store.append_row(timestamp, {"symbol": "MSFT", "volume": 1},
+                     index_name="datetime")
+    eq_(store.frame("MSFT").index.name, "datetime")
@@ -870,12 +870,17 @@ def resample(data, resolution="1T", tz=None, ffill=True, dropna=False,
 # =============================================
 
 class DataStore():
+    """ recorded data (saved to ``output_file`` on every record,
+    or when calling ``save()`` if ``autosave`` is False) """
 
-    def __init__(self, output_file=None):
+    def __init__(self, output_file=None, autosave=True):
         self.auto = None
-        self.recorded = None
         self.output_file = output_file
+        self.autosave = autosave
         self.rows = []
+        self.index = []
+        self._recorded = None
+        self._changed = False
 
     def record(self, timestamp, *args, **kwargs):
         """ add custom data to data store """
@@ -896,7 +901,6 @@ class DataStore():
             data.update(dict(kwargs))
 
         data['datetime'] = timestamp
-        # self.rows.append(pd.DataFrame(data=data, index=[timestamp]))
 
         new_data = {}
         if "symbol" not in data.keys():
@@ -910,15 +914,35 @@ class DataStore():
 
         new_data['datetime'] = timestamp
 
-        # append to rows
-        self.rows.append(pd.DataFrame(data=new_data, index=[timestamp]))
+        # append to rows (the dataframe is built when needed)
+        self.rows.append(new_data)
+        self.index.append(timestamp)
+        self._changed = True
 
+        if self.autosave:
+            self.save()
+
+    @property
+    def recorded(self):
+        """ recorded data, one row per timestamp (None until a
+        symbol's data was recorded) """
+        if self._changed:
+            self._changed = False
+            try:
+                recorded = self._build()
+                if recorded is not None:
+                    self._recorded = recorded
+            except Exception as e:
+                pass
+        return self._recorded
+
+    def _build(self):
         # create dataframe
-        recorded = pd.concat(self.rows, sort=True)
+        recorded = pd.DataFrame(self.rows, index=self.index)
+        recorded = recorded[sorted(recorded.columns)]
 
         if "symbol" not in recorded.columns:
-            return
-
+            return None
 
         # group by symbol
         recorded['datetime'] = recorded.index
@@ -928,7 +952,6 @@ class DataStore():
         symbols = data['symbol'].unique().tolist()
         data.drop(columns=['symbol'], inplace=True)
 
-
         # cleanup:
 
         # remove symbols
@@ -948,15 +971,21 @@ class DataStore():
         # group df
         recorded = recorded.groupby(recorded['datetime']).first()
 
-        # shift position
+        # shift position (held until the next recorded change)
         for sym in symbols:
-            recorded[sym + '_POSITION'] = recorded[sym + '_POSITION'
-                                                   ].shift(1).fillna(0)
+            if sym + '_POSITION' in recorded.columns:
+                recorded[sym + '_POSITION'] = recorded[
+                    sym + '_POSITION'].ffill().shift(1).fillna(0)
 
-        # make this public
-        self.recorded = recorded.copy()
+        return recorded
+
+    def save(self):
+        """ saves the recorded data to ``output_file`` """
+        if self.output_file is None or self.recorded is None:
+            return
 
         # cleanup columns names before saving...
+        recorded = self.recorded.copy()
         recorded.columns = [col.replace('_FUT_', '_').replace(
                             '_OPT_OPT_', '_OPT_') for col in recorded.columns]
 
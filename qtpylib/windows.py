@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# QTPyLib: Quantitative Trading Python Library
+# https://github.com/ranaroussi/qtpylib
+#
+# Copyright 2016-2018 Ran Aroussi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Per-symbol tick/bar windows for ``Algo`` (``Algo.ticks`` / ``Algo.bars``).
+
+Each symbol's rows live in a fixed-capacity, column-oriented buffer
+(one NumPy array per column, plus the timestamps), so adding a tick or
+a bar is O(1) no matter how many symbols are tracked. DataFrames are
+only built when asked for (``Instrument.get_bars()`` etc.).
+
+Buffers are 2x their capacity: rows are appended until the end of the
+arrays, then the last ``capacity`` rows are moved back to the start -
+every window is a contiguous slice (no re-ordering on read).
+"""
+
+import sys
+
+from threading import RLock
+
+import numpy as np
+import pandas as pd
+
+# =============================================
+# check min, python version
+if sys.version_info < (3, 4):
+    raise SystemError("QTPyLib requires Python version >= 3.4")
+# =============================================
+
+
+def _missing(dtype):
+    return None if dtype == object else np.nan
+
+
+def _fits(array, value):
+    """ can the value be stored as is? """
+    kind = array.dtype.kind
+    return kind == "O" or value is None or (
+        kind == "f" and isinstance(value, (float, int, np.number)))
+
+
+def _common_dtype(current, new):
+    """ dtype that can hold values of both dtypes """
+    if current.kind in "biuf" and new.kind in "biuf":
+        return np.result_type(current, new, np.float16)
+    return np.dtype(object)
+
+
+# ---------------------------------------------
+class RingBuffer():
+    """Time-ordered rows of a single symbol
+
+    :Optional:
+        capacity : int
+            Max rows to keep (default: None = unbounded)
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = None if capacity is None else max(1, int(capacity))
+        self._size = 2 * self.capacity if self.capacity else 64
+        self._index = np.empty(self._size, dtype="int64")
+        self._columns = {}
+        self._start = 0
+        self._end = 0
+
+        self.tz = None
+        self.index_name = None
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @property
+    def last_index(self):
+        """ last timestamp (int64 nanoseconds) """
+        return self._index[self._end - 1] if len(self) else None
+
+    # ---------------------------------------------
+    def _column(self, name, dtype):
+        """ array for a column, created/upcasted as needed """
+        array = self._columns.get(name)
+        if array is None:
+            dtype = np.dtype(float) if dtype.kind in "biu" else dtype
+            dtype = dtype if dtype.kind in "f" else np.dtype(object)
+            array = np.empty(self._size, dtype=dtype)
+            array[self._start:self._end] = _missing(dtype)
+            self._columns[name] = array
+
+        elif array.dtype != dtype:
+            common = _common_dtype(array.dtype, dtype)
+            if common != array.dtype:
+                array = array.astype(common)
+                self._columns[name] = array
+
+        return array
+
+    def _make_room(self, rows=1):
+        if self._end + rows <= self._size:
+            return
+
+        # full (unbounded buffers grow when half full)
+        limit = self._size if self.capacity else self._size // 2
+        if len(self) + rows > limit:
+            size = max(self._size * 2, 2 * (len(self) + rows))
+            self._index = np.concatenate([
+                self._index[self._start:self._end],
+                np.empty(size - len(self), dtype="int64")])
+            for name, array in self._columns.items():
+                self._columns[name] = np.concatenate([
+                    array[self._start:self._end],
+                    np.empty(size - len(self), dtype=array.dtype)])
+            self._size = size
+
+        # move to the start of the arrays
+        else:
+            count = len(self)
+            self._index[:count] = self._index[self._start:self._end]
+            for array in self._columns.values():
+                array[:count] = array[self._start:self._end]
+        self._end = len(self)
+        self._start = 0
+
+    def _trim(self):
+        if self.capacity is not None and len(self) > self.capacity:
+            self._start = self._end - self.capacity
+
+    # ---------------------------------------------
+    def append(self, timestamp, row):
+        """Adds (or replaces) a row
+
+        :Parameters:
+            timestamp : int
+                Row's timestamp (int64 nanoseconds)
+            row : dict
+                Column values (as NumPy scalars / Python objects)
+        """
+        last = self.last_index
+
+        # same timestamp as the last row: replace it
+        if last is not None and timestamp == last:
+            pos = self._end - 1
+
+        # out of order: replace or insert (rare)
+        elif last is not None and timestamp < last:
+            index = self._index[self._start:self._end]
+            pos = self._start + int(np.searchsorted(index, timestamp))
+            if self._index[pos] != timestamp:
+                self._make_room()
+                pos = self._start + int(np.searchsorted(
+                    self._index[self._start:self._end], timestamp))
+                self._index[pos + 1:self._end + 1] = \
+                    self._index[pos:self._end]
+                for array in self._columns.values():
+                    array[pos + 1:self._end + 1] = array[pos:self._end]
+                    array[pos] = _missing(array.dtype)
+                self._end += 1
+
+        else:
+            self._make_room()
+            pos = self._end
+            self._end += 1
+
+        self._index[pos] = timestamp
+        for name, value in row.items():
+            array = self._columns.get(name)
+            if array is None or not _fits(array, value):
+                array = self._column(name, np.dtype(object) if value is None
+                                     else np.asarray(value).dtype)
+            array[pos] = _missing(array.dtype) if value is None else value
+
+        # columns this row doesn't have
+        if len(self._columns) > len(row):
+            for name, array in self._columns.items():
+                if name not in row:
+                    array[pos] = _missing(array.dtype)
+
+        self._trim()
+
+    def extend(self, timestamps, columns):
+        """Adds time-ordered rows (newer than the last one) at once
+
+        :Parameters:
+            timestamps : np.array
+                Rows' timestamps (int64 nanoseconds)
+            columns : dict
+                Column name => np.array of values
+        """
+        if self.capacity is not None:
+            timestamps = timestamps[-self.capacity:]
+            columns = {name: values[-len(timestamps):]
+                       for name, values in columns.items()}
+        rows = len(timestamps)
+        if not rows:
+            return
+
+        self._make_room(rows)
+        start, end = self._end, self._end + rows
+        self._index[start:end] = timestamps
+        for array in self._columns.values():
+            array[start:end] = _missing(array.dtype)
+        for name, values in columns.items():
+            self._column(name, values.dtype)[start:end] = values
+        self._end = end
+        self._trim()
+
+    def truncate(self, rows):
+        """ keeps the last ``rows`` rows """
+        if len(self) > rows:
+            self._start = self._end - max(0, int(rows))
+
+    # ---------------------------------------------
+    def frame(self, lookback=None):
+        """Builds a DataFrame of the buffer's rows
+
+        :Optional:
+            lookback : int
+                Max number of (last) rows (default: None = all)
+
+        :Returns:
+            data : pd.DataFrame
+                Rows, indexed by their timestamp
+        """
+        start = self._start
+        if lookback is not None:
+            start = max(start, self._end - int(lookback))
+
+        index = pd.DatetimeIndex(self._index[start:self._end].copy(),
+                                 name=self.index_name)
+        if self.tz is not None:
+            index = index.tz_localize("UTC").tz_convert(self.tz)
+
+        return pd.DataFrame({name: array[start:self._end].copy()
+                             for name, array in self._columns.items()},
+                            index=index)
+
+
+# ---------------------------------------------
+class WindowStore():
+    """Rolling windows of ticks/bars, one ``RingBuffer`` per symbol
+
+    :Optional:
+        capacity : int
+            Max rows to keep per symbol (default: None = unbounded)
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self._buffers = {}
+        self._groups = {}
+        self._lock = RLock()
+
+    def __len__(self):
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def __contains__(self, symbol):
+        """ has rows for this symbol (or symbol group)? """
+        buffer = self._buffers.get(symbol)
+        if buffer is not None and len(buffer):
+            return True
+        return any(len(self._buffers[sym]) for sym, group in
+                   list(self._groups.items()) if group == symbol)
+
+    @property
+    def symbols(self):
+        return list(self._buffers)
+
+    def clear(self):
+        with self._lock:
+            self._buffers = {}
+            self._groups = {}
+
+    # ---------------------------------------------
+    def _buffer(self, symbol, index):
+        buffer = self._buffers.get(symbol)
+        if buffer is None:
+            buffer = RingBuffer(self.capacity)
+            buffer.tz = getattr(index, "tz", None)
+            buffer.index_name = index.name
+            self._buffers[symbol] = buffer
+        return buffer
+
+    @staticmethod
+    def _timestamps(index):
+        if not isinstance(index, pd.DatetimeIndex):
+            index = pd.DatetimeIndex(index)
+        # (.values are UTC for tz-aware indexes)
+        return index.values.astype("datetime64[ns]").view("int64")
+
+    def append(self, data):
+        """Adds ticks/bars (replacing rows with the same timestamp)
+
+        :Parameters:
+            data : pd.DataFrame
+                Rows with a ``symbol`` column, indexed by timestamp
+        """
+        if data is None or data.empty:
+            return
+
+        timestamps = self._timestamps(data.index)
+        columns = list(data.columns)
+
+        with self._lock:
+            for timestamp, values in zip(timestamps, data.values):
+                row = dict(zip(columns, values))
+                symbol = row["symbol"]
+                self._buffer(symbol, data.index).append(timestamp, row)
+                if "symbol_group" in row:
+                    self._groups[symbol] = row["symbol_group"]
+
+    def append_row(self, timestamp, row, index_name=None):
+        """Adds (or replaces) a single row, without a DataFrame
+
+        :Parameters:
+            timestamp : pd.Timestamp
+                Row's timestamp
+            row : dict
+                Column values, including ``symbol``
+
+        :Optional:
+            index_name : str
+                Index name of the symbol's frames (if new)
+        """
+        timestamp = pd.Timestamp(timestamp)
+        symbol = row["symbol"]
+
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None:
+                buffer = self._buffer(symbol, pd.DatetimeIndex(
+                    [timestamp], name=index_name))
+            buffer.append(timestamp.value, row)
+            if "symbol_group" in row:
+                self._groups[symbol] = row["symbol_group"]
+
+    def load(self, data):
+        """Replaces all windows with ``data`` (eg. history)
+
+        :Parameters:
+            data : pd.DataFrame
+                Rows with a ``symbol`` column, indexed by timestamp
+        """
+        with self._lock:
+            self.clear()
+            if data is None or data.empty or "symbol" not in data.columns:
+                return
+
+            data = data.sort_index(kind="mergesort")
+            for symbol, rows in data.groupby(
+                    data["symbol"].astype(str).values, sort=False):
+                buffer = self._buffer(symbol, rows.index)
+                buffer.extend(self._timestamps(rows.index), {
+                    name: np.asarray(rows[name].values)
+                    for name in rows.columns})
+                if "symbol_group" in rows.columns:
+                    self._groups[symbol] = rows["symbol_group"].values[-1]
+
+    def truncate(self, symbol, rows):
+        """ keeps the last ``rows`` rows of a symbol """
+        with self._lock:
+            if symbol in self._buffers:
+                self._buffers[symbol].truncate(rows)
+
+    # ---------------------------------------------
+    def last_index(self):
+        """ the latest timestamp of all symbols (as pd.Timestamp) """
+        with self._lock:
+            buffers = [buffer for buffer in self._buffers.values()
+                       if len(buffer)]
+            if not buffers:
+                return None
+            buffer = max(buffers, key=lambda buffer: buffer.last_index)
+            return buffer.frame(1).index[-1]
+
+    def frame(self, symbol=None, lookback=None):
+        """Builds a DataFrame of a symbol's (or all symbols') rows
+
+        :Optional:
+            symbol : str
+                Symbol or symbol group (default: None = all symbols)
+            lookback : int
+                Max number of (last) rows per symbol (default: None = all)
+
+        :Returns:
+            data : pd.DataFrame
+                Rows sorted by timestamp
+        """
+        with self._lock:
+            symbols = self.symbols if symbol is None else [
+                sym for sym in self._buffers
+                if sym == symbol or self._groups.get(sym) == symbol]
+            dfs = [self._buffers[sym].frame(lookback) for sym in symbols]
+            dfs = [df for df in dfs if not df.empty]
+
+        if not dfs:
+            return pd.DataFrame()
+        if len(dfs) == 1:
+            return dfs[0]
+        return pd.concat(dfs, sort=False).sort_index(kind="mergesort")
@@ -37,6 +37,7 @@ from qtpylib.blotter import (
     load_blotter_args, get_symbol_id,
     mysql_insert_tick, mysql_insert_bar
 )
+from qtpylib.coverage import MySQLCoverage
 
 _IB_HISTORY_DOWNLOADED = False
 
@@ -314,6 +315,7 @@ def store_data(df, blotter=None, kind="BAR"):
     """
     Store QTPyLib-compatible csv files in Blotter's MySQL.
     TWS/GW data are required for determining futures/options expiration
+    Rows within time ranges that are already stored are skipped.
 
     :Parameters:
         df : dict
@@ -344,20 +346,33 @@ def store_data(df, blotter=None, kind="BAR"):
         raise Exception("Cannot continue. Blotter running with --dbskip")
 
     # connect to mysql using blotter's settings
-    dbconn = pymysql.connect(
-        client_flag=MULTI_STATEMENTS,
-        host=str(blotter_args['dbhost']),
-        port=int(blotter_args['dbport']),
-        user=str(blotter_args['dbuser']),
-        passwd=str(blotter_args['dbpass']),
-        db=str(blotter_args['dbname']),
-        autocommit=True
-    )
+    def connect():
+        return pymysql.connect(
+            client_flag=MULTI_STATEMENTS,
+            host=str(blotter_args['dbhost']),
+            port=int(blotter_args['dbport']),
+            user=str(blotter_args['dbuser']),
+            passwd=str(blotter_args['dbpass']),
+            db=str(blotter_args['dbname']),
+            autocommit=True
+        )
+
+    dbconn = connect()
     dbcurr = dbconn.cursor()
 
+    # time ranges already stored
+    coverage = MySQLCoverage(connect=connect, symbol_id=get_symbol_id)
+
     # loop through symbols and save in db
     for symbol in list(df['symbol'].unique()):
         data = df[df['symbol'] == symbol]
+        index = data.index
+
+        # skip rows already stored
+        data = data[~coverage.covered(symbol, kind, data.index)]
+        if data.empty:
+            continue
+
         symbol_id = get_symbol_id(symbol, dbconn, dbcurr)
 
         # prepare columns for insert
@@ -367,18 +382,25 @@ def store_data(df, blotter=None, kind="BAR"):
         # insert row by row to handle greeks
         data = data.to_dict(orient="records")
 
+        partitioned = blotter_args.get('dbschema') == "partitioned"
         if kind == "BAR":
             for _, row in enumerate(data):
-                mysql_insert_bar(row, symbol_id, dbcurr)
+                mysql_insert_bar(row, symbol_id, dbcurr, partitioned)
         else:
             for _, row in enumerate(data):
-                mysql_insert_tick(row, symbol_id, dbcurr)
+                mysql_insert_tick(row, symbol_id, dbcurr, partitioned)
 
         try:
             dbconn.commit()
         except Exception as e:
             return False
 
+        # only the runs actually present (holes of more than a bar aren't)
+        step = None
+        if kind == "BAR" and index.nunique() > 1:
+            step = np.diff(index.unique().sort_values().values).min()
+        coverage.add_index(symbol, kind, index, step)
+
     return True
 
 
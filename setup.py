@@ -61,6 +61,6 @@ setup(
     include_package_data=True,
     package_data={
         'static': ['qtpylib/_webapp/*'],
-        'db': ['qtpylib/schema.sql*']
+        'db': ['qtpylib/schema.sql*', 'qtpylib/schema_partitioned.sql']
     },
 )